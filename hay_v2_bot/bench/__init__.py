@@ -0,0 +1 @@
+"""Бенчмарки на собственном корпусе (запуск: python -m hay_v2_bot.bench.<модуль> --help)."""
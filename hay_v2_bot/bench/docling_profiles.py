@@ -0,0 +1,47 @@
+"""
+Бенчмарк профилей конвертации Docling: время, пиковая память, число чанков и объём текста для каждого
+профиля, плюс профиль, который выбрал бы автоматический режим.
+
+  python -m hay_v2_bot.bench.docling_profiles docs/*.pdf docs/*.docx
+
+При DOCLING_MEMORY_BUDGET_MB > 0 конвертация идёт в изолированном процессе, и время первого файла
+включает загрузку моделей в нём; для чистого замера времени — DOCLING_MEMORY_BUDGET_MB=0.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from hay_v2_bot.components.docling_loader import ConversionError, docling_path_to_documents
+from hay_v2_bot.components.docling_profiles import PROFILES, get_converter, select_profile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение профилей Docling fast/balanced/full на своих файлах")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    args = parser.parse_args(argv)
+    profiles = [p for p in args.profiles.split(",") if p]
+
+    # Прогрев: загрузка моделей не должна попадать в замер первого файла
+    for profile in profiles:
+        get_converter(profile)
+
+    print("file\tauto\tprofile\tseconds\tpeak_mb\tchunks\tchars\terror")
+    for path in args.files:
+        name = Path(path).name
+        auto, reason = select_profile(path, name, forced="auto")
+        for profile in profiles:
+            t0 = time.perf_counter()
+            try:
+                docs, error = docling_path_to_documents(path, user_id="bench", filename=name, profile=profile), ""
+            except ConversionError as e:
+                docs, error = [], str(e)
+            seconds = time.perf_counter() - t0
+            chars = sum(len(d.content or "") for d in docs)
+            peak = docs[0].meta.get("peak_rss_mb", 0) if docs else 0
+            print(f"{name}\t{auto} ({reason})\t{profile}\t{seconds:.2f}\t{peak:.0f}\t{len(docs)}\t{chars}\t{error[:60]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Бенчмарк бэкендов эмбеддингов: OpenAI (через прокси) против локальной модели на CPU.
+
+Корпус — наши файлы (через Docling-лоадер). Запрос — первое предложение случайного чанка, релевантный
+документ — сам этот чанк: recall@k показывает, находит ли бэкенд источник запроса в top-k. Дополнительно
+для каждого бэкенда считается пересечение его top-k с top-k эталонного бэкенда (первого в --backends).
+Меряются пропускная способность эмбеддинга корпуса и латентность эмбеддинга одного запроса.
+
+  python -m hay_v2_bot.bench.embedding_backends docs/*.pdf --backends openai,local --k 10
+"""
+
+import argparse
+import random
+import re
+import time
+
+import numpy as np
+from haystack import Document
+
+from hay_v2_bot.bench.embedding_settings import _load_corpus, _percentile
+from hay_v2_bot.components.embedders import get_doc_embedder, get_text_embedder
+from hay_v2_bot.components.vectors import LocalVectorIndex
+
+
+def _sample_queries(texts: list[str], n: int, seed: int) -> list[tuple[int, str]]:
+    """(индекс чанка-источника, запрос); слишком короткие первые предложения пропускаются."""
+    rnd = random.Random(seed)
+    out = []
+    for i in rnd.sample(range(len(texts)), len(texts)):
+        query = re.split(r"(?<=[.!?])\s+", texts[i].strip())[0][:300]
+        if len(query) >= 20:
+            out.append((i, query))
+        if len(out) >= n:
+            break
+    return out
+
+
+def run_backend(backend: str, texts: list[str], queries: list[str]) -> dict:
+    doc_embedder = get_doc_embedder(backend=backend)
+    text_embedder = get_text_embedder(backend=backend)
+    # Прогрев: загрузка модели (local) и соединение с прокси (openai) не входят в замер
+    text_embedder.run(text="прогрев")
+
+    t0 = time.perf_counter()
+    out = doc_embedder.run(documents=[Document(content=t) for t in texts])
+    corpus_seconds = time.perf_counter() - t0
+    corpus = np.asarray([d.embedding for d in out["documents"]], dtype=np.float32)
+
+    latencies, vectors = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        vectors.append(text_embedder.run(text=q)["embedding"])
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return {
+        "version": doc_embedder.version,
+        "corpus": corpus,
+        "queries": np.asarray(vectors, dtype=np.float32),
+        "corpus_seconds": corpus_seconds,
+        "latencies": latencies,
+    }
+
+
+def _top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> list[list[str]]:
+    index = LocalVectorIndex("float32")
+    index.add([str(i) for i in range(len(corpus))], corpus)
+    return [[doc_id for doc_id, _ in index.search(q, k)] for q in queries]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Латентность / пропускная способность / recall@k бэкендов эмбеддингов")
+    parser.add_argument("files", nargs="+", help="Файлы корпуса (PDF, DOCX и т.д.)")
+    parser.add_argument("--backends", default="openai,local", help="Бэкенды через запятую; первый — эталон для пересечения top-k")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-queries", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    backends = [b for b in args.backends.split(",") if b]
+    texts = _load_corpus(args.files)
+    if not texts:
+        raise SystemExit("Корпус пуст: Docling не извлёк текст из файлов")
+    sampled = _sample_queries(texts, args.n_queries, args.seed)
+    sources = [str(i) for i, _ in sampled]
+    queries = [q for _, q in sampled]
+    print(f"[bench] chunks={len(texts)} queries={len(queries)} k={args.k}")
+
+    reference = None
+    rows = []
+    for backend in backends:
+        result = run_backend(backend, texts, queries)
+        found = _top_k(result["corpus"], result["queries"], args.k)
+        reference = reference or found
+        recall = [source in ids for source, ids in zip(sources, found)]
+        overlap = [len(set(ids) & set(ref)) / max(1, len(ref)) for ids, ref in zip(found, reference)]
+        rows.append(
+            {
+                "backend": result["version"],
+                "dim": result["corpus"].shape[1],
+                f"recall@{args.k}": float(np.mean(recall)) if recall else 0.0,
+                f"overlap@{args.k}": float(np.mean(overlap)) if overlap else 0.0,
+                "corpus_emb_per_s": len(texts) / result["corpus_seconds"] if result["corpus_seconds"] > 0 else 0.0,
+                "query_p50_ms": _percentile(result["latencies"], 50),
+                "query_p95_ms": _percentile(result["latencies"], 95),
+            }
+        )
+
+    header = list(rows[0].keys())
+    print("\t".join(header))
+    for row in rows:
+        print("\t".join(f"{v:.4f}" if isinstance(v, float) else str(v) for v in row.values()))
+
+
+if __name__ == "__main__":
+    main()
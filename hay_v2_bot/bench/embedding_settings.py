@@ -0,0 +1,136 @@
+"""
+Бенчмарк настроек эмбеддингов: размерность × формат локального хранения.
+
+Корпус — наши файлы (через Docling-лоадер). Эмбеддинги считаются один раз на полной размерности,
+укороченные варианты получаются обрезкой + нормализацией (так работает dimensions у text-embedding-3).
+Эталон — точный поиск float32 на полной размерности; для каждой настройки меряются recall@k,
+латентность поиска и объём хранения.
+
+  python -m hay_v2_bot.bench.embedding_settings docs/*.pdf --dims 1536,1024,512,256 --k 10
+"""
+
+import argparse
+import random
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+from haystack import Document
+
+from hay_v2_bot.components.docling_loader import ConversionError, docling_path_to_documents
+from hay_v2_bot.components.embedders import MODEL_MAX_DIM, get_doc_embedder, get_text_embedder
+from hay_v2_bot.components.vectors import DTYPES, LocalVectorIndex, truncate_embeddings
+from hay_v2_bot.config import EMBEDDING_MODEL
+
+
+def _load_corpus(paths: list[str]) -> list[str]:
+    texts = []
+    for path in paths:
+        try:
+            docs = docling_path_to_documents(path, user_id="bench", filename=Path(path).name)
+        except ConversionError as e:
+            print(f"[WARN] {e}")
+            continue
+        texts.extend(d.content for d in docs if d.content)
+    return texts
+
+
+def _sample_queries(texts: list[str], n: int, seed: int) -> list[str]:
+    """Без файла запросов берём первое предложение случайных чанков — вопрос «о чём-то из корпуса»."""
+    rnd = random.Random(seed)
+    picked = rnd.sample(texts, min(n, len(texts)))
+    return [re.split(r"(?<=[.!?])\s+", t.strip())[0][:300] for t in picked]
+
+
+def _embed(texts: list[str], cache: Path | None, full_dim: int) -> tuple[np.ndarray, np.ndarray | None]:
+    if cache and cache.exists():
+        data = np.load(cache)
+        return data["corpus"], data["queries"] if "queries" in data else None
+    # Укорачивание векторов — свойство моделей OpenAI, бенчмарк всегда идёт через этот бэкенд
+    embedder = get_doc_embedder(dimensions=full_dim, backend="openai")
+    out = embedder.run(documents=[Document(content=t) for t in texts])
+    return np.asarray([d.embedding for d in out["documents"]], dtype=np.float32), None
+
+
+def _percentile(values: list[float], p: float) -> float:
+    return float(np.percentile(values, p)) if values else 0.0
+
+
+def run_benchmark(corpus: np.ndarray, queries: np.ndarray, dims: list[int], dtypes: list[str], k: int) -> list[dict]:
+    ids = [str(i) for i in range(len(corpus))]
+    truth_index = LocalVectorIndex("float32")
+    truth_index.add(ids, corpus)
+    truth = [{doc_id for doc_id, _ in truth_index.search(q, k)} for q in queries]
+
+    rows = []
+    for dim in dims:
+        corpus_d = truncate_embeddings(corpus, dim)
+        queries_d = truncate_embeddings(queries, dim)
+        for dtype in dtypes:
+            index = LocalVectorIndex(dtype)
+            index.add(ids, corpus_d)
+            recalls, latencies = [], []
+            for q, expected in zip(queries_d, truth):
+                t0 = time.perf_counter()
+                found = {doc_id for doc_id, _ in index.search(q, k)}
+                latencies.append((time.perf_counter() - t0) * 1000)
+                recalls.append(len(found & expected) / max(1, len(expected)))
+            rows.append(
+                {
+                    "dim": dim,
+                    "dtype": dtype,
+                    f"recall@{k}": float(np.mean(recalls)) if recalls else 0.0,
+                    "p50_ms": _percentile(latencies, 50),
+                    "p95_ms": _percentile(latencies, 95),
+                    "local_bytes": index.nbytes,
+                    # Pinecone хранит float32 независимо от локального формата
+                    "pinecone_bytes": len(ids) * dim * 4,
+                }
+            )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall@k / латентность / объём для размерностей и квантования эмбеддингов")
+    parser.add_argument("files", nargs="+", help="Файлы корпуса (PDF, DOCX и т.д.)")
+    parser.add_argument("--dims", default="1536,1024,768,512,256")
+    parser.add_argument("--dtypes", default=",".join(DTYPES))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", help="Файл с запросами, по одному в строке (по умолчанию — выборка из корпуса)")
+    parser.add_argument("--n-queries", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", help="npz-кэш эмбеддингов корпуса и запросов, чтобы не платить за повторный прогон")
+    args = parser.parse_args(argv)
+
+    full_dim = MODEL_MAX_DIM.get(EMBEDDING_MODEL, 1536)
+    dims = sorted({int(d) for d in args.dims.split(",") if d}, reverse=True)
+    dims = [d for d in dims if d <= full_dim]
+    dtypes = [d for d in args.dtypes.split(",") if d]
+    cache = Path(args.cache) if args.cache else None
+
+    texts = _load_corpus(args.files)
+    if not texts:
+        raise SystemExit("Корпус пуст: Docling не извлёк текст из файлов")
+    if args.queries:
+        query_texts = [line.strip() for line in Path(args.queries).read_text(encoding="utf-8").splitlines() if line.strip()]
+    else:
+        query_texts = _sample_queries(texts, args.n_queries, args.seed)
+
+    corpus, queries = _embed(texts, cache, full_dim)
+    if queries is None:
+        text_embedder = get_text_embedder(dimensions=full_dim, backend="openai")
+        queries = np.asarray([text_embedder.run(text=q)["embedding"] for q in query_texts], dtype=np.float32)
+        if cache:
+            np.savez(cache, corpus=corpus, queries=queries)
+
+    print(f"[bench] model={EMBEDDING_MODEL} chunks={len(corpus)} queries={len(queries)} k={args.k}")
+    rows = run_benchmark(corpus, queries, dims, dtypes, args.k)
+    header = list(rows[0].keys())
+    print("\t".join(header))
+    for row in rows:
+        print("\t".join(f"{v:.4f}" if isinstance(v, float) else str(v) for v in row.values()))
+
+
+if __name__ == "__main__":
+    main()
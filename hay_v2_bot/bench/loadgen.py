@@ -0,0 +1,408 @@
+"""
+Нагрузочный тест пути сообщения: колбэки register_handlers с локальными заглушками
+Telegram, OpenAI-прокси (эмбеддинги, агент) и Pinecone с настраиваемой искусственной задержкой.
+
+Открытая модель (пуассоновский поток с заданной интенсивностью) или закрытая (N пользователей,
+каждый ждёт ответа и «думает»), либо воспроизведение записанной трассы. Для каждой ступени
+нагрузки — p50/p95/p99 по стадиям и в целом, пропускная способность, доля ошибок; по ступеням
+--rates определяется точка насыщения.
+
+  python -m hay_v2_bot.bench.loadgen --rates 1,2,4,8,16 --duration 30 --bot-threads 2
+  python -m hay_v2_bot.bench.loadgen --trace trace.jsonl --speed 2
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from haystack import Document
+from haystack.dataclasses import ChatMessage
+
+from hay_v2_bot.bot.handlers import register_handlers
+from hay_v2_bot.components import FileCatalog, OfflineDocumentStore, OfflineEmbeddingRetriever, SimulatedLatency
+from hay_v2_bot.jobs import JobQueue
+
+_DIM = 256
+_ERROR_PREFIX = "Произошла ошибка"
+
+
+class StageRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def reset(self) -> dict[str, list[float]]:
+        with self._lock:
+            samples, self.samples = self.samples, {}
+        return samples
+
+
+def _fake_vector(text: str) -> list[float]:
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+    return np.random.default_rng(seed).standard_normal(_DIM).astype(np.float32).tolist()
+
+
+class FakeTextEmbedder:
+    def __init__(self, upstream: SimulatedLatency):
+        self.upstream = upstream
+
+    def run(self, text: str) -> dict:
+        return self.upstream.call(lambda: {"embedding": _fake_vector(text)})
+
+
+class FakeDocEmbedder:
+    def __init__(self, upstream: SimulatedLatency):
+        self.upstream = upstream
+
+    def run(self, documents: list[Document]) -> dict:
+        def _embed():
+            for d in documents:
+                d.embedding = _fake_vector(d.content or "")
+            return {"documents": documents}
+        return self.upstream.call(_embed)
+
+
+class FakeChatGenerator:
+    """Один вызов модели без инструментов — ответ бота, когда агент не уложился в дедлайн."""
+
+    def __init__(self, upstream: SimulatedLatency):
+        self.upstream = upstream
+
+    def run(self, messages) -> dict:
+        self.upstream.call()
+        text = messages[-1].text or ""
+        return {"replies": [ChatMessage.from_assistant(f"Ответ без инструментов на: {text[-80:]}")]}
+
+
+class FakeAgent:
+    """Ответ модели; с вероятностью tool_rate — дополнительный шаг с вызовом инструмента."""
+
+    def __init__(self, upstream: SimulatedLatency, tool_upstream: SimulatedLatency, tool_rate: float):
+        self.upstream = upstream
+        self.tool_upstream = tool_upstream
+        self.tool_rate = tool_rate
+        self.chat_generator = FakeChatGenerator(upstream)
+        self.system_prompt = ""
+
+    def run(self, messages, **state) -> dict:
+        self.upstream.call()
+        if random.random() < self.tool_rate:
+            self.tool_upstream.call()
+            self.upstream.call()
+        text = messages[-1].text or ""
+        return {"messages": messages + [ChatMessage.from_assistant(f"Ответ на: {text[-80:]}")]}
+
+
+class FakeTeleBot:
+    """Минимум TeleBot, нужный register_handlers: регистрация обработчиков и отправка сообщений."""
+
+    def __init__(self, upstream: SimulatedLatency, on_reply):
+        self.upstream = upstream
+        self.on_reply = on_reply
+        self.handlers = []
+        self._ids = itertools.count(1)
+
+    def message_handler(self, commands=None, content_types=None, func=None, **kwargs):
+        def decorator(fn):
+            self.handlers.append((commands, content_types or ["text"], func, fn))
+            return fn
+        return decorator
+
+    def dispatch(self, message) -> None:
+        for commands, content_types, func, fn in self.handlers:
+            if message.content_type not in content_types:
+                continue
+            if commands and not any((message.text or "").startswith(f"/{c}") for c in commands):
+                continue
+            if func and not func(message):
+                continue
+            fn(message)
+            return
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.upstream.call()
+        self.on_reply(chat_id, text)
+        return SimpleNamespace(message_id=next(self._ids), chat=SimpleNamespace(id=chat_id), text=text)
+
+    def reply_to(self, message, text, **kwargs):
+        return self.send_message(message.chat.id, text)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.upstream.call()
+
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"n": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    arr = np.asarray(values)
+    return {"n": len(values), "p50": float(np.percentile(arr, 50)), "p95": float(np.percentile(arr, 95)), "p99": float(np.percentile(arr, 99))}
+
+
+class LoadHarness:
+    def __init__(self, args):
+        self.args = args
+        self.recorder = StageRecorder()
+        self._current = threading.local()
+        self._lock = threading.Lock()
+        self.reply_latencies: list[float] = []
+        self.handler_latencies: list[float] = []
+        self.errors = 0
+        self.completed = 0
+        self._msg_ids = itertools.count(1)
+
+        def upstream(name, median_ms, limit=0, errors=True):
+            return SimulatedLatency(
+                median_ms, concurrency=limit, error_rate=args.error_rate if errors else 0.0, name=name, on_call=self.recorder.record
+            )
+
+        self.bot = FakeTeleBot(upstream("telegram", args.telegram_ms, errors=False), on_reply=self._on_reply)
+        self.store = OfflineDocumentStore(
+            write_latency=upstream("store", args.store_ms, args.pinecone_concurrency),
+            query_latency=upstream("retrieve", args.retrieve_ms, args.pinecone_concurrency),
+        )
+        tmp_dir = Path(tempfile.mkdtemp(prefix="hayv2_loadgen_"))
+        register_handlers(
+            bot=self.bot,
+            document_store=self.store,
+            text_embedder=FakeTextEmbedder(upstream("embed", args.embed_ms, args.openai_concurrency)),
+            doc_embedder=FakeDocEmbedder(upstream("doc_embed", args.embed_ms, args.openai_concurrency)),
+            retriever=OfflineEmbeddingRetriever(self.store),
+            agent=FakeAgent(
+                upstream("agent", args.agent_ms, args.openai_concurrency),
+                upstream("tool", args.tool_ms, errors=False),
+                args.tool_rate,
+            ),
+            job_queue=JobQueue(tmp_dir / "jobs.sqlite3"),
+            catalog=FileCatalog(tmp_dir / "catalog.sqlite3"),
+        )
+        # Как telebot.TeleBot(threaded=True): обработчики выполняет пул из num_threads потоков
+        self.pool = ThreadPoolExecutor(max_workers=args.bot_threads)
+
+    def _on_reply(self, chat_id, text):
+        arrival = getattr(self._current, "arrival", None)
+        if arrival is None:
+            return
+        with self._lock:
+            # Ошибка сохранения диалога приходит вторым сообщением после ответа
+            if text.startswith(_ERROR_PREFIX) and not self._current.failed:
+                self._current.failed = True
+                self.errors += 1
+            if not self._current.replied:
+                self._current.replied = True
+                self.reply_latencies.append(time.perf_counter() - arrival)
+
+    def _handle(self, message, arrival: float):
+        self._current.arrival = arrival
+        self._current.replied = False
+        self._current.failed = False
+        try:
+            self.bot.dispatch(message)
+        except Exception:
+            with self._lock:
+                if not self._current.failed:
+                    self.errors += 1
+        finally:
+            with self._lock:
+                self.handler_latencies.append(time.perf_counter() - arrival)
+                self.completed += 1
+            self._current.arrival = None
+
+    def submit(self, user_id: int, text: str):
+        message = SimpleNamespace(
+            message_id=next(self._msg_ids),
+            from_user=SimpleNamespace(id=user_id),
+            chat=SimpleNamespace(id=user_id),
+            text=text,
+            content_type="text",
+            document=None,
+            media_group_id=None,
+        )
+        return self.pool.submit(self._handle, message, time.perf_counter())
+
+    def reset(self):
+        with self._lock:
+            self.reply_latencies, self.handler_latencies = [], []
+            self.errors = self.completed = 0
+        self.recorder.reset()
+
+    def collect(self, offered: int, elapsed: float, offered_rate: float) -> dict:
+        stages = self.recorder.reset()
+        with self._lock:
+            completed, errors = self.completed, self.errors
+            overall = _percentiles(self.handler_latencies)
+            reply = _percentiles(self.reply_latencies)
+        return {
+            "offered_rate": offered_rate,
+            "offered": offered,
+            "completed": completed,
+            "throughput": completed / elapsed if elapsed > 0 else 0.0,
+            "error_rate": (errors + offered - completed) / offered if offered else 0.0,
+            "overall": overall,
+            "reply": reply,
+            "stages": {name: _percentiles(values) for name, values in sorted(stages.items())},
+        }
+
+
+def _synthetic_text(rnd: random.Random) -> str:
+    words = ["документ", "раздел", "таблица", "собака", "договор", "отчёт", "порода", "итог", "срок", "сумма"]
+    return " ".join(rnd.choice(words) for _ in range(rnd.randint(3, 15))) + "?"
+
+
+def _drain(futures, timeout: float):
+    deadline = time.monotonic() + timeout
+    for fut in futures:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            fut.result(timeout=remaining)
+        except Exception:
+            pass
+
+
+def run_open_loop(harness: LoadHarness, rate: float, duration: float, users: int, seed: int, drain: float) -> dict:
+    rnd = random.Random(seed)
+    harness.reset()
+    futures = []
+    t0 = time.perf_counter()
+    next_at = 0.0
+    while next_at < duration:
+        delay = t0 + next_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(harness.submit(rnd.randint(1, users), _synthetic_text(rnd)))
+        next_at += rnd.expovariate(rate)
+    _drain(futures, drain)
+    return harness.collect(len(futures), time.perf_counter() - t0, rate)
+
+
+def run_closed_loop(harness: LoadHarness, users: int, duration: float, think: float, seed: int, drain: float) -> dict:
+    harness.reset()
+    stop_at = time.perf_counter() + duration
+    sent = []
+
+    def _user(uid: int):
+        rnd = random.Random(seed + uid)
+        while time.perf_counter() < stop_at:
+            fut = harness.submit(uid, _synthetic_text(rnd))
+            sent.append(fut)
+            fut.result()
+            if think:
+                time.sleep(rnd.expovariate(1 / think))
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=_user, args=(uid,), daemon=True) for uid in range(1, users + 1)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(duration + drain)
+    elapsed = time.perf_counter() - t0
+    return harness.collect(len(sent), elapsed, len(sent) / elapsed if elapsed else 0.0)
+
+
+def run_trace(harness: LoadHarness, path: str, speed: float, drain: float) -> dict:
+    """Трасса JSONL: {"t": секунды от начала, "user_id": ..., "text": ...} на строку."""
+    events = [json.loads(line) for line in Path(path).read_text(encoding="utf-8").splitlines() if line.strip()]
+    events.sort(key=lambda e: e.get("t", 0))
+    harness.reset()
+    futures = []
+    t0 = time.perf_counter()
+    for event in events:
+        delay = t0 + event.get("t", 0) / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(harness.submit(int(event["user_id"]), event["text"]))
+    span = (events[-1].get("t", 0) / speed) if events else 0.0
+    _drain(futures, drain)
+    return harness.collect(len(futures), time.perf_counter() - t0, len(events) / span if span else 0.0)
+
+
+def print_report(result: dict) -> None:
+    o = result["overall"]
+    print(
+        f"\n== offered={result['offered_rate']:.2f} msg/s sent={result['offered']} done={result['completed']} "
+        f"throughput={result['throughput']:.2f} msg/s errors={result['error_rate']:.1%}"
+    )
+    print(f"{'stage':<12}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = [("overall", o), ("reply", result["reply"])] + list(result["stages"].items())
+    for name, p in rows:
+        print(f"{name:<12}{p['n']:>7}{p['p50']:>9.3f}{p['p95']:>9.3f}{p['p99']:>9.3f}")
+
+
+def find_saturation(results: list[dict], slo_p95: float) -> dict | None:
+    """Первая ступень, где пропускная способность отстала от подаваемой нагрузки или p95 вышел за SLO."""
+    for r in results:
+        if r["throughput"] < 0.9 * r["offered_rate"] or r["overall"]["p95"] > slo_p95:
+            return r
+    return None
+
+
+def _rates(value: str) -> list[float]:
+    try:
+        rates = [float(r) for r in value.split(",") if r.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидаются числа через запятую: {value!r}") from None
+    if not rates or any(r <= 0 for r in rates):
+        raise argparse.ArgumentTypeError(f"нужна хотя бы одна положительная интенсивность: {value!r}")
+    return rates
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Нагрузочный тест пути сообщения с локальными заглушками")
+    p.add_argument("--rates", type=_rates, default="1,2,4,8", help="Ступени открытой нагрузки, сообщений/с")
+    p.add_argument("--users", type=int, default=50, help="Число пользователей (для закрытой модели — параллельных)")
+    p.add_argument("--closed", action="store_true", help="Закрытая модель: --users параллельных пользователей")
+    p.add_argument("--think", type=float, default=1.0, help="Среднее время «раздумий» в закрытой модели, с")
+    p.add_argument("--trace", help="Воспроизвести записанную трассу (JSONL)")
+    p.add_argument("--speed", type=float, default=1.0, help="Ускорение трассы")
+    p.add_argument("--duration", type=float, default=20.0)
+    p.add_argument("--drain", type=float, default=60.0, help="Сколько ждать хвост очереди после ступени, с")
+    p.add_argument("--bot-threads", type=int, default=2, help="Потоки обработчиков (у TeleBot по умолчанию 2)")
+    p.add_argument("--embed-ms", type=float, default=150)
+    p.add_argument("--retrieve-ms", type=float, default=120)
+    p.add_argument("--agent-ms", type=float, default=1500)
+    p.add_argument("--tool-ms", type=float, default=800)
+    p.add_argument("--tool-rate", type=float, default=0.1)
+    p.add_argument("--store-ms", type=float, default=100)
+    p.add_argument("--telegram-ms", type=float, default=80)
+    p.add_argument("--openai-concurrency", type=int, default=0, help="Лимит параллельных запросов к прокси OpenAI (0 — без лимита)")
+    p.add_argument("--pinecone-concurrency", type=int, default=0)
+    p.add_argument("--error-rate", type=float, default=0.0, help="Доля искусственных ошибок апстримов")
+    p.add_argument("--slo-p95", type=float, default=5.0, help="Порог p95 для точки насыщения, с")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args(argv)
+
+    harness = LoadHarness(args)
+    if args.trace:
+        print_report(run_trace(harness, args.trace, args.speed, args.drain))
+        return
+    if args.closed:
+        print_report(run_closed_loop(harness, args.users, args.duration, args.think, args.seed, args.drain))
+        return
+    results = []
+    for i, rate in enumerate(args.rates):
+        result = run_open_loop(harness, rate, args.duration, args.users, args.seed + i, args.drain)
+        print_report(result)
+        results.append(result)
+    saturated = find_saturation(results, args.slo_p95)
+    if saturated:
+        print(f"\nТочка насыщения: ~{saturated['offered_rate']:.2f} msg/s (throughput {saturated['throughput']:.2f}, p95 {saturated['overall']['p95']:.2f}s)")
+    else:
+        print(f"\nНасыщение не достигнуто до {results[-1]['offered_rate']:.2f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Пакетная загрузка в Telegram: распаковка ZIP, сбор альбома (media group),
+одно сообщение о прогрессе, которое редактируется на месте.
+"""
+
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+from hay_v2_bot.config import BULK_MAX_FILES, BULK_MAX_ARCHIVE_BYTES, BULK_MEDIA_GROUP_DELAY
+
+ARCHIVE_SUFFIXES = {".zip"}
+# Форматы, которые понимает Docling
+SUPPORTED_SUFFIXES = {".pdf", ".docx", ".pptx", ".xlsx", ".html", ".htm", ".md", ".csv", ".adoc", ".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+
+
+def short_error(e: Exception) -> str:
+    # Обрезаем сообщение об ошибке для Telegram (лимит 4096 символов)
+    error_msg = str(e)
+    if len(error_msg) > 4000:
+        error_msg = error_msg[:4000] + "\n... (сообщение обрезано)"
+    return error_msg
+
+
+def is_archive(filename: str) -> bool:
+    return Path(filename).suffix.lower() in ARCHIVE_SUFFIXES
+
+
+def extract_archive(
+    archive,
+    dest_dir: str,
+    max_files: int = BULK_MAX_FILES,
+    max_total_bytes: int = BULK_MAX_ARCHIVE_BYTES,
+) -> list[tuple[str, str]]:
+    """Распаковывает поддерживаемые файлы из ZIP (путь или file-like). Возвращает список (путь, имя файла внутри архива)."""
+    dest = Path(dest_dir).resolve()
+    out = []
+    total = 0
+    too_big = f"Распакованный архив больше {max_total_bytes // (1024 * 1024)} МБ"
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or Path(name).name.startswith("."):
+                    continue
+                if Path(name).suffix.lower() not in SUPPORTED_SUFFIXES:
+                    continue
+                if len(out) >= max_files:
+                    raise ValueError(f"В архиве больше {max_files} файлов")
+                # Размер из заголовка — только быстрый отказ: он задаётся автором архива, поэтому ниже
+                # считаются реально записанные байты
+                if total + info.file_size > max_total_bytes:
+                    raise ValueError(too_big)
+                # Плоская раскладка: защищает от путей вида ../../ (zip slip) и одинаковых имён в разных папках
+                target = dest / f"{len(out):04d}_{Path(name).name}"
+                out.append((str(target), name))
+                with zf.open(info) as src, open(target, "wb") as dst:
+                    while True:
+                        block = src.read(1024 * 1024)
+                        if not block:
+                            break
+                        total += len(block)
+                        if total > max_total_bytes:
+                            raise ValueError(too_big)
+                        dst.write(block)
+    except BaseException:
+        # Частично распакованное не оставляем: вызывающий код получает либо все файлы, либо ошибку
+        for path, _ in out:
+            Path(path).unlink(missing_ok=True)
+        raise
+    return out
+
+
+class MediaGroupCollector:
+    """
+    Копит сообщения одного альбома (media_group_id): Telegram присылает каждый файл отдельным апдейтом.
+    Когда новых файлов нет дольше delay секунд, вызывает on_complete(messages) в отдельном потоке.
+    """
+
+    def __init__(self, on_complete, delay: float = BULK_MEDIA_GROUP_DELAY):
+        self.on_complete = on_complete
+        self.delay = delay
+        self._groups: dict[str, list] = {}
+        self._timers: dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+
+    def add(self, message) -> None:
+        group_id = str(message.media_group_id)
+        with self._lock:
+            self._groups.setdefault(group_id, []).append(message)
+            timer = self._timers.get(group_id)
+            if timer:
+                timer.cancel()
+            timer = threading.Timer(self.delay, self._flush, args=(group_id,))
+            timer.daemon = True
+            self._timers[group_id] = timer
+            timer.start()
+
+    def _flush(self, group_id: str) -> None:
+        with self._lock:
+            messages = self._groups.pop(group_id, [])
+            self._timers.pop(group_id, None)
+        if messages:
+            self.on_complete(messages)
+
+
+class ProgressMessage:
+    """Одно сообщение о ходе обработки: отправляется один раз и дальше редактируется (не чаще min_interval)."""
+
+    def __init__(self, bot, chat_id, text: str, min_interval: float = 2.0, message_id: int | None = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self._last_text = text
+        self._last_edit = 0.0
+        if message_id is None:
+            message_id = bot.send_message(chat_id, text).message_id
+        self.message_id = message_id
+
+    def update(self, text: str, force: bool = False) -> None:
+        now = time.monotonic()
+        if text == self._last_text or (not force and now - self._last_edit < self.min_interval):
+            return
+        try:
+            self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id)
+            self._last_text = text
+            self._last_edit = now
+        except Exception as e:
+            # "message is not modified" и сетевые сбои не должны ронять обработку
+            print(f"[WARN] Не удалось обновить сообщение о прогрессе: {e}")
+
+
+_STAGE_TITLES = {
+    "download": "Скачиваю файлы",
+    "convert": "Разбираю документы",
+    "embed": "Считаю эмбеддинги",
+    "summary": "Готовлю общее резюме",
+}
+
+
+def progress_text(stage: str, done: int, total: int) -> str:
+    return f"{_STAGE_TITLES.get(stage, stage)}: {done}/{total}…"
@@ -0,0 +1,110 @@
+"""
+Скачивание файлов из Telegram с учётом размера.
+
+Лимит проверяется до начала скачивания. Небольшие файлы остаются в памяти и конвертируются
+через Docling DocumentStream; крупные скачиваются потоком во временный файл кусками,
+не держа весь файл в памяти.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+import requests
+from telebot import apihelper
+
+from hay_v2_bot.components import make_document_stream
+from hay_v2_bot.config import MAX_UPLOAD_BYTES, INMEMORY_MAX_BYTES
+
+_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def check_upload_size(file_size: int | None, limit: int = MAX_UPLOAD_BYTES) -> None:
+    if file_size and file_size > limit:
+        raise UploadTooLarge(
+            f"Файл слишком большой: {file_size / (1024 * 1024):.1f} МБ при лимите {limit / (1024 * 1024):.0f} МБ"
+        )
+
+
+class FetchedFile:
+    """Скачанный файл: байты в памяти или путь к временному файлу. Удаляет временный файл в cleanup()."""
+
+    def __init__(self, filename: str, size: int, data: bytes | None = None, path: str | None = None):
+        self.filename = filename
+        self.size = size
+        self.data = data
+        self.path = path
+
+    @property
+    def in_memory(self) -> bool:
+        return self.data is not None
+
+    @property
+    def source(self):
+        """Источник для DoclingLoader: новый DocumentStream (поток читается один раз) или путь."""
+        return make_document_stream(self.data, self.filename) if self.in_memory else self.path
+
+    def cleanup(self) -> None:
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except Exception:
+                pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+def _file_url(bot, file_path: str) -> str:
+    if apihelper.FILE_URL is None:
+        return f"https://api.telegram.org/file/bot{bot.token}/{file_path}"
+    return apihelper.FILE_URL.format(bot.token, file_path)
+
+
+def _stream_to_disk(bot, file_path: str, filename: str, limit: int) -> tuple[str, int]:
+    suffix = Path(filename).suffix or ".bin"
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix, prefix="hayv2_")
+    size = 0
+    try:
+        with requests.get(_file_url(bot, file_path), stream=True, timeout=(10, 120), proxies=apihelper.proxy) as r:
+            r.raise_for_status()
+            with os.fdopen(fd, "wb") as f:
+                for block in r.iter_content(chunk_size=_CHUNK_BYTES):
+                    size += len(block)
+                    # Telegram мог не сообщить размер заранее — проверяем по ходу
+                    check_upload_size(size, limit)
+                    f.write(block)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except Exception:
+            pass
+        raise
+    return tmp_path, size
+
+
+def fetch_telegram_file(
+    bot,
+    file_id: str,
+    filename: str,
+    file_size: int | None = None,
+    limit: int = MAX_UPLOAD_BYTES,
+    inmemory_max: int = INMEMORY_MAX_BYTES,
+) -> FetchedFile:
+    check_upload_size(file_size, limit)
+    tg_file = bot.get_file(file_id)
+    size = file_size or tg_file.file_size
+    check_upload_size(size, limit)
+    if size is not None and size <= inmemory_max:
+        data = bot.download_file(tg_file.file_path)
+        return FetchedFile(filename, len(data), data=data)
+    path, size = _stream_to_disk(bot, tg_file.file_path, filename, limit)
+    return FetchedFile(filename, size, path=path)
@@ -1,12 +1,40 @@
-import os
 import time
-import tempfile
-from pathlib import Path
+from datetime import datetime
+from functools import partial
 
 import telebot
 from haystack.dataclasses import ChatMessage
 
-from hay_v2_bot.pipelines import get_context_for_user, build_file_summary, get_document_texts_for_summary
+from hay_v2_bot.components import (
+    AbandonableRunner,
+    Deadline,
+    DeadlineExceeded,
+    FileCatalog,
+    Hedger,
+    OutlineStore,
+    PipelinedDocumentWriter,
+    QuotaExceeded,
+    RecentDialogCache,
+    TailStats,
+    delete_ids_batched,
+    run_with_deadline,
+)
+from hay_v2_bot.config import AGENT_FALLBACK_SECONDS, MESSAGE_DEADLINE_SECONDS, RETRIEVAL_BUDGET_SECONDS
+from hay_v2_bot.pipelines import get_context_for_user
+from hay_v2_bot.bot.bulk import MediaGroupCollector, ProgressMessage, is_archive
+from hay_v2_bot.bot.downloads import UploadTooLarge, check_upload_size
+from hay_v2_bot.jobs import JobQueue
+
+
+def _answer_without_tools(agent, messages: list[ChatMessage], timeout: float) -> str:
+    """Один вызов модели агента без инструментов и без шагов агента."""
+    generator = getattr(agent, "chat_generator", None)
+    if generator is None:
+        raise DeadlineExceeded("у агента нет генератора для ответа без инструментов")
+    system_prompt = getattr(agent, "system_prompt", None)
+    prompt = ([ChatMessage.from_system(system_prompt)] if system_prompt else []) + messages
+    replies = run_with_deadline(generator.run, timeout, messages=prompt).get("replies") or []
+    return replies[-1].text if replies else ""
 
 
 def register_handlers(
@@ -16,61 +44,141 @@ def register_handlers(
     doc_embedder,
     retriever,
     agent,
-    ingestion_pipeline,
+    job_queue: JobQueue | None = None,
+    hot_cache: RecentDialogCache | None = None,
+    catalog: FileCatalog | None = None,
     logger=None,
 ):
     log = logger or (lambda msg: None)
+    job_queue = job_queue or JobQueue()
+    hot_cache = hot_cache if hot_cache is not None else RecentDialogCache()
+    writer = PipelinedDocumentWriter(document_store=document_store, embedder=doc_embedder, logger=log)
+    catalog = catalog if catalog is not None else FileCatalog()
+    outlines = OutlineStore()
+    hedger = Hedger()
+    agent_runner = AbandonableRunner()
+    tail = TailStats(hedger, logger=log)
 
     @bot.message_handler(commands=["start"])
     def cmd_start(message):
         bot.reply_to(
             message,
-            "Привет! Я помощник с доступом к твоим документам: загружай PDF или DOCX — я сохраню контент и смогу отвечать по ним. Также могу рассказать факт о собаках или показать случайную собаку с описанием породы. Напиши что-нибудь или пришли файл.",
+            "Привет! Я помощник с доступом к твоим документам: загружай PDF или DOCX — я сохраню контент и смогу отвечать по ним. Также могу рассказать факт о собаках или показать случайную собаку с описанием породы. Напиши что-нибудь или пришли файл.\n\n/files — мои файлы\n/forget <файл> — удалить файл из памяти",
         )
 
+    @bot.message_handler(commands=["files"])
+    def cmd_files(message):
+        user_id = message.from_user.id
+        files = catalog.files(str(user_id))
+        if not files:
+            bot.reply_to(message, "Загруженных файлов нет.")
+            return
+        usage = catalog.usage(str(user_id))
+        lines = [f"Файлов: {usage['files']}, {usage['bytes'] / (1024 * 1024):.1f} МБ, фрагментов в индексе: {usage['chunks']}"]
+        for f in files:
+            date = datetime.fromtimestamp(f["updated_at"]).strftime("%d.%m.%Y %H:%M")
+            if f["kind"] == "bundle":
+                count = f" из {len(f['members'])} файлов" if f["members"] else ""
+                lines.append(f"• {f['filename']} — резюме пакета{count}, {date}")
+            else:
+                lines.append(f"• {f['filename']} — {f['size_bytes'] / 1024:.0f} КБ, фрагментов {f['chunk_count']}, {date}")
+        bot.reply_to(message, "\n".join(lines)[:4000])
+
+    @bot.message_handler(commands=["forget"])
+    def cmd_forget(message):
+        user_id = str(message.from_user.id)
+        name = (message.text or "").partition(" ")[2].strip()
+        if not name:
+            bot.reply_to(message, "Укажи файл: /forget <имя файла или его часть>. Список — /files.")
+            return
+        matches = catalog.find(user_id, name)
+        if not matches:
+            bot.reply_to(message, f"Файл «{name}» не найден. Список — /files.")
+            return
+        if len(matches) > 1:
+            bot.reply_to(message, "Подходит несколько файлов, уточни имя:\n" + "\n".join(f"• {m}" for m in matches[:20]))
+            return
+        filename = matches[0]
+        # Пакет удаляется вместе со своими файлами: одно резюме без чанков файлов ничего бы не «забыло»
+        members = catalog.members(user_id, filename)
+        t0 = time.perf_counter()
+        deleted = 0
+        try:
+            for name in [filename] + members:
+                # Удаление по ID из каталога пачками, без сканирования индекса по фильтру
+                deleted += delete_ids_batched(document_store, catalog.vector_ids(user_id, name))
+                outlines.delete(user_id, name)
+                catalog.remove(user_id, name)
+        except Exception as e:
+            log(f"[forget] user_id={user_id} filename={filename} error: {e}")
+            bot.reply_to(message, f"Не удалось удалить «{filename}»: {e}")
+            return
+        log(f"[forget] user_id={user_id} filename={filename} members={len(members)} deleted={deleted} in {time.perf_counter() - t0:.2f}s")
+        if members:
+            listing = "\n".join(f"• {m}" for m in members[:20]) + (f"\n… и ещё {len(members) - 20}" if len(members) > 20 else "")
+            bot.reply_to(message, f"Удалил пакет «{filename}» и его файлы ({deleted} фрагментов):\n{listing}"[:4000])
+        else:
+            bot.reply_to(message, f"Удалил «{filename}» ({deleted} фрагментов).")
+
+    def enqueue(kind: str, chat_id, user_id, refs: list[dict], bundle_name: str, text: str) -> int:
+        """Ставит задачу индексации в очередь; обработку делает ingest-worker."""
+        progress = ProgressMessage(bot, chat_id, text)
+        payload = {
+            "chat_id": chat_id,
+            "user_id": str(user_id),
+            "message_id": progress.message_id,
+            "bundle_name": bundle_name,
+            "files": refs,
+        }
+        job_id = job_queue.enqueue(kind, payload)
+        log(f"[file] user_id={user_id} queued job_id={job_id} kind={kind} files={len(refs)}")
+        return job_id
+
+    def _ref(doc) -> dict:
+        return {"file_id": doc.file_id, "filename": doc.file_name or "document", "file_size": doc.file_size}
+
+    def on_media_group(messages):
+        first = messages[0]
+        refs = [_ref(m.document) for m in messages if m.document]
+        # Квота — на весь альбом сразу: по отдельности каждый файл прошёл бы в последний свободный слот
+        try:
+            catalog.check_quota_many(
+                str(first.from_user.id),
+                [(ref["filename"], ref["file_size"]) for ref in refs],
+                pending=job_queue.pending_uploads(str(first.from_user.id)),
+            )
+        except QuotaExceeded as e:
+            log(f"[file] user_id={first.from_user.id} media group of {len(refs)} rejected: {e}")
+            bot.reply_to(first, str(e))
+            return
+        bundle_name = refs[0]["filename"] if len(refs) == 1 else f"{refs[0]['filename']} и ещё {len(refs) - 1}"
+        enqueue("bundle", first.chat.id, first.from_user.id, refs, bundle_name, f"Получено файлов: {len(refs)}. Поставил в очередь на обработку…")
+
+    media_groups = MediaGroupCollector(on_complete=on_media_group)
+
     @bot.message_handler(content_types=["document"])
     def on_document(message):
         user_id = message.from_user.id
         chat_id = message.chat.id
         doc = message.document
-        file_id = doc.file_id
         filename = doc.file_name or "document"
-        log(f"[file] user_id={user_id} filename={filename} file_id={file_id}")
-        bot.send_message(
-            chat_id,
-            "Файл получен. Запускаю анализ и сохранение. Это может занять немного времени…",
-        )
+        log(f"[file] user_id={user_id} filename={filename} file_id={doc.file_id}")
+        # Лимит размера проверяем до постановки в очередь и до любого скачивания
         try:
-            tg_file = bot.get_file(file_id)
-            data = bot.download_file(tg_file.file_path)
-            suffix = Path(filename).suffix or ".bin"
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, prefix="hayv2_") as f:
-                f.write(data)
-                tmp_path = f.name
-            try:
-                ingestion_pipeline.run(
-                    {"loader": {"paths": [tmp_path], "user_id": str(user_id), "filename": filename}}
-                )
-                texts = get_document_texts_for_summary(tmp_path)
-                summary = build_file_summary(texts)
-            finally:
-                try:
-                    os.unlink(tmp_path)
-                except Exception:
-                    pass
-            bot.send_message(
-                chat_id,
-                "Готово. Я изучил этот файл, теперь можем его обсудить.",
-            )
-            bot.send_message(chat_id, summary)
-            log(f"[file] user_id={user_id} filename={filename} done, summary_len={len(summary)}")
-        except Exception as e:
-            log(f"[file] user_id={user_id} error: {e}")
-            # Обрезаем сообщение об ошибке для Telegram (лимит 4096 символов)
-            error_msg = str(e)
-            if len(error_msg) > 4000:
-                error_msg = error_msg[:4000] + "\n... (сообщение обрезано)"
-            bot.send_message(chat_id, f"Ошибка при обработке файла: {error_msg}")
+            check_upload_size(doc.file_size)
+            # Квота — тоже до очереди: файл сверх квоты не скачивается и не конвертируется.
+            # Файлы альбома проверяются вместе в on_media_group, файлы из очереди учитываются как уже занятые
+            if not message.media_group_id:
+                catalog.check_quota(str(user_id), filename, doc.file_size, pending=job_queue.pending_uploads(str(user_id)))
+        except (UploadTooLarge, QuotaExceeded) as e:
+            log(f"[file] user_id={user_id} filename={filename} rejected: {e}")
+            bot.reply_to(message, str(e))
+            return
+        if message.media_group_id:
+            media_groups.add(message)
+            return
+        kind = "bundle" if is_archive(filename) else "file"
+        enqueue(kind, chat_id, user_id, [_ref(doc)], filename, "Файл получен и поставлен в очередь на анализ. Это может занять немного времени…")
 
     @bot.message_handler(func=lambda m: True)
     def on_message(message):
@@ -79,28 +187,61 @@ def register_handlers(
         text = (message.text or "").strip()
         if not text:
             return
+        deadline = Deadline(MESSAGE_DEADLINE_SECONDS)
+        # Промахи дедлайна этого хода: embed_timeout, retrieve_skipped, agent_skipped, agent_timeout, fallback_timeout, store_late
+        events: list[str] = []
         t0 = time.perf_counter()
         log(f"[run] user_id={user_id} chat_id={chat_id} query_len={len(text)} query={text[:80]!r}...")
         try:
-            embedded = text_embedder.run(text=text)
-            query_emb = embedded.get("embedding")
-            if query_emb is not None and isinstance(query_emb, list) and len(query_emb) > 0:
-                vec = query_emb[0] if isinstance(query_emb[0], list) else query_emb
-            else:
-                vec = None
+            # Эмбеддинг и поиск не трогают резерв AGENT_FALLBACK_SECONDS: без контекста ответить можно, без времени — нет
+            vec = None
+            try:
+                embedded = hedger.call("embed", partial(text_embedder.run, text=text), timeout=deadline.budget(reserve=AGENT_FALLBACK_SECONDS))
+                query_emb = embedded.get("embedding")
+                if query_emb is not None and isinstance(query_emb, list) and len(query_emb) > 0:
+                    vec = query_emb[0] if isinstance(query_emb[0], list) else query_emb
+            except DeadlineExceeded:
+                events.append("embed_timeout")
             t1 = time.perf_counter()
-            log(f"[run] user_id={user_id} embed done in {t1 - t0:.2f}s")
-            context_str = get_context_for_user(retriever, str(user_id), vec, top_k=15, logger=log) if vec else ""
+            log(f"[run] user_id={user_id} embed done in {t1 - t0:.2f}s" + (" (timeout, answering without context)" if vec is None else ""))
+            context_str = ""
+            if vec:
+                budget = deadline.budget(RETRIEVAL_BUDGET_SECONDS, reserve=AGENT_FALLBACK_SECONDS)
+                if budget > 0:
+                    context_str = get_context_for_user(retriever, str(user_id), vec, budget=budget, logger=log, hot_cache=hot_cache, hedger=hedger)
+                else:
+                    events.append("retrieve_skipped")
             if context_str:
                 user_content = f"Контекст предыдущего диалога и загруженных документов:\n{context_str}\n\nТекущее сообщение пользователя: {text}"
             else:
                 user_content = text
             messages = [ChatMessage.from_user(user_content)]
-            result = agent.run(messages=messages)
+            # Агент не хеджируется (инструменты не идемпотентны): не уложился — ответ одним вызовом модели без инструментов.
+            # Если в фоне уже доживает предел брошенных запусков агента, апстрим явно тормозит — агент не запускается
+            reply_text = None
+            if agent_runner.saturated():
+                events.append("agent_skipped")
+                log(f"[run] user_id={user_id} {agent_runner.abandoned} abandoned agent runs still in flight, answering without tools")
+            else:
+                try:
+                    result = agent_runner.run(agent.run, deadline.budget(reserve=AGENT_FALLBACK_SECONDS), messages=messages, user_id=str(user_id))
+                    replies = result.get("messages") or []
+                    reply_text = replies[-1].text if replies else "Не удалось сформировать ответ."
+                except DeadlineExceeded:
+                    events.append("agent_timeout")
+                    log(f"[run] user_id={user_id} agent missed deadline after {deadline.elapsed():.2f}s, answering without tools")
+            if reply_text is None:
+                try:
+                    reply_text = _answer_without_tools(agent, messages, deadline.remaining()) or "Не удалось сформировать ответ."
+                except DeadlineExceeded:
+                    events.append("fallback_timeout")
+                    reply_text = None
             t2 = time.perf_counter()
-            replies = result.get("messages") or []
-            reply_text = replies[-1].text if replies else "Не удалось сформировать ответ."
-            log(f"[run] user_id={user_id} agent done in {t2 - t1:.2f}s messages={len(replies)} reply_len={len(reply_text)}")
+            if reply_text is None:
+                log(f"[run] user_id={user_id} no reply within {MESSAGE_DEADLINE_SECONDS:.0f}s deadline events={','.join(events)}")
+                bot.send_message(chat_id, "Не успел ответить вовремя — попробуй повторить вопрос чуть позже.")
+                return
+            log(f"[run] user_id={user_id} agent done in {t2 - t1:.2f}s reply_len={len(reply_text)}")
             bot.send_message(chat_id, reply_text)
 
             ts = time.time()
@@ -109,12 +250,30 @@ def register_handlers(
                 Document(content=f"user: {text}", meta={"user_id": str(user_id), "timestamp": ts}),
                 Document(content=f"assistant: {reply_text}", meta={"user_id": str(user_id), "timestamp": ts + 0.01}),
             ]
-            out = doc_embedder.run(documents=to_store)
-            docs_with_emb = out.get("documents") or to_store
-            document_store.write_documents(docs_with_emb)
+
+            def store() -> int:
+                try:
+                    docs_with_emb = writer.run(documents=to_store)["documents"]
+                except Exception as e:
+                    log(f"[run] user_id={user_id} store error: {e}")
+                    raise
+                for d in docs_with_emb:
+                    hot_cache.add(str(user_id), d.content, d.embedding, d.meta["timestamp"], doc_id=d.id)
+                return len(docs_with_emb)
+
+            # Ответ уже отправлен; запись, не успевшая к дедлайну, доживает в фоне и не держит поток бота
+            try:
+                stored = run_with_deadline(store, deadline.remaining())
+            except DeadlineExceeded:
+                events.append("store_late")
+                stored = 0
             t3 = time.perf_counter()
-            log(f"[run] user_id={user_id} stored {len(docs_with_emb)} docs in {t3 - t2:.2f}s total_run={t3 - t0:.2f}s")
+            log(
+                f"[run] user_id={user_id} stored {stored} docs in {t3 - t2:.2f}s total_run={t3 - t0:.2f}s"
+                + (f" deadline_events={','.join(events)}" if events else "")
+            )
         except Exception as e:
             log(f"[run] user_id={user_id} Error: {e}")
             bot.send_message(chat_id, f"Произошла ошибка: {e}")
-
+        finally:
+            tail.record(events)
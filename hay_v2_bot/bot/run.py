@@ -3,10 +3,12 @@ from pathlib import Path
 
 import telebot
 
-from hay_v2_bot.config import WORK_LOG_PATH, TELEGRAM_BOT_TOKEN, ROOT_DIR
-from hay_v2_bot.components import get_document_store, get_doc_embedder, get_text_embedder
+from hay_v2_bot.config import WORK_LOG_PATH, TELEGRAM_BOT_TOKEN, ROOT_DIR, BOT_MODE, INGEST_INLINE_WORKERS
+from hay_v2_bot.components import FileCatalog, get_document_store, get_doc_embedder, get_text_embedder
+from hay_v2_bot.components.memory_guard import check_rss_source
 from hay_v2_bot.pipelines import build_ingestion_pipeline, build_agent, get_context_for_user
 from hay_v2_bot.bot.handlers import register_handlers
+from hay_v2_bot.jobs import JobQueue
 from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
 from datetime import datetime
 
@@ -18,7 +20,7 @@ def _log_work(msg: str):
         f.write(line + "\n")
 
 
-def run_bot():
+def _prepare_env():
     import platform
     # Настраиваем HuggingFace кэш в папку проекта (решает проблему с правами на Windows)
     hf_cache_dir = ROOT_DIR / ".hf_cache"
@@ -37,37 +39,87 @@ def run_bot():
         raise SystemExit("Задай PINECONE_API_KEY в .env")
     os.environ["PINECONE_API_KEY"] = api_key
 
+    if not TELEGRAM_BOT_TOKEN:
+        _log_work("ERROR: TELEGRAM_BOT_TOKEN не задан")
+        raise SystemExit("Задай TELEGRAM_BOT_TOKEN в .env")
+
+    try:
+        check_rss_source()
+    except RuntimeError as e:
+        _log_work(f"ERROR: {e}")
+        raise SystemExit(str(e))
+    
+    # Отключаем прокси для запросов к Telegram (иначе ProxyError при sendMessage)
+    # OpenAI идёт через PROXY_BASE_URL в коде, системный прокси здесь не нужен
+    for key in ("HTTP_PROXY", "HTTPS_PROXY", "http_proxy", "https_proxy", "ALL_PROXY", "all_proxy"):
+        os.environ.pop(key, None)
+
+
+def build_ingest_runtime() -> dict:
+    """Только то, что нужно воркеру индексации: хранилище, эмбеддер документов, пайплайн."""
+    _prepare_env()
+    document_store = get_document_store()
+    doc_embedder = get_doc_embedder()
+    catalog = FileCatalog()
+    return {
+        "document_store": document_store,
+        "doc_embedder": doc_embedder,
+        "catalog": catalog,
+        "ingestion_pipeline": build_ingestion_pipeline(document_store, doc_embedder, manifest=catalog),
+    }
+
+
+def build_runtime() -> dict:
+    """Инициализирует хранилище, эмбеддеры, пайплайны и агента."""
+    _prepare_env()
     _log_work("Start: инициализация Pinecone, embedders, pipelines, agent")
     document_store = get_document_store()
     doc_embedder = get_doc_embedder()
     text_embedder = get_text_embedder()
     retriever = PineconeEmbeddingRetriever(document_store=document_store, top_k=15)
+    catalog = FileCatalog()
 
-    ingestion_pipeline = build_ingestion_pipeline(document_store, doc_embedder)
+    ingestion_pipeline = build_ingestion_pipeline(document_store, doc_embedder, manifest=catalog)
 
     agent = build_agent()
     agent.warm_up()
     _log_work("Agent и Pinecone готовы")
+    return {
+        "document_store": document_store,
+        "text_embedder": text_embedder,
+        "doc_embedder": doc_embedder,
+        "retriever": retriever,
+        "agent": agent,
+        "catalog": catalog,
+        "ingestion_pipeline": ingestion_pipeline,
+    }
 
-    if not TELEGRAM_BOT_TOKEN:
-        _log_work("ERROR: TELEGRAM_BOT_TOKEN не задан")
-        raise SystemExit("Задай TELEGRAM_BOT_TOKEN в .env")
-    
-    # Отключаем прокси для запросов к Telegram (иначе ProxyError при sendMessage)
-    # OpenAI идёт через PROXY_BASE_URL в коде, системный прокси здесь не нужен
-    for key in ("HTTP_PROXY", "HTTPS_PROXY", "http_proxy", "https_proxy", "ALL_PROXY", "all_proxy"):
-        os.environ.pop(key, None)
-    
+
+def handler_args(runtime: dict) -> dict:
+    """Аргументы register_handlers из runtime (пайплайн индексации нужен только воркерам очереди)."""
+    keys = ("document_store", "text_embedder", "doc_embedder", "retriever", "agent", "catalog")
+    return {k: runtime[k] for k in keys}
+
+
+def start_bot(bot: telebot.TeleBot, runtime: dict, logger=_log_work) -> JobQueue:
+    """Регистрирует обработчики и (если INGEST_INLINE_WORKERS > 0) запускает воркеры очереди в этом процессе."""
+    from hay_v2_bot.jobs.worker import start_inline_workers
+
+    job_queue = JobQueue()
+    register_handlers(bot=bot, job_queue=job_queue, logger=logger, **handler_args(runtime))
+    if INGEST_INLINE_WORKERS > 0:
+        start_inline_workers(bot, runtime, job_queue, INGEST_INLINE_WORKERS, logger=logger)
+    return job_queue
+
+
+def run_bot():
+    if BOT_MODE == "webhook":
+        from hay_v2_bot.bot.webhook import run_webhook
+        run_webhook()
+        return
+
+    runtime = build_runtime()
     bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
-    register_handlers(
-        bot=bot,
-        document_store=document_store,
-        text_embedder=text_embedder,
-        doc_embedder=doc_embedder,
-        retriever=retriever,
-        agent=agent,
-        ingestion_pipeline=ingestion_pipeline,
-        logger=_log_work,
-    )
+    start_bot(bot, runtime)
     _log_work("Polling started")
     bot.infinity_polling()
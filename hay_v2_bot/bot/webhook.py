@@ -0,0 +1,297 @@
+"""
+Webhook-режим: локальный HTTP-сервер принимает апдейты Telegram и раздаёт их пулу процессов-воркеров.
+
+Каждый воркер — отдельный процесс со своим прогретым агентом, эмбеддерами и Pinecone-клиентом.
+Апдейты одного чата всегда попадают в один и тот же воркер (chat_id % N) и обрабатываются им
+последовательно, поэтому порядок сообщений внутри чата сохраняется.
+
+Офлайн-проверка без Telegram, OpenAI и Pinecone: `serve --offline` поднимает воркеры на заглушках
+из нагрузочного теста (bench/loadgen), а ответы бота пишутся в лог и в --replies; затем записанные апдейты
+отправляются на локальный адрес:
+
+  python -m hay_v2_bot.bot.webhook serve --offline --replies replies.jsonl
+  python -m hay_v2_bot.bot.webhook replay updates.jsonl --url http://127.0.0.1:8443/webhook
+"""
+
+import argparse
+import json
+import itertools
+import multiprocessing as mp
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+import telebot
+
+from hay_v2_bot.config import (
+    TELEGRAM_BOT_TOKEN,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKERS,
+)
+from hay_v2_bot.bot.handlers import register_handlers
+from hay_v2_bot.bot.run import build_runtime, handler_args, start_bot, _log_work
+
+_CHAT_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post", "business_message")
+
+
+def update_chat_key(update: dict) -> int:
+    """Ключ шардирования апдейта: id чата (или пользователя), иначе update_id."""
+    for key in _CHAT_KEYS:
+        chat = (update.get(key) or {}).get("chat")
+        if chat and "id" in chat:
+            return int(chat["id"])
+    callback = update.get("callback_query")
+    if callback:
+        chat = (callback.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return int(chat["id"])
+        return int(callback["from"]["id"])
+    for key in ("inline_query", "chosen_inline_result", "my_chat_member", "chat_member"):
+        obj = update.get(key)
+        if obj:
+            if "chat" in obj:
+                return int(obj["chat"]["id"])
+            return int(obj["from"]["id"])
+    return int(update.get("update_id", 0))
+
+
+def offline_runtime() -> dict:
+    """Runtime без внешних сервисов: заглушки OpenAI и Pinecone из bench/loadgen, очередь и каталог во временной папке."""
+    from hay_v2_bot.bench.loadgen import FakeAgent, FakeDocEmbedder, FakeTextEmbedder
+    from hay_v2_bot.components import FileCatalog, OfflineDocumentStore, OfflineEmbeddingRetriever, SimulatedLatency
+    from hay_v2_bot.jobs import JobQueue
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix="hayv2_webhook_"))
+    store = OfflineDocumentStore()
+    return {
+        "document_store": store,
+        "text_embedder": FakeTextEmbedder(SimulatedLatency(name="embed")),
+        "doc_embedder": FakeDocEmbedder(SimulatedLatency(name="doc_embed")),
+        "retriever": OfflineEmbeddingRetriever(store),
+        "agent": FakeAgent(SimulatedLatency(name="agent"), SimulatedLatency(name="tool"), tool_rate=0.0),
+        "catalog": FileCatalog(tmp_dir / "catalog.sqlite3"),
+        "job_queue": JobQueue(tmp_dir / "jobs.sqlite3"),
+    }
+
+
+class RecordingTeleBot(telebot.TeleBot):
+    """TeleBot без обращений к Telegram: ответы пишутся в лог и (если задан path) в JSONL-файл."""
+
+    def __init__(self, logger, path: str | None = None):
+        super().__init__("0:offline", threaded=False)
+        self.log = logger
+        self.path = path
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _record(self, event: dict) -> None:
+        self.log(f"[reply] {json.dumps(event, ensure_ascii=False)}")
+        if self.path:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        message_id = next(self._ids)
+        self._record({"chat_id": chat_id, "message_id": message_id, "text": text})
+        return SimpleNamespace(message_id=message_id, chat=SimpleNamespace(id=chat_id), text=text)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, *args, **kwargs):
+        self._record({"chat_id": chat_id, "message_id": message_id, "text": text, "edit": True})
+        return True
+
+
+def _worker_main(index: int, queue, runtime_factory=build_runtime, offline: bool = False, replies_path: str | None = None):
+    """Процесс-воркер: свой runtime и свой TeleBot; апдейты обрабатываются строго по очереди."""
+    def log(msg: str):
+        _log_work(f"[w{index}] {msg}")
+
+    runtime = runtime_factory()
+    if offline:
+        # Без воркеров очереди: загруженные файлы остаются в очереди во временной папке
+        bot = RecordingTeleBot(log, replies_path)
+        register_handlers(bot=bot, job_queue=runtime["job_queue"], logger=log, **handler_args(runtime))
+    else:
+        bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, threaded=False)
+        start_bot(bot, runtime, logger=log)
+    log("worker ready")
+    while True:
+        raw = queue.get()
+        if raw is None:
+            break
+        try:
+            update = telebot.types.Update.de_json(raw)
+            bot.process_new_updates([update])
+        except Exception as e:
+            log(f"[webhook] update failed: {e}")
+    log("worker stopped")
+
+
+class WebhookDispatcher:
+    """Держит пул воркеров с очередью на каждый; перезапускает упавшие процессы."""
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, runtime_factory=build_runtime, offline: bool = False, replies_path: str | None = None):
+        self._ctx = mp.get_context("spawn")
+        self.offline = offline
+        self.replies_path = replies_path
+        self.runtime_factory = offline_runtime if offline else runtime_factory
+        self.queues = [self._ctx.Queue() for _ in range(max(1, workers))]
+        self.processes: list = [None] * len(self.queues)
+        self._stopping = threading.Event()
+        self.received = 0
+
+    def _spawn(self, index: int):
+        # Не daemon: демон-процесс не может запускать дочерние, а воркеру нужны изолированные процессы
+        # конвертации Docling. Завершение — через stop()
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.queues[index], self.runtime_factory, self.offline, self.replies_path),
+            name=f"hayv2-webhook-{index}",
+            daemon=False,
+        )
+        proc.start()
+        self.processes[index] = proc
+
+    def start(self):
+        for i in range(len(self.queues)):
+            self._spawn(i)
+        threading.Thread(target=self._supervise, daemon=True).start()
+
+    def _supervise(self):
+        while not self._stopping.wait(5):
+            for i, proc in enumerate(self.processes):
+                if proc is not None and not proc.is_alive():
+                    _log_work(f"[webhook] worker {i} exited with code {proc.exitcode}, restarting")
+                    self._spawn(i)
+
+    def dispatch(self, raw: str) -> int:
+        update = json.loads(raw)
+        index = update_chat_key(update) % len(self.queues)
+        self.queues[index].put(raw)
+        self.received += 1
+        return index
+
+    def stop(self, timeout: float = 30):
+        self._stopping.set()
+        for q in self.queues:
+            q.put(None)
+        for proc in self.processes:
+            if proc is not None:
+                proc.join(timeout)
+                # Зависший воркер не должен держать завершение сервера
+                if proc.is_alive():
+                    proc.terminate()
+                    proc.join(5)
+
+
+def make_server(dispatcher: WebhookDispatcher, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+    class _Handler(BaseHTTPRequestHandler):
+        def _reply(self, code: int, body: bytes = b""):
+            self.send_response(code)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/healthz":
+                alive = sum(1 for p in dispatcher.processes if p is not None and p.is_alive())
+                self._reply(200, json.dumps({"workers_alive": alive, "received": dispatcher.received}).encode())
+            else:
+                self._reply(404)
+
+        def do_POST(self):
+            if self.path != path:
+                self._reply(404)
+                return
+            if secret and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+                self._reply(403)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length).decode("utf-8")
+            try:
+                dispatcher.dispatch(raw)
+            except Exception as e:
+                _log_work(f"[webhook] bad update: {e}")
+                self._reply(400)
+                return
+            # Отвечаем сразу: обработка идёт в воркере, Telegram не ждёт ответа бота
+            self._reply(200)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((listen, port), _Handler)
+
+
+def run_webhook(workers: int = WEBHOOK_WORKERS, runtime_factory=build_runtime, offline: bool = False, replies_path: str | None = None):
+    if not offline and not TELEGRAM_BOT_TOKEN:
+        raise SystemExit("Задай TELEGRAM_BOT_TOKEN в .env")
+    dispatcher = WebhookDispatcher(workers=workers, runtime_factory=runtime_factory, offline=offline, replies_path=replies_path)
+    dispatcher.start()
+    server = make_server(dispatcher)
+    if offline:
+        _log_work("Офлайн-режим: заглушки OpenAI/Pinecone, ответы не отправляются в Telegram")
+    elif WEBHOOK_URL:
+        telebot.TeleBot(TELEGRAM_BOT_TOKEN).set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            drop_pending_updates=False,
+        )
+        _log_work(f"Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    else:
+        _log_work("WEBHOOK_URL не задан: setWebhook пропущен (локальный режим)")
+    _log_work(f"Webhook server started on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}, workers={len(dispatcher.queues)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dispatcher.stop()
+
+
+def replay_updates(path: str, url: str, secret: str = WEBHOOK_SECRET, delay: float = 0.0) -> int:
+    """Отправляет записанные апдейты (JSON по одному в строке или JSON-массив) на локальный webhook."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    updates = json.loads(text) if text.startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+    sent = 0
+    for update in updates:
+        req = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"), headers={"Content-Type": "application/json"})
+        if secret:
+            req.add_header("X-Telegram-Bot-Api-Secret-Token", secret)
+        with urllib.request.urlopen(req, timeout=10) as r:
+            r.read()
+        sent += 1
+        if delay:
+            time.sleep(delay)
+    return sent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Webhook-режим бота")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    serve = sub.add_parser("serve", help="Запустить HTTP-сервер и воркеры")
+    serve.add_argument("--offline", action="store_true", help="Заглушки вместо Telegram, OpenAI и Pinecone")
+    serve.add_argument("--replies", help="JSONL-файл для ответов бота в офлайн-режиме")
+    replay = sub.add_parser("replay", help="Отправить записанные апдейты на локальный webhook")
+    replay.add_argument("file")
+    replay.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    replay.add_argument("--delay", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    if args.cmd == "serve":
+        run_webhook(offline=args.offline, replies_path=args.replies)
+    else:
+        print(f"sent {replay_updates(args.file, args.url, delay=args.delay)} updates")
+
+
+if __name__ == "__main__":
+    main()
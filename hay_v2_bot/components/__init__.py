@@ -1,15 +1,53 @@
 from .store import get_document_store
-from .embedders import get_doc_embedder, get_text_embedder
-from .tools import dog_fact_tool, dog_image_tool
+from .embedders import ConcurrentDocumentEmbedder, LocalDocumentEmbedder, LocalTextEmbedder, get_doc_embedder, get_text_embedder
+from .tools import dog_fact_tool, dog_image_tool, document_structure_tool
 from .meta_adder import DocumentMetaAdder
-from .docling_loader import DoclingLoader
+from .docling_loader import ConversionError, DoclingLoader, make_document_stream
+from .vectors import LocalVectorIndex, truncate_embeddings
+from .hot_memory import RecentDialogCache
+from .outline import DocumentStructureTool, OutlineStore
+from .writer import PipelinedDocumentWriter
+from .offline_store import OfflineDocumentStore, OfflineEmbeddingRetriever, SimulatedLatency
+from .chunk_delta import ChunkManifest, ChunkDeltaFilter, ChunkDeltaCommitter, chunk_id, delete_ids_batched
+from .catalog import FileCatalog, QuotaExceeded, bundle_key, source_digest
+from .deadline import AbandonableRunner, Deadline, DeadlineExceeded, Hedger, TailStats, run_with_deadline
 
 __all__ = [
     "get_document_store",
     "get_doc_embedder",
     "get_text_embedder",
+    "ConcurrentDocumentEmbedder",
+    "LocalDocumentEmbedder",
+    "LocalTextEmbedder",
     "dog_fact_tool",
     "dog_image_tool",
+    "document_structure_tool",
     "DocumentMetaAdder",
     "DoclingLoader",
+    "make_document_stream",
+    "ConversionError",
+    "ChunkManifest",
+    "ChunkDeltaFilter",
+    "ChunkDeltaCommitter",
+    "chunk_id",
+    "delete_ids_batched",
+    "FileCatalog",
+    "QuotaExceeded",
+    "bundle_key",
+    "source_digest",
+    "LocalVectorIndex",
+    "truncate_embeddings",
+    "RecentDialogCache",
+    "OutlineStore",
+    "DocumentStructureTool",
+    "PipelinedDocumentWriter",
+    "OfflineDocumentStore",
+    "OfflineEmbeddingRetriever",
+    "SimulatedLatency",
+    "AbandonableRunner",
+    "Deadline",
+    "DeadlineExceeded",
+    "Hedger",
+    "TailStats",
+    "run_with_deadline",
 ]
@@ -0,0 +1,248 @@
+"""
+Локальный каталог проиндексированных файлов на SQLite: что пользователь загрузил, хэш файла, размеры,
+время обработки и ID всех векторов файла в Pinecone (чанки и резюме разделов).
+
+Каталог реализует интерфейс ChunkManifest (get/put), поэтому дельта-переиндексация берёт прошлую версию
+файла отсюда. Список файлов, удаление по ID и квоты не требуют сканирования индекса по фильтру.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from hay_v2_bot.components.chunk_delta import ChunkManifest
+from hay_v2_bot.config import CATALOG_DB_PATH, PINECONE_INDEX_NAME, USER_QUOTA_BYTES, USER_QUOTA_CHUNKS, USER_QUOTA_FILES
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'file',
+    file_hash TEXT,
+    size_bytes INTEGER NOT NULL DEFAULT 0,
+    text_bytes INTEGER NOT NULL DEFAULT 0,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    chunk_ids TEXT NOT NULL DEFAULT '[]',
+    summary_ids TEXT NOT NULL DEFAULT '[]',
+    members TEXT NOT NULL DEFAULT '[]',
+    convert_seconds REAL,
+    index_seconds REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, filename)
+);
+"""
+# Строки пакетов (общее резюме альбома или архива) живут в своём пространстве имён:
+# альбом из одного файла иначе занял бы строку самого файла
+BUNDLE_PREFIX = "bundle:"
+
+
+def bundle_key(bundle_name: str) -> str:
+    return f"{BUNDLE_PREFIX}{bundle_name}"
+
+
+class QuotaExceeded(ValueError):
+    """Загрузка превысит квоту пользователя: файл не ставится в очередь."""
+
+
+def _format_mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} МБ"
+
+
+def source_digest(source) -> tuple[str, int]:
+    """(sha256, размер) файла: путь или DocumentStream."""
+    h = hashlib.sha256()
+    stream = getattr(source, "stream", None)
+    if stream is not None:
+        data = stream.getvalue()
+        h.update(data)
+        return h.hexdigest(), len(data)
+    size = 0
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+            size += len(block)
+    return h.hexdigest(), size
+
+
+class FileCatalog:
+    def __init__(self, path=CATALOG_DB_PATH, legacy_manifest: ChunkManifest | None = None):
+        self.path = str(path)
+        # Манифесты в JSON из прошлых версий: читаются, пока файл не переиндексирован.
+        # Они описывают исходный индекс tgdialog (1536 измерений, OpenAI), к другим индексам не относятся
+        self.legacy = legacy_manifest or (ChunkManifest() if PINECONE_INDEX_NAME == "tgdialog" else None)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # Каталоги прошлых версий — без списка файлов пакета
+            columns = {r["name"] for r in conn.execute("PRAGMA table_info(files)")}
+            if "members" not in columns:
+                conn.execute("ALTER TABLE files ADD COLUMN members TEXT NOT NULL DEFAULT '[]'")
+
+    @contextmanager
+    def _connect(self):
+        # Отдельное соединение на операцию: каталог используют обработчики бота и воркеры в разных потоках и процессах
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # Интерфейс ChunkManifest
+
+    def get(self, user_id: str, filename: str) -> set[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT chunk_ids FROM files WHERE user_id=? AND filename=?", (str(user_id), filename)).fetchone()
+        if row is None:
+            return self.legacy.get(user_id, filename) if self.legacy else set()
+        return set(json.loads(row["chunk_ids"]))
+
+    def put(self, user_id: str, filename: str, ids: list[str]) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO files (user_id, filename, chunk_ids, chunk_count, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, filename) DO UPDATE SET chunk_ids=excluded.chunk_ids, chunk_count=excluded.chunk_count, "
+                "updated_at=excluded.updated_at",
+                (str(user_id), filename, json.dumps(sorted(ids)), len(ids), now, now),
+            )
+
+    # Сведения о файле
+
+    def update(self, user_id: str, filename: str, **fields) -> None:
+        """file_hash, size_bytes, text_bytes, convert_seconds, index_seconds, kind."""
+        allowed = {"file_hash", "size_bytes", "text_bytes", "convert_seconds", "index_seconds", "kind"}
+        fields = {k: v for k, v in fields.items() if k in allowed and v is not None}
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO files (user_id, filename, created_at, updated_at) VALUES (?, ?, ?, ?) ON CONFLICT (user_id, filename) DO NOTHING",
+                (str(user_id), filename, now, now),
+            )
+            if fields:
+                assignments = ", ".join(f"{k}=?" for k in fields)
+                conn.execute(
+                    f"UPDATE files SET {assignments}, updated_at=? WHERE user_id=? AND filename=?",
+                    (*fields.values(), now, str(user_id), filename),
+                )
+
+    def set_summary_ids(
+        self, user_id: str, filename: str, ids: list[str], kind: str = "file", members: list[str] | None = None
+    ) -> list[str]:
+        """
+        Сохраняет ID резюме разделов; возвращает ID прошлой версии, которых больше нет (их нужно удалить).
+        members — имена файлов пакета (kind="bundle"), чтобы /forget пакета удалял и их.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT summary_ids, members FROM files WHERE user_id=? AND filename=?", (str(user_id), filename)
+            ).fetchone()
+            previous = set(json.loads(row["summary_ids"])) if row else set()
+            # Повторная загрузка пакета с тем же именем дополняет список файлов: прежние файлы остаются в индексе
+            names = sorted(set(json.loads(row["members"]) if row else []) | set(members or []))
+            conn.execute(
+                "INSERT INTO files (user_id, filename, kind, summary_ids, members, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, filename) DO UPDATE SET summary_ids=excluded.summary_ids, members=excluded.members, "
+                "updated_at=excluded.updated_at",
+                (str(user_id), filename, kind, json.dumps(sorted(ids)), json.dumps(names), now, now),
+            )
+            conn.execute("COMMIT")
+        return sorted(previous - set(ids))
+
+    def members(self, user_id: str, filename: str) -> list[str]:
+        """Файлы пакета, которые ещё есть в каталоге (пустой список — не пакет)."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT members FROM files WHERE user_id=? AND filename=?", (str(user_id), filename)).fetchone()
+            if row is None:
+                return []
+            names = json.loads(row["members"])
+            present = {
+                r["filename"]
+                for r in conn.execute("SELECT filename FROM files WHERE user_id=? AND kind='file'", (str(user_id),))
+            }
+        return [n for n in names if n in present]
+
+    def files(self, user_id: str) -> list[dict]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT filename, kind, file_hash, size_bytes, text_bytes, chunk_count, members, convert_seconds, index_seconds, created_at, updated_at "
+                "FROM files WHERE user_id=? ORDER BY updated_at DESC",
+                (str(user_id),),
+            ).fetchall()
+        return [{**dict(r), "members": json.loads(r["members"])} for r in rows]
+
+    def find(self, user_id: str, name: str) -> list[str]:
+        """Имена файлов пользователя: точное совпадение, иначе все, содержащие name (без учёта регистра)."""
+        names = [f["filename"] for f in self.files(user_id)]
+        exact = [n for n in names if n == name]
+        if exact:
+            return exact
+        wanted = name.lower()
+        return [n for n in names if wanted in n.lower()]
+
+    def vector_ids(self, user_id: str, filename: str) -> list[str]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT chunk_ids, summary_ids FROM files WHERE user_id=? AND filename=?", (str(user_id), filename)
+            ).fetchone()
+        if row is None:
+            return sorted(self.legacy.get(user_id, filename)) if self.legacy else []
+        return json.loads(row["chunk_ids"]) + json.loads(row["summary_ids"])
+
+    def remove(self, user_id: str, filename: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM files WHERE user_id=? AND filename=?", (str(user_id), filename))
+        if self.legacy:
+            self.legacy.delete(user_id, filename)
+
+    # Квоты
+
+    def usage(self, user_id: str) -> dict:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS files, COALESCE(SUM(size_bytes), 0) AS bytes, COALESCE(SUM(chunk_count), 0) AS chunks "
+                "FROM files WHERE user_id=? AND kind='file'",
+                (str(user_id),),
+            ).fetchone()
+        return dict(row)
+
+    def check_quota(self, user_id: str, filename: str, size_bytes: int | None, pending: list[tuple[str, int | None]] = ()) -> None:
+        """Бросает QuotaExceeded, если загрузка превысит квоту; повторная загрузка файла с тем же именем заменяет старую версию."""
+        self.check_quota_many(user_id, [(filename, size_bytes)], pending=pending)
+
+    def check_quota_many(self, user_id: str, files: list[tuple[str, int | None]], pending: list[tuple[str, int | None]] = ()) -> None:
+        """
+        Квота для нескольких файлов сразу (альбом, содержимое архива): files — (имя, размер) новой загрузки,
+        pending — файлы из очереди, ещё не попавшие в каталог (их тоже нельзя провести мимо квоты).
+        """
+        usage = self.usage(user_id)
+        with self._connect() as conn:
+            existing = {
+                r["filename"]: r["size_bytes"]
+                for r in conn.execute("SELECT filename, size_bytes FROM files WHERE user_id=? AND kind='file'", (str(user_id),))
+            }
+        # Одно имя в очереди и в загрузке — одна будущая версия файла
+        incoming = {name: size or 0 for name, size in list(pending) + list(files)}
+        new_files = usage["files"] + sum(1 for name in incoming if name not in existing)
+        if USER_QUOTA_FILES and new_files > USER_QUOTA_FILES:
+            raise QuotaExceeded(
+                f"Достигнут лимит файлов: {usage['files']} из {USER_QUOTA_FILES}"
+                + (f", в очереди и в загрузке ещё {len(incoming)}" if len(incoming) > 1 else "")
+                + ". Удали ненужные командой /forget <файл>."
+            )
+        size_bytes = sum(size or 0 for _, size in files)
+        new_bytes = usage["bytes"] + sum(size - existing.get(name, 0) for name, size in incoming.items())
+        if USER_QUOTA_BYTES and new_bytes > USER_QUOTA_BYTES:
+            raise QuotaExceeded(
+                f"Не хватает места: занято {_format_mb(usage['bytes'])} из {_format_mb(USER_QUOTA_BYTES)}, "
+                f"загрузка {_format_mb(size_bytes)}. Удали ненужные файлы командой /forget <файл>."
+            )
+        if USER_QUOTA_CHUNKS and usage["chunks"] >= USER_QUOTA_CHUNKS:
+            raise QuotaExceeded(
+                f"Достигнут лимит фрагментов в индексе: {usage['chunks']} из {USER_QUOTA_CHUNKS}. Удали ненужные файлы командой /forget <файл>."
+            )
@@ -0,0 +1,136 @@
+"""
+Детерминированные ID чанков и дельта-переиндексация при повторной загрузке файла.
+
+ID чанка = sha256(user_id, filename, sha256(content)): одинаковый текст в том же файле
+того же пользователя всегда получает тот же ID. При повторной загрузке эмбеддятся
+и записываются только новые/изменённые чанки, исчезнувшие — удаляются из хранилища.
+"""
+
+import hashlib
+import json
+import threading
+
+from haystack import Document, component
+
+from hay_v2_bot.config import PINECONE_INDEX_NAME, ROOT_DIR
+
+# Манифест описывает содержимое конкретного индекса: при смене индекса (размерность, имя) он начинается с нуля,
+# иначе неизменённые чанки считались бы уже записанными и в новый индекс не попадали
+CHUNK_MANIFEST_DIR = ROOT_DIR / ".chunk_manifests" / PINECONE_INDEX_NAME
+# Манифесты до разделения по индексам лежат прямо в .chunk_manifests и относятся к исходному индексу tgdialog
+_UNSCOPED_MANIFEST_DIR = ROOT_DIR / ".chunk_manifests"
+# Pinecone принимает не более 1000 ID в одном delete
+DELETE_BATCH_SIZE = 1000
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256((content or "").encode("utf-8")).hexdigest()
+
+
+def chunk_id(user_id: str, filename: str, content: str) -> str:
+    """Детерминированный ID чанка по (user_id, filename, хэш содержимого)."""
+    key = f"{user_id}\x1f{filename}\x1f{content_hash(content)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def delete_ids_batched(document_store, ids: list[str], batch_size: int = DELETE_BATCH_SIZE) -> int:
+    """Удаляет документы по ID пачками (без сканирования индекса по фильтру)."""
+    ids = list(ids)
+    for i in range(0, len(ids), batch_size):
+        document_store.delete_documents(ids[i : i + batch_size])
+    return len(ids)
+
+
+class ChunkManifest:
+    """Набор ID чанков последней версии файла: JSON на пару (user_id, filename)."""
+
+    def __init__(self, root=CHUNK_MANIFEST_DIR, fallback_root=_UNSCOPED_MANIFEST_DIR if PINECONE_INDEX_NAME == "tgdialog" else None):
+        self.root = root
+        self.fallback_root = fallback_root
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: str, filename: str, root=None):
+        name = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+        return (root or self.root) / str(user_id) / f"{name}.json"
+
+    def get(self, user_id: str, filename: str) -> set[str]:
+        path = self._path(user_id, filename)
+        if not path.exists() and self.fallback_root is not None:
+            path = self._path(user_id, filename, self.fallback_root)
+        if not path.exists():
+            return set()
+        try:
+            return set(json.loads(path.read_text(encoding="utf-8")).get("chunk_ids", []))
+        except Exception as e:
+            print(f"[WARN] Не удалось прочитать манифест {path}: {e}")
+            return set()
+
+    def put(self, user_id: str, filename: str, ids: list[str]) -> None:
+        path = self._path(user_id, filename)
+        with self._lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"filename": filename, "chunk_ids": sorted(ids)}, ensure_ascii=False), encoding="utf-8")
+            tmp.replace(path)
+
+    def delete(self, user_id: str, filename: str) -> None:
+        paths = [self._path(user_id, filename)]
+        if self.fallback_root is not None:
+            paths.append(self._path(user_id, filename, self.fallback_root))
+        with self._lock:
+            for path in paths:
+                if path.exists():
+                    path.unlink()
+
+
+@component
+class ChunkDeltaFilter:
+    """Проставляет детерминированные ID и пропускает дальше только чанки, которых не было в прошлой версии файла."""
+
+    def __init__(self, manifest: ChunkManifest | None = None):
+        self.manifest = manifest or ChunkManifest()
+
+    @component.output_types(documents=list[Document], delta=dict)
+    def run(self, documents: list[Document], user_id: str, filename: str) -> dict:
+        current = {}
+        for doc in documents:
+            doc_id = chunk_id(user_id, filename, doc.content or "")
+            if doc_id not in current:
+                current[doc_id] = Document(id=doc_id, content=doc.content, meta=dict(doc.meta or {}))
+        previous = self.manifest.get(user_id, filename)
+        fresh = [d for i, d in current.items() if i not in previous]
+        stale = sorted(previous - current.keys())
+        delta = {
+            "user_id": str(user_id),
+            "filename": filename,
+            "chunk_ids": list(current.keys()),
+            "stale_ids": stale,
+            "total": len(current),
+            "new": len(fresh),
+            "unchanged": len(current) - len(fresh),
+            "duplicates": len(documents) - len(current),
+        }
+        return {"documents": fresh, "delta": delta}
+
+
+@component
+class ChunkDeltaCommitter:
+    """После успешной записи удаляет исчезнувшие чанки и сохраняет манифест новой версии файла."""
+
+    def __init__(self, document_store, manifest: ChunkManifest | None = None):
+        self.document_store = document_store
+        self.manifest = manifest or ChunkManifest()
+
+    @component.output_types(stats=dict)
+    def run(self, documents_written: int, delta: dict) -> dict:
+        deleted = delete_ids_batched(self.document_store, delta["stale_ids"]) if delta["stale_ids"] else 0
+        self.manifest.put(delta["user_id"], delta["filename"], delta["chunk_ids"])
+        stats = {
+            "chunks": delta["total"],
+            "written": documents_written,
+            "deleted": deleted,
+            # Неизменённые и повторяющиеся чанки не эмбеддятся и не записываются заново
+            "embeddings_avoided": delta["unchanged"] + delta["duplicates"],
+            "upserts_avoided": delta["unchanged"] + delta["duplicates"],
+        }
+        return {"stats": stats}
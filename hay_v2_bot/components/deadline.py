@@ -0,0 +1,222 @@
+"""
+Бюджет времени на сообщение и хеджирование идемпотентных вызовов (эмбеддинг запроса, поиск в Pinecone).
+
+Вызов, не ответивший за HEDGE_PERCENTILE-й перцентиль своей обычной латентности, дублируется; берётся
+первый успешный ответ. Медленный вызов нельзя прервать — он доживает в фоне, но ход больше его не ждёт.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from hay_v2_bot.config import (
+    AGENT_MAX_ABANDONED,
+    HEDGE_DEFAULT_DELAY,
+    HEDGE_MAX_RATIO,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+    TAIL_STATS_EVERY,
+)
+
+# Брошенные по дедлайну вызовы занимают поток, пока не завершатся сами, поэтому пулы раздельные:
+# хеджируемые идемпотентные вызовы (эмбеддинг, поиск) не стоят в очереди за зависшими агентами и записью
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+# Ответ без инструментов и запись реплик
+_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="deadline")
+_WINDOW = 500
+
+
+class DeadlineExceeded(TimeoutError):
+    """Вызов не уложился в отведённый бюджет времени."""
+
+
+class Deadline:
+    """Абсолютный срок ответа на сообщение; стадии берут из него свой бюджет."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.start = time.monotonic()
+        self.at = self.start + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def budget(self, limit: float | None = None, reserve: float = 0.0) -> float:
+        """Время на стадию: остаток минус резерв для следующих стадий, не больше limit."""
+        left = max(0.0, self.remaining() - reserve)
+        return min(left, limit) if limit is not None else left
+
+
+def run_with_deadline(fn, timeout: float, *args, **kwargs):
+    """fn(*args, **kwargs) в пуле; DeadlineExceeded, если результата нет за timeout секунд (вызов продолжится в фоне)."""
+    fut = _pool.submit(fn, *args, **kwargs)
+    try:
+        return fut.result(timeout=max(0.0, timeout))
+    except FutureTimeout:
+        raise DeadlineExceeded(f"нет результата за {timeout:.1f} с") from None
+
+
+class AbandonableRunner:
+    """
+    Неотменяемые вызовы с дедлайном (шаги агента с инструментами) в своём пуле. Брошенных по дедлайну,
+    но ещё работающих вызовов не больше max_abandoned: при медленном апстриме новые запуски не копятся
+    за ними, а вызывающий код сразу идёт по запасному пути (saturated()).
+    """
+
+    def __init__(self, max_abandoned: int = AGENT_MAX_ABANDONED, name: str = "agent", spare_workers: int = 16):
+        self.max_abandoned = max_abandoned
+        self._pool = ThreadPoolExecutor(max_workers=max_abandoned + spare_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.abandoned = 0
+
+    def saturated(self) -> bool:
+        with self._lock:
+            return self.abandoned >= self.max_abandoned
+
+    def _release(self, _fut) -> None:
+        with self._lock:
+            self.abandoned -= 1
+
+    def run(self, fn, timeout: float, *args, **kwargs):
+        fut = self._pool.submit(fn, *args, **kwargs)
+        try:
+            return fut.result(timeout=max(0.0, timeout))
+        except FutureTimeout:
+            with self._lock:
+                self.abandoned += 1
+            fut.add_done_callback(self._release)
+            raise DeadlineExceeded(f"нет результата за {timeout:.1f} с") from None
+
+
+class Hedger:
+    """
+    Хеджирование по имени вызова: своё окно латентностей, порог — перцентиль окна (до HEDGE_MIN_SAMPLES
+    замеров — HEDGE_DEFAULT_DELAY). Доля дублей ограничена HEDGE_MAX_RATIO, чтобы при общей деградации
+    апстрима не удвоить на него нагрузку.
+    """
+
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        default_delay: float = HEDGE_DEFAULT_DELAY,
+        max_ratio: float = HEDGE_MAX_RATIO,
+    ):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.max_ratio = max_ratio
+        self._lock = threading.Lock()
+        self._latencies: dict[str, deque] = {}
+        self._stats: dict[str, dict] = {}
+
+    def _count(self, name: str, key: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "hedged": 0, "hedge_won": 0, "timeouts": 0, "errors": 0})
+            stats[key] += 1
+
+    def delay(self, name: str) -> float:
+        with self._lock:
+            window = sorted(self._latencies.get(name, ()))
+        if len(window) < self.min_samples:
+            return self.default_delay
+        return window[min(len(window) - 1, int(len(window) * self.percentile / 100))]
+
+    def _may_hedge(self, name: str) -> bool:
+        with self._lock:
+            stats = self._stats[name]
+            return stats["hedged"] < self.max_ratio * stats["calls"] + 1
+
+    def _submit(self, name: str, fn):
+        def timed():
+            t0 = time.perf_counter()
+            result = fn()
+            # В окно идёт латентность каждой попытки, а не время до первого ответа: иначе хеджирование
+            # срезает хвост окна, порог ползёт вниз и дублей становится всё больше
+            with self._lock:
+                self._latencies.setdefault(name, deque(maxlen=_WINDOW)).append(time.perf_counter() - t0)
+            return result
+
+        return _hedge_pool.submit(timed)
+
+    def call(self, name: str, fn, timeout: float):
+        """Результат fn() от первой успешной попытки; DeadlineExceeded, если ни одна не ответила за timeout."""
+        self._count(name, "calls")
+        deadline = time.monotonic() + max(0.0, timeout)
+        primary = self._submit(name, fn)
+        done, _ = wait([primary], timeout=min(self.delay(name), max(0.0, timeout)))
+        if done:
+            if primary.exception() is not None:
+                self._count(name, "errors")
+            return primary.result()
+
+        attempts = {primary}
+        if deadline - time.monotonic() > 0 and self._may_hedge(name):
+            self._count(name, "hedged")
+            attempts.add(self._submit(name, fn))
+        error = None
+        pending = attempts
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for fut in done:
+                if fut.exception() is None:
+                    if fut is not primary:
+                        self._count(name, "hedge_won")
+                    return fut.result()
+                error = fut.exception()
+        if error is not None and not pending:
+            self._count(name, "errors")
+            raise error
+        self._count(name, "timeouts")
+        raise DeadlineExceeded(f"{name}: нет ответа за {timeout:.1f} с")
+
+    def summary(self) -> str:
+        with self._lock:
+            stats = {name: dict(s) for name, s in self._stats.items()}
+        parts = []
+        for name, s in sorted(stats.items()):
+            calls = max(1, s["calls"])
+            parts.append(
+                f"{name}: calls={s['calls']} hedged={s['hedged'] / calls:.1%} hedge_won={s['hedge_won'] / calls:.1%} "
+                f"timeouts={s['timeouts'] / calls:.1%} errors={s['errors'] / calls:.1%} p{self.percentile:g}={self.delay(name) * 1000:.0f}ms"
+            )
+        return "; ".join(parts)
+
+
+class TailStats:
+    """Счётчики ходов: промахи дедлайна по стадиям и деградации; сводка в лог каждые every сообщений."""
+
+    def __init__(self, hedger: Hedger | None = None, every: int = TAIL_STATS_EVERY, logger=None):
+        self.hedger = hedger
+        self.every = every
+        self.log = logger or print
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.missed = 0
+        self.events: dict[str, int] = {}
+
+    def record(self, events: list[str]) -> None:
+        """events хода: embed_timeout, retrieve_skipped, agent_timeout, fallback_timeout, store_late и т.п."""
+        with self._lock:
+            self.messages += 1
+            if events:
+                self.missed += 1
+            for event in events:
+                self.events[event] = self.events.get(event, 0) + 1
+            due = self.every > 0 and self.messages % self.every == 0
+            line = self._line() if due else ""
+        if line:
+            self.log(line)
+
+    def _line(self) -> str:
+        n = max(1, self.messages)
+        events = " ".join(f"{k}={v / n:.1%}" for k, v in sorted(self.events.items())) or "-"
+        hedges = self.hedger.summary() if self.hedger else "-"
+        return f"[tail] messages={self.messages} deadline_miss={self.missed / n:.1%} events: {events} hedges: {hedges}"
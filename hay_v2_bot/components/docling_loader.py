@@ -4,11 +4,17 @@
 """
 
 import os
+import threading
+import time
 from pathlib import Path
+from typing import Optional
 
 from haystack import Document, component
 
-from hay_v2_bot.config import CHUNKER_TOKENIZER, ROOT_DIR
+from hay_v2_bot.config import CHUNKER_TOKENIZER, DOCLING_FILE_TIMEOUT, DOCLING_MEMORY_BUDGET_MB, DOCLING_PAGE_BATCH, ROOT_DIR
+from hay_v2_bot.components.docling_profiles import cheaper_profiles, get_converter, pdf_page_count, select_profile
+from hay_v2_bot.components.memory_guard import MB, PeakRssSampler, SandboxPool, sandbox_unavailable_reason
+from hay_v2_bot.components.outline import OutlineStore, extract_outline, merge_outlines
 
 
 def _setup_hf_cache():
@@ -66,70 +72,218 @@ def _make_chunker():
         return HierarchicalChunker()
 
 
-def _docling_path_to_documents(path: str, user_id: str, filename: str) -> list[Document]:
-    from docling.document_converter import DocumentConverter
-    converter = DocumentConverter()
+def make_document_stream(data: bytes, filename: str):
+    """Байты файла -> Docling DocumentStream: конвертация без временного файла на диске."""
+    from io import BytesIO
+    from docling.datamodel.base_models import DocumentStream
+    return DocumentStream(name=filename, stream=BytesIO(data))
+
+
+class ConversionError(RuntimeError):
+    """Файл не удалось конвертировать — в индекс по нему ничего не пишется."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def _source_spec(source) -> tuple:
+    """Путь или DocumentStream -> сериализуемое описание (для передачи в изолированный процесс и повторов)."""
+    stream = getattr(source, "stream", None)
+    if stream is not None:
+        return ("stream", source.name, stream.getvalue())
+    return ("path", str(source))
+
+
+def _open_source(spec: tuple):
+    # DocumentStream читается один раз — на каждую попытку новый
+    return make_document_stream(spec[2], spec[1]) if spec[0] == "stream" else spec[1]
+
+
+def _convert_chunks(spec: tuple, profile: str, page_range: tuple[int, int] | None = None) -> dict:
+    """Конвертация, чанкинг и структура одного файла (или диапазона страниц); выполняется в изолированном процессе."""
+    t0 = time.perf_counter()
+    kwargs = {"page_range": page_range} if page_range else {}
+    doc = get_converter(profile).convert(_open_source(spec), **kwargs).document
+    convert_seconds = time.perf_counter() - t0
     try:
-        result = converter.convert(path)
-        doc = result.document
+        outline = extract_outline(doc)
     except Exception as e:
-        # Если обработка не удалась из-за памяти или других ошибок
-        print(f"[WARN] Ошибка при конвертации {filename}: {e}")
-        # Возвращаем пустой список или минимальный документ
-        return [
-            Document(
-                content=f"Документ {filename} не удалось полностью обработать из-за ошибки: {e}",
-                meta={"user_id": str(user_id), "filename": filename, "chunk_index": 0, "error": str(e)},
-            )
-        ]
-    
+        print(f"[WARN] Не удалось извлечь структуру {spec[1]}: {e}")
+        outline = None
+
     chunker = _make_chunker()
     try:
         chunks = list(chunker.chunk(dl_doc=doc))
     except Exception as e:
-        print(f"[WARN] Ошибка при чанкинге {filename}: {e}")
-        # Пробуем получить хотя бы часть документа
+        print(f"[WARN] Ошибка при чанкинге {spec[1]}: {e}")
         chunks = []
-    
-    out = []
+    texts = []
     for i, ch in enumerate(chunks):
         try:
             text = (chunker.contextualize(chunk=ch) if hasattr(chunker, "contextualize") else ch.text) or ch.text
             if text and text.strip():
-                out.append(
-                    Document(
-                        content=text,
-                        meta={"user_id": str(user_id), "filename": filename, "chunk_index": i},
-                    )
-                )
+                texts.append(text)
         except Exception as e:
-            print(f"[WARN] Ошибка при обработке чанка {i} из {filename}: {e}")
+            print(f"[WARN] Ошибка при обработке чанка {i} из {spec[1]}: {e}")
+    return {"texts": texts, "convert_seconds": convert_seconds, "outline": outline}
+
+
+_sandboxes = None
+_sandboxes_lock = threading.Lock()
+_unisolated_warned = False
+
+
+def _run_conversion(spec: tuple, profile: str, page_range, timeout: float | None = None) -> tuple[dict, int]:
+    """
+    (результат _convert_chunks, пиковый RSS в байтах). С бюджетом — в изолированном процессе,
+    который убивается через timeout секунд; без изоляции конвертацию прервать нельзя.
+    """
+    global _sandboxes, _unisolated_warned
+    if DOCLING_MEMORY_BUDGET_MB > 0:
+        reason = sandbox_unavailable_reason()
+        if reason is None:
+            with _sandboxes_lock:
+                if _sandboxes is None:
+                    _sandboxes = SandboxPool(_convert_chunks)
+            with _sandboxes.lease() as sandbox:
+                return sandbox.call(spec, profile, page_range, timeout=timeout)
+        with _sandboxes_lock:
+            warn, _unisolated_warned = not _unisolated_warned, True
+        if warn:
+            print(f"[WARN] DOCLING_MEMORY_BUDGET_MB={DOCLING_MEMORY_BUDGET_MB} не соблюдается: {reason}; конвертация идёт в процессе бота без изоляции")
+    # Без изоляции пик — это RSS всего процесса бота
+    with PeakRssSampler() as sampler:
+        result = _convert_chunks(spec, profile, page_range)
+    return result, sampler.peak
+
+
+def _conversion_plans(source, filename: str, profile: str) -> list[tuple[str, list]]:
+    """
+    Попытки по возрастанию экономности: (профиль, диапазоны страниц; None — весь документ).
+    Выбранный профиль целиком -> он же батчами страниц (PDF) -> более лёгкие профили.
+    После таймаута батчи того же профиля пропускаются (см. _docling_source_to_documents).
+    """
+    pages = 0
+    if Path(getattr(source, "name", None) or str(source) or filename).suffix.lower() == ".pdf":
+        try:
+            pages = pdf_page_count(source)
+        except Exception:
+            pages = 0
+    batches = None
+    if pages > DOCLING_PAGE_BATCH > 0:
+        batches = [(start, min(start + DOCLING_PAGE_BATCH - 1, pages)) for start in range(1, pages + 1, DOCLING_PAGE_BATCH)]
+    plans = [(profile, [None])]
+    if batches:
+        plans.append((profile, batches))
+    plans.extend((cheaper, batches or [None]) for cheaper in cheaper_profiles(profile))
+    return plans
+
+
+def _docling_source_to_documents(
+    source, user_id: str, filename: str, profile: str | None = None, outline_store: OutlineStore | None = None
+) -> list[Document]:
+    """
+    source — путь к файлу или DocumentStream (файл в памяти). profile=None — автоматический выбор.
+    При нехватке памяти конвертация повторяется дешевле; если не вышло — ConversionError (плейсхолдеров в индексе нет).
+    outline_store — куда сохранить структуру документа (оглавление, таблицы, страницы).
+    """
+    if profile is None:
+        profile, reason = select_profile(source, filename)
+    else:
+        reason = "explicit"
+    spec = _source_spec(source)
+    peak = 0
+    overruns = []
+    # Общий лимит на файл: каждая попытка и каждый батч иначе получали бы свой DOCLING_CONVERT_TIMEOUT
+    file_deadline = time.monotonic() + DOCLING_FILE_TIMEOUT
+    timed_out = set()
+    for plan_profile, ranges in _conversion_plans(source, filename, profile):
+        # Медленный файл батчами того же профиля медленнее не станет: сразу к более лёгкому профилю
+        if plan_profile in timed_out:
+            continue
+        texts = []
+        outlines = []
+        convert_seconds = 0.0
+        try:
+            for page_range in ranges:
+                remaining = file_deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConversionError(
+                        f"Документ {filename} не удалось обработать за {DOCLING_FILE_TIMEOUT:.0f} с: {'; '.join(overruns) or 'слишком долгая конвертация'}",
+                        retryable=False,
+                    )
+                result, used = _run_conversion(spec, plan_profile, page_range, timeout=remaining)
+                peak = max(peak, used)
+                texts.extend(result["texts"])
+                if result.get("outline"):
+                    outlines.append(result["outline"])
+                convert_seconds += result["convert_seconds"]
+        except ConversionError:
+            raise
+        except (MemoryError, TimeoutError) as e:
+            if isinstance(e, TimeoutError):
+                timed_out.add(plan_profile)
+            peak = max(peak, getattr(e, "peak_bytes", 0))
+            batched = f" батчами по {DOCLING_PAGE_BATCH} стр." if ranges[0] else ""
+            overruns.append(f"{plan_profile}{batched}: {e}")
+            print(f"[WARN] Docling {filename}: profile={plan_profile}{batched} — {e}; пробую дешевле")
             continue
-    
-    if not out:
-        # Если ничего не получилось, возвращаем хотя бы сообщение об ошибке
-        out.append(
-            Document(
-                content=f"Документ {filename} обработан, но не удалось извлечь текст. Возможно, документ содержит только изображения или произошла ошибка памяти.",
-                meta={"user_id": str(user_id), "filename": filename, "chunk_index": 0},
-            )
+        except Exception as e:
+            raise ConversionError(f"Документ {filename} не удалось конвертировать: {e}") from e
+        break
+    else:
+        raise ConversionError(
+            f"Документ {filename} не удалось обработать в пределах памяти и времени: {'; '.join(overruns)}", retryable=False
         )
-    
-    return out
+
+    print(
+        f"[INFO] Docling {filename}: profile={plan_profile} ({reason}) convert={convert_seconds:.2f}s "
+        f"peak_rss={peak / MB:.0f}MB page_batches={len(ranges) if ranges[0] else 0} chunks={len(texts)}"
+    )
+    if not texts:
+        raise ConversionError(
+            f"Документ {filename} обработан, но текст не извлечён — возможно, он содержит только изображения.", retryable=False
+        )
+    if outline_store is not None and outlines:
+        # Конец последнего батча — число страниц PDF (pdf_page_count в _conversion_plans)
+        outline = merge_outlines(outlines, pages=ranges[-1][1] if ranges[0] else 0)
+        outline_store.put(str(user_id), filename, outline)
+        print(f"[INFO] Docling {filename}: outline sections={len(outline['sections'])} tables={len(outline['tables'])}")
+    return [
+        Document(
+            content=text,
+            meta={
+                "user_id": str(user_id),
+                "filename": filename,
+                "chunk_index": i,
+                "docling_profile": plan_profile,
+                "convert_seconds": round(convert_seconds, 3),
+                "peak_rss_mb": round(peak / MB, 1),
+            },
+        )
+        for i, text in enumerate(texts)
+    ]
 
 
 @component
 class DoclingLoader:
-    """Конвертирует файлы через Docling в чанки и отдаёт Haystack Document (без docling-haystack)."""
+    """Конвертирует файлы через Docling в чанки и отдаёт Haystack Document (без docling-haystack); структуру сохраняет в outline_store."""
+
+    def __init__(self, outline_store: OutlineStore | None = None):
+        self.outline_store = outline_store or OutlineStore()
 
     @component.output_types(documents=list[Document])
-    def run(self, paths: list[str], user_id: str, filename: str) -> dict:
+    def run(self, user_id: str, filename: str, paths: Optional[list[str]] = None, streams: Optional[list] = None) -> dict:
+        """paths — файлы на диске, streams — DocumentStream (файлы в памяти); можно передать и то, и другое."""
         all_docs = []
-        for path in paths:
-            all_docs.extend(_docling_path_to_documents(path, user_id, filename))
+        for source in list(paths or []) + list(streams or []):
+            all_docs.extend(_docling_source_to_documents(source, user_id, filename, outline_store=self.outline_store))
         return {"documents": all_docs}
 
 
-def docling_path_to_documents(path: str, user_id: str, filename: str) -> list[Document]:
-    """Вспомогательная функция: один файл -> список Haystack Document."""
-    return _docling_path_to_documents(path, user_id, filename)
+def docling_path_to_documents(
+    path, user_id: str, filename: str, profile: str | None = None, outline_store: OutlineStore | None = None
+) -> list[Document]:
+    """Вспомогательная функция: один файл (путь или DocumentStream) -> список Haystack Document."""
+    return _docling_source_to_documents(path, user_id, filename, profile=profile, outline_store=outline_store)
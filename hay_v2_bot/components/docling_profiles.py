@@ -0,0 +1,158 @@
+"""
+Профили конвертации Docling и их автоматический выбор по файлу.
+
+PDF с полноценным текстовым слоем не нуждается в OCR и модели таблиц — для него профиль fast.
+DOCX/HTML/MD/PPTX/XLSX идут через лёгкие декларативные бэкенды Docling (модели не нужны).
+OCR включается только для PDF без текстового слоя на части страниц (balanced, OCR растровых
+областей) или целиком (full, OCR всей страницы), а также для изображений.
+"""
+
+import threading
+from pathlib import Path
+
+from hay_v2_bot.config import (
+    DOCLING_PROFILE,
+    DOCLING_PROBE_PAGES,
+    DOCLING_FAST_TEXT_RATIO,
+    DOCLING_FULL_TEXT_RATIO,
+)
+
+PROFILES = ("fast", "balanced", "full")
+# Страница считается «текстовой», если в её текстовом слое не меньше стольких символов
+_MIN_PAGE_CHARS = 50
+
+_LIGHT_SUFFIXES = {".docx", ".pptx", ".xlsx", ".html", ".htm", ".md", ".csv", ".adoc"}
+_IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"}
+
+_converters = {}
+_lock = threading.Lock()
+
+
+def _source_name(source, filename: str) -> str:
+    return getattr(source, "name", None) or filename or str(source)
+
+
+def _probe_indices(total: int, max_pages: int) -> list[int]:
+    """До max_pages индексов страниц, равномерно по всему документу, включая первую и последнюю."""
+    if total <= max_pages:
+        return list(range(total))
+    if max_pages <= 1:
+        return [0] if max_pages == 1 else []
+    step = (total - 1) / (max_pages - 1)
+    return sorted({round(i * step) for i in range(max_pages)})
+
+
+def detect_pdf_text_layer(source, max_pages: int = DOCLING_PROBE_PAGES) -> dict:
+    """
+    Доля страниц с извлекаемым текстовым слоем среди max_pages страниц, разнесённых по всему документу
+    (через pypdfium2 из зависимостей Docling): сканы в середине или в конце файла тоже попадают в выборку.
+    """
+    import pypdfium2 as pdfium
+
+    stream = getattr(source, "stream", None)
+    if stream is not None:
+        data = stream.getvalue()
+    else:
+        data = str(source)
+    pdf = pdfium.PdfDocument(data)
+    try:
+        total = len(pdf)
+        indices = _probe_indices(total, max_pages)
+        probed = len(indices)
+        text_pages = 0
+        for i in indices:
+            page = pdf[i]
+            textpage = page.get_textpage()
+            try:
+                if len(textpage.get_text_range().strip()) >= _MIN_PAGE_CHARS:
+                    text_pages += 1
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
+    return {"pages": total, "probed": probed, "text_pages": text_pages, "ratio": text_pages / probed if probed else 0.0}
+
+
+def pdf_page_count(source) -> int:
+    import pypdfium2 as pdfium
+
+    stream = getattr(source, "stream", None)
+    pdf = pdfium.PdfDocument(stream.getvalue() if stream is not None else str(source))
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def cheaper_profiles(profile: str) -> list[str]:
+    """Профили легче данного, от ближайшего к самому дешёвому."""
+    return list(reversed(PROFILES[: PROFILES.index(profile)]))
+
+
+def select_profile(source, filename: str, forced: str = DOCLING_PROFILE) -> tuple[str, str]:
+    """Возвращает (профиль, причина выбора)."""
+    if forced in PROFILES:
+        return forced, "forced"
+    suffix = Path(_source_name(source, filename)).suffix.lower()
+    if suffix in _LIGHT_SUFFIXES:
+        return "fast", f"{suffix}: declarative backend"
+    if suffix in _IMAGE_SUFFIXES:
+        return "full", f"{suffix}: image needs OCR"
+    if suffix != ".pdf":
+        return "balanced", f"{suffix or 'no suffix'}: unknown format"
+    try:
+        probe = detect_pdf_text_layer(source)
+    except Exception as e:
+        return "balanced", f"pdf probe failed: {e}"
+    reason = f"text pages {probe['text_pages']}/{probe['probed']}"
+    if probe["ratio"] >= DOCLING_FAST_TEXT_RATIO:
+        return "fast", reason
+    if probe["ratio"] >= DOCLING_FULL_TEXT_RATIO:
+        return "balanced", reason
+    return "full", reason
+
+
+def _build_converter(profile: str):
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode
+    from docling.document_converter import DocumentConverter, ImageFormatOption, PdfFormatOption
+
+    opts = PdfPipelineOptions()
+    backend = None
+    if profile == "fast":
+        from docling.backend.pypdfium2_backend import PyPdfiumDocumentBackend
+        opts.do_ocr = False
+        opts.do_table_structure = False
+        backend = PyPdfiumDocumentBackend
+    elif profile == "balanced":
+        # OCR только растровых областей: страницы с текстовым слоем берутся из него
+        opts.do_ocr = True
+        opts.ocr_options.force_full_page_ocr = False
+        opts.do_table_structure = True
+        opts.table_structure_options.mode = TableFormerMode.FAST
+    else:
+        opts.do_ocr = True
+        opts.ocr_options.force_full_page_ocr = True
+        opts.do_table_structure = True
+        opts.table_structure_options.mode = TableFormerMode.ACCURATE
+
+    pdf_option = PdfFormatOption(pipeline_options=opts, backend=backend) if backend else PdfFormatOption(pipeline_options=opts)
+    return DocumentConverter(
+        format_options={
+            InputFormat.PDF: pdf_option,
+            InputFormat.IMAGE: ImageFormatOption(pipeline_options=opts),
+        }
+    )
+
+
+def get_converter(profile: str):
+    """DocumentConverter для профиля; создаётся один раз, модели остаются загруженными между файлами."""
+    if profile not in PROFILES:
+        raise ValueError(f"Неизвестный профиль Docling {profile!r}, ожидается один из {PROFILES}")
+    with _lock:
+        converter = _converters.get(profile)
+        if converter is None:
+            converter = _build_converter(profile)
+            _converters[profile] = converter
+    return converter
@@ -1,26 +1,367 @@
-from haystack.components.embedders import OpenAIDocumentEmbedder, OpenAITextEmbedder
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator
+
+from haystack import Document, component
+from haystack.components.embedders import OpenAITextEmbedder
 from haystack.utils import Secret
 
-from hay_v2_bot.config import EMBEDDING_DIM, EMBEDDING_MODEL, PROXY_BASE_URL, OPENAI_API_KEY
+from hay_v2_bot.config import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_DIM,
+    EMBEDDING_MODEL,
+    EMBED_BATCH_MAX_INPUTS,
+    EMBED_BATCH_TOKENS,
+    EMBED_CONCURRENCY,
+    EMBED_MAX_RETRIES,
+    LOCAL_EMBEDDING_BATCH,
+    LOCAL_EMBEDDING_MODEL,
+    LOCAL_EMBEDDING_WORKERS,
+    LOCAL_MODEL_DIMS,
+    PROXY_BASE_URL,
+    OPENAI_API_KEY,
+)
+
+# Максимальная (нативная) размерность моделей OpenAI; text-embedding-3-* можно укорачивать до любой меньшей
+MODEL_MAX_DIM = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def _check_dimensions(dimensions: int) -> int:
+    max_dim = MODEL_MAX_DIM.get(EMBEDDING_MODEL)
+    if max_dim is None:
+        return dimensions
+    if dimensions < 1 or dimensions > max_dim:
+        raise ValueError(f"EMBEDDING_DIM={dimensions} вне диапазона 1..{max_dim} для {EMBEDDING_MODEL}")
+    if EMBEDDING_MODEL == "text-embedding-ada-002" and dimensions != max_dim:
+        raise ValueError("text-embedding-ada-002 не поддерживает укороченные эмбеддинги (dimensions)")
+    return dimensions
+
+
+def _check_local_dimensions(model: str, dimensions: int | None) -> int | None:
+    # Локальные модели не обучены на укорачивание векторов: размерность индекса равна размерности модели
+    native = LOCAL_MODEL_DIMS.get(model)
+    if dimensions and native and dimensions != native:
+        raise ValueError(f"EMBEDDING_DIM={dimensions} не совпадает с размерностью {native} локальной модели {model}")
+    return dimensions or native
+
+
+def _default_dimensions(backend: str) -> int | None:
+    # EMBEDDING_DIM относится к настроенному бэкенду; другой бэкенд (бенчмарк сравнения) берёт нативную размерность модели
+    if backend == EMBEDDING_BACKEND:
+        return EMBEDDING_DIM
+    return LOCAL_MODEL_DIMS.get(LOCAL_EMBEDDING_MODEL) if backend == "local" else MODEL_MAX_DIM.get(EMBEDDING_MODEL, 1536)
+
+
+def embedding_version(backend: str, model: str, dimensions: int | None) -> str:
+    """Метка, с которой вектор сохраняется в метаданных: векторы разных версий несравнимы между собой."""
+    return f"{backend}:{model}:{dimensions or 'native'}"
+
+
+def _count_tokens_fn():
+    """Точный подсчёт через tiktoken, если он установлен; иначе оценка сверху по байтам UTF-8 (кириллица — 2 байта)."""
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return lambda text: len(text.encode("utf-8")) // 4 + 1
+
+
+def _token_batches(token_counts: list[int], max_tokens: int, max_inputs: int) -> list[list[int]]:
+    """Индексы текстов подряд, батчами не больше max_tokens токенов и max_inputs текстов (порядок сохраняется)."""
+    batches, current, current_tokens = [], [], 0
+    for i, tokens in enumerate(token_counts):
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class _BatchedDocumentEmbedder:
+    """
+    Общая часть эмбеддеров документов: батчи считаются параллельно в пуле, результаты раскладываются
+    по исходным позициям, каждому документу проставляется метка версии эмбеддинга (meta["embedding_version"]).
+    Наследник передаёт split (разбиение текстов на батчи индексов) и embed_batch (тексты -> (векторы, токены)).
+    """
+
+    backend = ""
+
+    def __init__(
+        self,
+        model: str,
+        dimensions: int | None,
+        concurrency: int,
+        split: Callable[[list[str]], list[list[int]]],
+        embed_batch: Callable[[list[str]], tuple[list[list[float]], int]],
+        logger=None,
+    ):
+        self.model = model
+        self.dimensions = dimensions
+        self._split = split
+        self._embed_batch = embed_batch
+        self.version = embedding_version(self.backend, model, dimensions)
+        self.log = logger or print
+        # Пул общий для всех вызовов: лимит параллельных запросов действует на весь процесс, а не на один файл
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix=f"embed-{self.backend}")
+        self._lock = threading.Lock()
+        self.retries = 0
+
+    def _submit(self, documents: list[Document]) -> tuple[list[list[int]], list]:
+        # Пустой текст API не принимает — пробел даёт валидный вектор, как у OpenAIDocumentEmbedder
+        texts = [d.content or " " for d in documents]
+        batches = self._split(texts)
+        return batches, [self._pool.submit(self._embed_batch, [texts[i] for i in batch]) for batch in batches]
+
+    def _assign(self, documents: list[Document], batch: list[int], vectors: list[list[float]]) -> None:
+        for i, vector in zip(batch, vectors):
+            documents[i].embedding = vector
+            documents[i].meta["embedding_version"] = self.version
+
+    def iter_embedded(self, documents: list[Document]) -> Iterator[list[Document]]:
+        """Отдаёт батчи документов с эмбеддингами по мере готовности — запись может начаться до конца эмбеддинга."""
+        if not documents:
+            return
+        batches, futures = self._submit(documents)
+        by_future = dict(zip(futures, batches))
+        try:
+            for fut in as_completed(futures):
+                vectors, _ = fut.result()
+                batch = by_future[fut]
+                self._assign(documents, batch, vectors)
+                yield [documents[i] for i in batch]
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+    @component.output_types(documents=list[Document], meta=dict)
+    def run(self, documents: list[Document]) -> dict:
+        if not documents:
+            return {"documents": [], "meta": {"model": self.model, "usage": {"total_tokens": 0}}}
+        retries_before = self.retries
+        t0 = time.perf_counter()
+        batches, futures = self._submit(documents)
+        total_tokens = 0
+        try:
+            # Результаты раскладываются по исходным позициям: порядок чанков не зависит от порядка ответов
+            for batch, fut in zip(batches, futures):
+                vectors, tokens = fut.result()
+                total_tokens += tokens
+                self._assign(documents, batch, vectors)
+        except Exception:
+            for fut in futures:
+                fut.cancel()
+            raise
+        seconds = time.perf_counter() - t0
+        rate = len(documents) / seconds if seconds > 0 else 0.0
+        stats = {
+            "embedded": len(documents),
+            "batches": len(batches),
+            "retries": self.retries - retries_before,
+            "seconds": round(seconds, 3),
+            "embeddings_per_second": round(rate, 1),
+        }
+        if len(batches) > 1:
+            self.log(
+                f"[embed:{self.backend}] {len(documents)} docs in {len(batches)} batches, {seconds:.2f}s "
+                f"({rate:.0f} emb/s, tokens={total_tokens}, retries={stats['retries']})"
+            )
+        meta = {"model": self.model, "version": self.version, "usage": {"total_tokens": total_tokens}, "stats": stats}
+        return {"documents": documents, "meta": meta}
+
+
+@component
+class ConcurrentDocumentEmbedder(_BatchedDocumentEmbedder):
+    """
+    Эмбеддинг документов через OpenAI-совместимый API: батчи по бюджету токенов отправляются параллельно
+    (не больше concurrency запросов на экземпляр), порядок документов сохраняется, при ошибке повторяется
+    только упавший батч. Выход совместим с OpenAIDocumentEmbedder (documents, meta).
+    """
+
+    backend = "openai"
+
+    def __init__(
+        self,
+        model: str = EMBEDDING_MODEL,
+        dimensions: int | None = None,
+        concurrency: int = EMBED_CONCURRENCY,
+        batch_tokens: int = EMBED_BATCH_TOKENS,
+        batch_max_inputs: int = EMBED_BATCH_MAX_INPUTS,
+        max_retries: int = EMBED_MAX_RETRIES,
+        logger=None,
+    ):
+        from openai import OpenAI
 
+        super().__init__(model, dimensions, concurrency, self._split_by_tokens, self._request_batch, logger)
+        self.batch_tokens = batch_tokens
+        self.batch_max_inputs = batch_max_inputs
+        self.max_retries = max_retries
+        # Повторы делаем сами и только для упавшего батча
+        self._client = OpenAI(api_key=OPENAI_API_KEY, base_url=PROXY_BASE_URL, max_retries=0)
+        self._count_tokens = _count_tokens_fn()
 
-def get_doc_embedder():
+    def _split_by_tokens(self, texts: list[str]) -> list[list[int]]:
+        return _token_batches([self._count_tokens(t) for t in texts], self.batch_tokens, self.batch_max_inputs)
+
+    def _request_batch(self, texts: list[str]) -> tuple[list[list[float]], int]:
+        import openai
+
+        kwargs = {"dimensions": self.dimensions} if self.dimensions and self.model != "text-embedding-ada-002" else {}
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._client.embeddings.create(model=self.model, input=texts, **kwargs)
+                vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+                return vectors, getattr(response.usage, "total_tokens", 0) or 0
+            except (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = min(30.0, 2 ** attempt) * (0.5 + random.random())
+                self.log(f"[embed] batch of {len(texts)} failed ({type(e).__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+
+class LocalEncoderPool:
+    """
+    Несколько экземпляров ONNX-модели fastembed на CPU. Каждый экземпляр получает свою долю ядер
+    (threads = ядра / workers), батчи разных запросов считаются параллельно без борьбы за одни и те же потоки.
+    Модели грузятся при первом обращении.
+    """
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL, workers: int = LOCAL_EMBEDDING_WORKERS):
+        cpus = os.cpu_count() or 1
+        self.model = model
+        # По умолчанию — экземпляр на каждые два ядра, но не больше четырёх: каждый держит свою копию весов
+        self.workers = workers if workers > 0 else max(1, min(4, cpus // 2))
+        self.threads = max(1, cpus // self.workers)
+        self._free: queue.Queue = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_encoder(self):
+        try:
+            from fastembed import TextEmbedding
+        except ImportError as e:
+            raise ImportError("EMBEDDING_BACKEND=local требует пакет fastembed: pip install fastembed") from e
+        # Модели fastembed — ONNX, для многоязычного MiniLM — квантованная в int8 версия
+        return TextEmbedding(model_name=self.model, threads=self.threads)
+
+    def _acquire(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.workers
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._new_encoder()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._free.get()
+
+    def encode(self, texts: list[str], query: bool = False, batch_size: int = LOCAL_EMBEDDING_BATCH) -> list[list[float]]:
+        encoder = self._acquire()
+        try:
+            # query_embed/passage_embed добавляют префиксы, которых ждут модели вроде e5
+            embed = encoder.query_embed if query else encoder.passage_embed
+            return [vector.tolist() for vector in embed(texts, batch_size=batch_size)]
+        finally:
+            self._free.put(encoder)
+
+
+_local_pools: dict[str, LocalEncoderPool] = {}
+_local_pools_lock = threading.Lock()
+
+
+def get_local_pool(model: str = LOCAL_EMBEDDING_MODEL) -> LocalEncoderPool:
+    """Один пул на модель в процессе: эмбеддер документов и эмбеддер запросов делят экземпляры модели."""
+    with _local_pools_lock:
+        if model not in _local_pools:
+            _local_pools[model] = LocalEncoderPool(model)
+        return _local_pools[model]
+
+
+@component
+class LocalDocumentEmbedder(_BatchedDocumentEmbedder):
+    """Эмбеддинг документов локальной моделью на CPU: батчи по batch_size текстов, по одному на экземпляр модели из пула."""
+
+    backend = "local"
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL, dimensions: int | None = None, batch_size: int = LOCAL_EMBEDDING_BATCH, logger=None):
+        self.encoders = get_local_pool(model)
+        self.batch_size = max(1, batch_size)
+        super().__init__(
+            model, _check_local_dimensions(model, dimensions), self.encoders.workers, self._split_by_size, self._encode_batch, logger
+        )
+
+    def _split_by_size(self, texts: list[str]) -> list[list[int]]:
+        return [list(range(i, min(i + self.batch_size, len(texts)))) for i in range(0, len(texts), self.batch_size)]
+
+    def _encode_batch(self, texts: list[str]) -> tuple[list[list[float]], int]:
+        return self.encoders.encode(texts, batch_size=self.batch_size), 0
+
+
+@component
+class LocalTextEmbedder:
+    """Эмбеддинг запроса локальной моделью; выход совместим с OpenAITextEmbedder (embedding, meta)."""
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL, dimensions: int | None = None):
+        self.model = model
+        self.encoders = get_local_pool(model)
+        self.version = embedding_version("local", model, _check_local_dimensions(model, dimensions))
+
+    @component.output_types(embedding=list[float], meta=dict)
+    def run(self, text: str) -> dict:
+        embedding = self.encoders.encode([text or " "], query=True)[0]
+        return {"embedding": embedding, "meta": {"model": self.model, "version": self.version}}
+
+
+def get_doc_embedder(dimensions: int | None = None, backend: str | None = None):
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "local":
+        return LocalDocumentEmbedder(dimensions=dimensions or _default_dimensions(backend))
+    if backend != "openai":
+        raise ValueError(f"Неизвестный EMBEDDING_BACKEND={backend!r}: ожидается openai или local")
     if not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY или PROXY_API_KEY должен быть задан в .env")
-    return OpenAIDocumentEmbedder(
-        api_key=Secret.from_token(OPENAI_API_KEY),
+    return ConcurrentDocumentEmbedder(
         model=EMBEDDING_MODEL,
-        dimensions=EMBEDDING_DIM,
-        api_base_url=PROXY_BASE_URL,
+        dimensions=_check_dimensions(dimensions or _default_dimensions(backend)),
     )
 
 
-def get_text_embedder():
+def get_text_embedder(dimensions: int | None = None, backend: str | None = None):
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "local":
+        return LocalTextEmbedder(dimensions=dimensions or _default_dimensions(backend))
+    if backend != "openai":
+        raise ValueError(f"Неизвестный EMBEDDING_BACKEND={backend!r}: ожидается openai или local")
     if not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY или PROXY_API_KEY должен быть задан в .env")
     return OpenAITextEmbedder(
         api_key=Secret.from_token(OPENAI_API_KEY),
         model=EMBEDDING_MODEL,
-        dimensions=EMBEDDING_DIM,
+        dimensions=_check_dimensions(dimensions or _default_dimensions(backend)),
         api_base_url=PROXY_BASE_URL,
     )
@@ -0,0 +1,119 @@
+"""
+Горячий слой памяти диалога: последние N реплик каждого пользователя с эмбеддингами прямо в процессе.
+
+Недавние реплики отдаются локально, без запроса в Pinecone. Пользователи вытесняются по LRU,
+когда суммарный объём превышает max_bytes. Эмбеддинги хранятся в формате EMBEDDING_LOCAL_DTYPE.
+"""
+
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from hay_v2_bot.components.vectors import cosine_scores, quantize
+from hay_v2_bot.config import (
+    EMBEDDING_LOCAL_DTYPE,
+    HOT_TIER_TURNS,
+    HOT_TIER_MAX_BYTES,
+    HOT_TIER_ALWAYS,
+    HOT_TIER_MIN_SCORE,
+)
+
+# Накладные расходы Python-объектов на реплику (кортеж, строка, массив) — грубая оценка
+_TURN_OVERHEAD_BYTES = 300
+
+
+class _Turn:
+    __slots__ = ("doc_id", "content", "timestamp", "codes", "scale", "nbytes")
+
+    def __init__(self, doc_id, content: str, timestamp: float, codes, scale):
+        self.doc_id = doc_id
+        self.content = content
+        self.timestamp = timestamp
+        self.codes = codes
+        self.scale = scale
+        self.nbytes = len(content.encode("utf-8")) + _TURN_OVERHEAD_BYTES + (codes.nbytes if codes is not None else 0)
+
+
+class RecentDialogCache:
+    def __init__(
+        self,
+        turns_per_user: int = HOT_TIER_TURNS,
+        max_bytes: int = HOT_TIER_MAX_BYTES,
+        dtype: str = EMBEDDING_LOCAL_DTYPE,
+    ):
+        self.turns_per_user = turns_per_user
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self._users: OrderedDict[str, deque] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evicted_users = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def add(self, user_id: str, content: str, embedding=None, timestamp: float = 0.0, doc_id=None) -> None:
+        codes, scale = (None, None)
+        if embedding is not None:
+            codes, scales = quantize(embedding, self.dtype)
+            codes, scale = codes[0], (float(scales[0]) if scales is not None else None)
+        turn = _Turn(doc_id, content, timestamp, codes, scale)
+        user_id = str(user_id)
+        with self._lock:
+            turns = self._users.get(user_id)
+            if turns is None:
+                turns = deque()
+                self._users[user_id] = turns
+            self._users.move_to_end(user_id)
+            turns.append(turn)
+            self._bytes += turn.nbytes
+            while len(turns) > self.turns_per_user:
+                self._bytes -= turns.popleft().nbytes
+            # LRU по пользователям; текущего (последнего) не вытесняем
+            while self._bytes > self.max_bytes and len(self._users) > 1:
+                _, dropped = self._users.popitem(last=False)
+                self._bytes -= sum(t.nbytes for t in dropped)
+                self.evicted_users += 1
+
+    def _turns(self, user_id: str) -> list[_Turn]:
+        with self._lock:
+            turns = self._users.get(str(user_id))
+            if turns is None:
+                return []
+            self._users.move_to_end(str(user_id))
+            return list(turns)
+
+    def oldest_timestamp(self, user_id: str) -> float | None:
+        turns = self._turns(user_id)
+        return turns[0].timestamp if turns else None
+
+    def context_turns(
+        self,
+        user_id: str,
+        query_embedding=None,
+        always: int = HOT_TIER_ALWAYS,
+        min_score: float = HOT_TIER_MIN_SCORE,
+    ) -> list[str]:
+        """
+        Реплики для контекста в хронологическом порядке: последние `always` — всегда,
+        более ранние из буфера — если похожи на запрос (cos >= min_score).
+        """
+        turns = self._turns(user_id)
+        if not turns:
+            return []
+        keep = [False] * len(turns)
+        for i in range(max(0, len(turns) - always), len(turns)):
+            keep[i] = True
+        if query_embedding is not None:
+            older = [(i, t) for i, t in enumerate(turns) if not keep[i] and t.codes is not None]
+            if older:
+                codes = np.stack([t.codes for _, t in older])
+                scales = None if older[0][1].scale is None else np.asarray([t.scale for _, t in older], dtype=np.float32)
+                for (i, _), score in zip(older, cosine_scores(codes, scales, query_embedding)):
+                    keep[i] = score >= min_score
+        return [t.content for t, k in zip(turns, keep) if k]
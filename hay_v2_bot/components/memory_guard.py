@@ -0,0 +1,224 @@
+"""
+Контроль памяти конвертации Docling: замер RSS (psutil, если установлен, иначе /proc),
+изолированный процесс конвертации с бюджетом памяти — при превышении процесс убивается,
+бот продолжает работать, а вызывающий код может повторить конвертацию дешевле.
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from hay_v2_bot.config import DOCLING_CONVERT_TIMEOUT, DOCLING_MEMORY_BUDGET_MB, DOCLING_SANDBOXES
+
+MB = 1024 * 1024
+_POLL_INTERVAL = 0.1
+# Если после задачи процесс держит больше этой доли бюджета, он перезапускается
+_RECYCLE_RATIO = 0.8
+
+
+class MemoryBudgetExceeded(MemoryError):
+    def __init__(self, peak_bytes: int, budget_bytes: int, detail: str = ""):
+        self.peak_bytes = peak_bytes
+        self.budget_bytes = budget_bytes
+        super().__init__(
+            f"превышен бюджет памяти конвертации: пик {peak_bytes / MB:.0f} МБ при бюджете {budget_bytes / MB:.0f} МБ"
+            + (f" ({detail})" if detail else "")
+        )
+
+
+def rss_bytes(pid: int | None = None) -> int | None:
+    """Текущий RSS процесса (по умолчанию — текущего); None, если измерить нечем."""
+    pid = pid or os.getpid()
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class PeakRssSampler:
+    """Фоновый замер пикового RSS процесса на время блока with."""
+
+    def __init__(self, pid: int | None = None, interval: float = _POLL_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.start = rss_bytes(pid)
+        self.peak = self.start or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = rss_bytes(self.pid)
+            if rss and rss > self.peak:
+                self.peak = rss
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        rss = rss_bytes(self.pid)
+        if rss and rss > self.peak:
+            self.peak = rss
+        return False
+
+
+def _sandbox_main(conn, target):
+    """Цикл изолированного процесса: (args, kwargs) -> target(*args, **kwargs)."""
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        args, kwargs = request
+        try:
+            conn.send({"ok": True, "result": target(*args, **kwargs)})
+        except MemoryError as e:
+            conn.send({"ok": False, "memory": True, "error": str(e) or "MemoryError"})
+        except Exception as e:
+            conn.send({"ok": False, "memory": False, "error": f"{type(e).__name__}: {e}"})
+
+
+class ConversionSandbox:
+    """
+    Один изолированный spawn-процесс, выполняющий target. Родитель опрашивает RSS процесса и убивает его
+    при превышении бюджета; следующий вызов поднимает процесс заново.
+    """
+
+    def __init__(self, target, budget_mb: int = DOCLING_MEMORY_BUDGET_MB, timeout: float = DOCLING_CONVERT_TIMEOUT):
+        self.target = target
+        self.budget = budget_mb * MB
+        self.timeout = timeout
+        self._ctx = mp.get_context("spawn")
+        self._proc = None
+        self._conn = None
+
+    def _ensure_started(self):
+        if self._proc is not None and self._proc.is_alive():
+            return
+        self.stop()
+        parent, child = self._ctx.Pipe()
+        self._proc = self._ctx.Process(target=_sandbox_main, args=(child, self.target), name="docling-sandbox", daemon=True)
+        self._proc.start()
+        child.close()
+        self._conn = parent
+
+    def stop(self, kill: bool = False):
+        proc, conn = self._proc, self._conn
+        self._proc = self._conn = None
+        if conn is not None:
+            try:
+                if not kill:
+                    conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        if proc is not None:
+            if kill:
+                proc.kill()
+            proc.join(5)
+            if proc.is_alive():
+                proc.kill()
+                proc.join()
+
+    def call(self, *args, timeout: float | None = None, **kwargs) -> tuple:
+        """Возвращает (результат, пиковый RSS процесса в байтах за время вызова); timeout — меньше self.timeout для этого вызова."""
+        self._ensure_started()
+        pid = self._proc.pid
+        peak = rss_bytes(pid) or 0
+        timeout = min(self.timeout, timeout) if timeout is not None else self.timeout
+        deadline = time.monotonic() + timeout
+        self._conn.send((args, kwargs))
+        while True:
+            try:
+                ready = self._conn.poll(_POLL_INTERVAL)
+            except (EOFError, OSError):
+                ready = False
+            if ready:
+                try:
+                    reply = self._conn.recv()
+                    break
+                except (EOFError, OSError):
+                    reply = None
+            rss = rss_bytes(pid)
+            if rss and rss > peak:
+                peak = rss
+            if rss and rss > self.budget:
+                self.stop(kill=True)
+                raise MemoryBudgetExceeded(peak, self.budget)
+            if not self._proc.is_alive() or (ready and reply is None):
+                exitcode = self._proc.exitcode
+                self.stop(kill=True)
+                # SIGKILL без нашего участия — почти всегда OOM killer
+                raise MemoryBudgetExceeded(peak, self.budget, f"процесс конвертации завершился, код {exitcode}")
+            if time.monotonic() > deadline:
+                self.stop(kill=True)
+                raise TimeoutError(f"конвертация не уложилась в {timeout:.0f} с")
+        idle = rss_bytes(pid)
+        if idle and idle > self.budget * _RECYCLE_RATIO:
+            self.stop()
+        if not reply["ok"]:
+            if reply["memory"]:
+                raise MemoryBudgetExceeded(peak, self.budget, reply["error"])
+            raise RuntimeError(reply["error"])
+        return reply["result"], peak
+
+
+class SandboxPool:
+    """Несколько изолированных процессов для параллельной конвертации (пакетная индексация)."""
+
+    def __init__(self, target, size: int = DOCLING_SANDBOXES, budget_mb: int = DOCLING_MEMORY_BUDGET_MB):
+        self._free: queue.Queue = queue.Queue()
+        for _ in range(max(1, size)):
+            self._free.put(ConversionSandbox(target, budget_mb=budget_mb))
+
+    @contextmanager
+    def lease(self):
+        sandbox = self._free.get()
+        try:
+            yield sandbox
+        finally:
+            self._free.put(sandbox)
+
+
+def check_rss_source() -> None:
+    """Бюджет памяти без замера RSS не работает: при старте это ошибка, а не тихое отключение изоляции."""
+    if DOCLING_MEMORY_BUDGET_MB > 0 and rss_bytes() is None:
+        raise RuntimeError(
+            f"DOCLING_MEMORY_BUDGET_MB={DOCLING_MEMORY_BUDGET_MB}, но RSS процесса измерить нечем (нет /proc и psutil): "
+            "установи psutil (pip install psutil) или задай DOCLING_MEMORY_BUDGET_MB=0"
+        )
+
+
+def sandbox_unavailable_reason() -> str | None:
+    """Почему конвертация не может идти в изолированном процессе; None — может."""
+    if mp.current_process().daemon:
+        return "демон-процесс не может порождать дочерние процессы"
+    if rss_bytes() is None:
+        return "нечем измерить RSS (нет /proc и psutil)"
+    return None
+
+
+def sandbox_available() -> bool:
+    return sandbox_unavailable_reason() is None
@@ -0,0 +1,104 @@
+"""
+Офлайн-замена Pinecone для бенчмарков и локальных проверок: InMemoryDocumentStore с фильтрами
+в синтаксисе Pinecone, искусственной задержкой, лимитом параллельных запросов и инъекцией ошибок.
+"""
+
+import math
+import random
+import threading
+import time
+
+from haystack import Document, component
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+from haystack.document_stores.types import DuplicatePolicy
+
+
+class SimulatedLatency:
+    """Задержка (логнормальная вокруг медианы), лимит параллелизма и доля ошибок вызова удалённого сервиса."""
+
+    def __init__(self, median_ms: float = 0.0, sigma: float = 0.5, concurrency: int = 0, error_rate: float = 0.0, name: str = "store", on_call=None):
+        self.name = name
+        self.median = median_ms / 1000
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.on_call = on_call
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency > 0 else None
+
+    def call(self, fn=None):
+        t0 = time.perf_counter()
+        try:
+            if self._slots:
+                self._slots.acquire()
+            try:
+                if self.median > 0:
+                    time.sleep(random.lognormvariate(math.log(self.median), self.sigma))
+                if self.error_rate and random.random() < self.error_rate:
+                    raise RuntimeError(f"{self.name}: injected upstream error")
+                return fn() if fn else None
+            finally:
+                if self._slots:
+                    self._slots.release()
+        finally:
+            if self.on_call:
+                self.on_call(self.name, time.perf_counter() - t0)
+
+
+def to_inmemory_filters(filters):
+    """Фильтры в синтаксисе Pinecone (поля метаданных без префикса) -> синтаксис InMemoryDocumentStore."""
+    if not filters:
+        return filters
+    if "conditions" in filters:
+        return {**filters, "conditions": [to_inmemory_filters(c) for c in filters["conditions"]]}
+    field = filters["field"]
+    if field not in ("id", "content") and not field.startswith("meta."):
+        field = f"meta.{field}"
+    return {**filters, "field": field}
+
+
+class OfflineDocumentStore:
+    """Интерфейс PineconeDocumentStore, который использует бот: upsert по ID, удаление, фильтры, поиск по вектору."""
+
+    def __init__(self, write_latency: SimulatedLatency | None = None, query_latency: SimulatedLatency | None = None):
+        self.store = InMemoryDocumentStore(embedding_similarity_function="cosine")
+        self.write_latency = write_latency or SimulatedLatency(name="store")
+        self.query_latency = query_latency or SimulatedLatency(name="retrieve")
+        self._lock = threading.Lock()
+        self.upserts = 0
+
+    def write_documents(self, documents: list[Document], policy: DuplicatePolicy = DuplicatePolicy.OVERWRITE) -> int:
+        # Как у Pinecone: запись — upsert, повтор с тем же ID перезаписывает вектор
+        def _write():
+            with self._lock:
+                self.upserts += len(documents)
+                return self.store.write_documents(documents, policy=policy if policy != DuplicatePolicy.NONE else DuplicatePolicy.OVERWRITE)
+        return self.write_latency.call(_write)
+
+    def delete_documents(self, document_ids: list[str]) -> None:
+        def _delete():
+            with self._lock:
+                self.store.delete_documents(document_ids)
+        self.write_latency.call(_delete)
+
+    def count_documents(self) -> int:
+        return self.store.count_documents()
+
+    def filter_documents(self, filters: dict | None = None) -> list[Document]:
+        return self.query_latency.call(lambda: self.store.filter_documents(to_inmemory_filters(filters)))
+
+    def embedding_retrieval(self, query_embedding: list[float], filters: dict | None = None, top_k: int = 10) -> list[Document]:
+        return self.query_latency.call(
+            lambda: self.store.embedding_retrieval(query_embedding=query_embedding, filters=to_inmemory_filters(filters), top_k=top_k)
+        )
+
+
+@component
+class OfflineEmbeddingRetriever:
+    """Замена PineconeEmbeddingRetriever поверх OfflineDocumentStore."""
+
+    def __init__(self, document_store: OfflineDocumentStore, top_k: int = 10):
+        self.document_store = document_store
+        self.top_k = top_k
+
+    @component.output_types(documents=list[Document])
+    def run(self, query_embedding: list[float], filters: dict | None = None, top_k: int | None = None) -> dict:
+        return {"documents": self.document_store.embedding_retrieval(query_embedding, filters=filters, top_k=top_k or self.top_k)}
@@ -0,0 +1,276 @@
+"""
+Структура сконвертированного документа (оглавление, таблицы, страницы), сохранённая локально рядом с индексом.
+
+В Pinecone лежит только плоский текст чанков; вопросы вида «что в разделе 3?» или «таблица на странице 12»
+решаются по структуре напрямую: раздел или таблица целиком, без поиска по 15 похожим чанкам.
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+from haystack import component
+
+from hay_v2_bot.config import ROOT_DIR
+
+OUTLINE_DIR = ROOT_DIR / ".outlines"
+# Сколько текста раздела и таблицы хранить и отдавать агенту
+SECTION_TEXT_MAX = 6000
+TABLE_TEXT_MAX = 8000
+_RESULT_MAX = 12000
+
+
+def _page(item) -> int | None:
+    prov = getattr(item, "prov", None) or []
+    return prov[0].page_no if prov else None
+
+
+def extract_outline(doc) -> dict:
+    """
+    DoclingDocument -> {"pages", "last_page", "sections", "tables", "preamble"}.
+    Разделы нумеруются по уровням заголовков ("2", "2.1", ...), у каждого — страница и текст до следующего заголовка.
+    preamble — текст до первого заголовка: у батча страниц это продолжение последнего раздела предыдущего батча.
+    """
+    from docling_core.types.doc import SectionHeaderItem, TableItem, TextItem, TitleItem
+
+    sections: list[dict] = []
+    tables: list[dict] = []
+    counters: list[int] = []
+    current = None
+    preamble = ""
+    for item, _ in doc.iterate_items():
+        if isinstance(item, (SectionHeaderItem, TitleItem)):
+            level = 1 if isinstance(item, TitleItem) else max(1, int(getattr(item, "level", 1) or 1))
+            del counters[level:]
+            counters.extend([0] * (level - len(counters)))
+            counters[level - 1] += 1
+            current = {
+                "ref": ".".join(str(n) for n in counters),
+                "title": (item.text or "").strip(),
+                "level": level,
+                "page": _page(item),
+                "text": "",
+            }
+            sections.append(current)
+        elif isinstance(item, TableItem):
+            try:
+                markdown = item.export_to_markdown(doc=doc)
+            except Exception:
+                markdown = ""
+            tables.append(
+                {
+                    "ref": f"T{len(tables) + 1}",
+                    "caption": (item.caption_text(doc) or "").strip() if hasattr(item, "caption_text") else "",
+                    "page": _page(item),
+                    "section": current["ref"] if current else None,
+                    "markdown": markdown[:TABLE_TEXT_MAX],
+                }
+            )
+        elif isinstance(item, TextItem):
+            text = (item.text or "").strip()
+            if not text:
+                continue
+            if current is None:
+                if len(preamble) < SECTION_TEXT_MAX:
+                    preamble = (preamble + "\n" + text).strip()[:SECTION_TEXT_MAX]
+            elif len(current["text"]) < SECTION_TEXT_MAX:
+                current["text"] = (current["text"] + "\n" + text).strip()[:SECTION_TEXT_MAX]
+    # Ключи doc.pages — номера страниц исходного файла, в том числе при конвертации с page_range
+    pages = getattr(doc, "pages", None) or {}
+    return {"pages": len(pages), "last_page": max(pages, default=0), "sections": sections, "tables": tables, "preamble": preamble}
+
+
+def merge_outlines(parts: list[dict], pages: int = 0) -> dict:
+    """
+    Outline документа, сконвертированного батчами страниц: разделы и таблицы подряд, ссылки пересчитываются.
+    Текст и таблицы батча до его первого заголовка относятся к последнему разделу предыдущих батчей.
+    pages — число страниц файла, если известно; иначе последняя страница, встреченная в батчах.
+    """
+    sections, tables = [], []
+    top = 0
+    for part in parts:
+        offset = top
+        # Батч начинается с середины раздела: его начало — продолжение последнего раздела
+        carried = sections[-1] if sections else None
+        preamble = part.get("preamble") or ""
+        if carried is not None and preamble and len(carried["text"]) < SECTION_TEXT_MAX:
+            carried["text"] = (carried["text"] + "\n" + preamble).strip()[:SECTION_TEXT_MAX]
+        for s in part["sections"]:
+            head, _, tail = s["ref"].partition(".")
+            ref = str(int(head) + offset) + (f".{tail}" if tail else "")
+            top = max(top, int(head) + offset)
+            sections.append({**s, "ref": ref})
+        for t in part["tables"]:
+            section = t["section"]
+            if section:
+                head, _, tail = section.partition(".")
+                section = str(int(head) + offset) + (f".{tail}" if tail else "")
+            elif carried is not None:
+                section = carried["ref"]
+            tables.append({**t, "ref": f"T{len(tables) + 1}", "section": section})
+    last_page = max((p.get("last_page") or p["pages"] for p in parts), default=0)
+    return {"pages": max(pages, last_page), "sections": sections, "tables": tables}
+
+
+class OutlineStore:
+    """Outline файла: JSON на пару (user_id, filename), как манифест чанков."""
+
+    def __init__(self, root=OUTLINE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: str, filename: str):
+        name = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+        return self.root / str(user_id) / f"{name}.json"
+
+    def put(self, user_id: str, filename: str, outline: dict) -> None:
+        path = self._path(user_id, filename)
+        with self._lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"filename": filename, "saved_at": time.time(), **outline}, ensure_ascii=False), encoding="utf-8")
+            tmp.replace(path)
+
+    def get(self, user_id: str, filename: str) -> dict | None:
+        path = self._path(user_id, filename)
+        if not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"[WARN] Не удалось прочитать outline {path}: {e}")
+            return None
+
+    def delete(self, user_id: str, filename: str) -> bool:
+        path = self._path(user_id, filename)
+        with self._lock:
+            if path.exists():
+                path.unlink()
+                return True
+        return False
+
+    def files(self, user_id: str) -> list[dict]:
+        """Файлы пользователя со структурой, последние загруженные первыми."""
+        out = []
+        for path in (self.root / str(user_id)).glob("*.json"):
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except Exception:
+                continue
+            out.append(
+                {
+                    "filename": data.get("filename"),
+                    "pages": data.get("pages", 0),
+                    "sections": len(data.get("sections", [])),
+                    "tables": len(data.get("tables", [])),
+                    "saved_at": data.get("saved_at", 0),
+                }
+            )
+        return sorted(out, key=lambda f: f["saved_at"], reverse=True)
+
+
+def _format_outline(outline: dict) -> str:
+    lines = [f"{outline['filename']}: страниц {outline.get('pages', 0)}, разделов {len(outline['sections'])}, таблиц {len(outline['tables'])}"]
+    for s in outline["sections"]:
+        page = f" (с. {s['page']})" if s.get("page") else ""
+        lines.append(f"{'  ' * (s['level'] - 1)}{s['ref']}. {s['title']}{page}")
+    for t in outline["tables"]:
+        page = f", с. {t['page']}" if t.get("page") else ""
+        lines.append(f"{t['ref']}: {t['caption'] or 'таблица'}{page}")
+    return "\n".join(lines)
+
+
+def _find_section(outline: dict, ref: str, query: str) -> dict | None:
+    sections = outline["sections"]
+    ref = (ref or "").strip().rstrip(".")
+    if ref:
+        match = next((s for s in sections if s["ref"] == ref), None)
+        if match:
+            return match
+    query = (query or ref).strip().lower()
+    if query:
+        return next((s for s in sections if query in s["title"].lower()), None)
+    return None
+
+
+def _find_table(outline: dict, ref: str, page: int) -> list[dict]:
+    ref = (ref or "").strip().upper()
+    if ref and not ref.startswith("T"):
+        ref = f"T{ref}"
+    if ref:
+        return [t for t in outline["tables"] if t["ref"] == ref]
+    if page:
+        return [t for t in outline["tables"] if t.get("page") == page]
+    return []
+
+
+@component
+class DocumentStructureTool:
+    """Поиск по структуре загруженных документов пользователя: оглавление, раздел, таблица, содержимое страницы."""
+
+    def __init__(self, outline_store: OutlineStore | None = None):
+        self.outline_store = outline_store or OutlineStore()
+
+    def _resolve(self, user_id: str, filename: str) -> tuple[dict | None, str]:
+        files = self.outline_store.files(user_id)
+        if not files:
+            return None, "У пользователя нет загруженных документов со структурой."
+        names = [f["filename"] for f in files]
+        if filename:
+            wanted = filename.strip().lower()
+            match = next((n for n in names if n.lower() == wanted), None) or next((n for n in names if wanted in n.lower()), None)
+            if match is None:
+                return None, f"Файл {filename!r} не найден. Загруженные файлы: {', '.join(names)}"
+        else:
+            match = names[0]
+        return self.outline_store.get(user_id, match), ""
+
+    @component.output_types(result=str)
+    def run(self, user_id: str, action: str, filename: str = "", ref: str = "", page: int = 0, query: str = "") -> dict:
+        """
+        Ищет разделы и таблицы загруженного документа по структуре.
+
+        :param user_id: ID пользователя (подставляется автоматически).
+        :param action: files — список файлов; outline — оглавление файла; section — текст раздела; table — таблица; page — что на странице.
+        :param filename: Имя файла или его часть; пусто — последний загруженный файл.
+        :param ref: Номер раздела ("3", "2.1") или таблицы ("T2", "2").
+        :param page: Номер страницы (для table и page).
+        :param query: Часть заголовка раздела, если номер неизвестен.
+        """
+        if action == "files":
+            files = self.outline_store.files(user_id)
+            if not files:
+                return {"result": "Загруженных документов нет."}
+            return {"result": "\n".join(f"{f['filename']}: страниц {f['pages']}, разделов {f['sections']}, таблиц {f['tables']}" for f in files)}
+        outline, error = self._resolve(user_id, filename)
+        if outline is None:
+            return {"result": error}
+        if action == "outline":
+            return {"result": _format_outline(outline)[:_RESULT_MAX]}
+        if action == "section":
+            section = _find_section(outline, ref, query)
+            if section is None:
+                return {"result": f"Раздел не найден. Оглавление:\n{_format_outline(outline)[:_RESULT_MAX]}"}
+            tables = [t for t in outline["tables"] if t.get("section") == section["ref"]]
+            page = f", с. {section['page']}" if section.get("page") else ""
+            body = section["text"] or "(текста под заголовком нет)"
+            extra = "".join(f"\n\n{t['ref']} {t['caption']}\n{t['markdown']}" for t in tables)
+            return {"result": f"{outline['filename']} — {section['ref']}. {section['title']}{page}\n{body}{extra}"[:_RESULT_MAX]}
+        if action == "table":
+            tables = _find_table(outline, ref, page)
+            if not tables:
+                listing = ", ".join(f"{t['ref']} (с. {t['page']})" for t in outline["tables"]) or "таблиц нет"
+                return {"result": f"Таблица не найдена. Таблицы в {outline['filename']}: {listing}"}
+            return {"result": "\n\n".join(f"{t['ref']} {t['caption']} (с. {t['page']})\n{t['markdown']}" for t in tables)[:_RESULT_MAX]}
+        if action == "page":
+            if not page:
+                return {"result": "Укажи номер страницы."}
+            sections = [s for s in outline["sections"] if s.get("page") == page]
+            tables = [t for t in outline["tables"] if t.get("page") == page]
+            if not sections and not tables:
+                return {"result": f"На странице {page} нет заголовков и таблиц (или такой страницы нет)."}
+            parts = [f"{s['ref']}. {s['title']}\n{s['text']}" for s in sections]
+            parts += [f"{t['ref']} {t['caption']}\n{t['markdown']}" for t in tables]
+            return {"result": "\n\n".join(parts)[:_RESULT_MAX]}
+        return {"result": f"Неизвестное действие {action!r}: ожидается files, outline, section, table или page."}
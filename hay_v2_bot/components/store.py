@@ -9,13 +9,14 @@ def _pinecone_api_key():
     return os.getenv("PINECONE_API_KEY") or os.getenv("PYNECONE_API_KEY")
 
 
-def get_document_store():
+def get_document_store(index: str | None = None, dimension: int | None = None):
+    """Pinecone-хранилище; индекс создаётся с размерностью EMBEDDING_DIM (или переданной явно)."""
     api_key = _pinecone_api_key()
     if api_key:
         os.environ["PINECONE_API_KEY"] = api_key
     return PineconeDocumentStore(
-        index=PINECONE_INDEX_NAME,
+        index=index or PINECONE_INDEX_NAME,
         metric="cosine",
-        dimension=EMBEDDING_DIM,
+        dimension=dimension or EMBEDDING_DIM,
         spec={"serverless": {"region": "us-east-1", "cloud": "aws"}},
     )
@@ -6,6 +6,7 @@ from haystack.tools.component_tool import ComponentTool
 from openai import OpenAI
 
 from hay_v2_bot.config import OPENAI_MODEL, OPENAI_API_KEY, PROXY_BASE_URL
+from hay_v2_bot.components.outline import DocumentStructureTool
 
 
 @component
@@ -71,3 +72,12 @@ dog_image_tool = ComponentTool(
     component=DogImageDescribeTool(),
     outputs_to_string={"source": "result"},
 )
+
+document_structure_tool = ComponentTool(
+    name="document_structure",
+    description="Найти раздел, таблицу или страницу в загруженных пользователем документах по структуре: оглавление файла (action=outline), текст раздела по номеру или заголовку (action=section), таблица по номеру или странице (action=table), содержимое страницы (action=page), список файлов (action=files). Вызывай для вопросов о конкретных разделах, таблицах, страницах и оглавлении — это точнее, чем фрагменты из контекста.",
+    component=DocumentStructureTool(),
+    outputs_to_string={"source": "result"},
+    # user_id берётся из состояния агента (agent.run(..., user_id=...)), модель его не задаёт
+    inputs_from_state={"user_id": "user_id"},
+)
@@ -0,0 +1,98 @@
+"""
+Локальное хранение векторов: укорачивание эмбеддингов text-embedding-3 и квантование float16/int8.
+
+Векторы нормализуются, поэтому скалярное произведение = косинусное сходство.
+int8 хранится с масштабом на строку (симметричное квантование).
+"""
+
+import numpy as np
+
+from hay_v2_bot.config import EMBEDDING_LOCAL_DTYPE
+
+DTYPES = ("float32", "float16", "int8")
+
+
+def normalize(vectors) -> np.ndarray:
+    arr = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(arr, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return arr / norms
+
+
+def truncate_embeddings(vectors, dim: int) -> np.ndarray:
+    """Укорачивает эмбеддинги text-embedding-3 до dim и перенормирует (эквивалент параметра dimensions API)."""
+    return normalize(np.asarray(vectors, dtype=np.float32)[..., :dim])
+
+
+def quantize(vectors, dtype: str = EMBEDDING_LOCAL_DTYPE) -> tuple[np.ndarray, np.ndarray | None]:
+    """Нормализует и квантует векторы. Для int8 возвращает ещё и масштаб на строку, иначе None."""
+    if dtype not in DTYPES:
+        raise ValueError(f"Неизвестный dtype {dtype!r}, ожидается один из {DTYPES}")
+    vecs = normalize(vectors)
+    if vecs.ndim == 1:
+        vecs = vecs[None, :]
+    if dtype != "int8":
+        return vecs.astype(dtype), None
+    scales = np.abs(vecs).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vecs / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def cosine_scores(codes: np.ndarray, scales: np.ndarray | None, query) -> np.ndarray:
+    """Косинусное сходство запроса с квантованными векторами."""
+    sims = codes.astype(np.float32) @ normalize(query)
+    if scales is not None:
+        sims *= scales
+    return sims
+
+
+class LocalVectorIndex:
+    """Небольшой in-memory индекс с косинусным поиском и опциональным квантованием."""
+
+    def __init__(self, dtype: str = EMBEDDING_LOCAL_DTYPE):
+        if dtype not in DTYPES:
+            raise ValueError(f"Неизвестный dtype {dtype!r}, ожидается один из {DTYPES}")
+        self.dtype = dtype
+        self.ids: list[str] = []
+        self._codes = None
+        self._scales = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, ids: list[str], vectors) -> None:
+        codes, scales = quantize(vectors, self.dtype)
+        self.ids.extend(ids)
+        self._codes = codes if self._codes is None else np.vstack([self._codes, codes])
+        if scales is not None:
+            self._scales = scales if self._scales is None else np.concatenate([self._scales, scales])
+
+    def remove(self, ids) -> None:
+        drop = set(ids)
+        keep = [i for i, doc_id in enumerate(self.ids) if doc_id not in drop]
+        self.ids = [self.ids[i] for i in keep]
+        if self._codes is not None:
+            self._codes = self._codes[keep]
+        if self._scales is not None:
+            self._scales = self._scales[keep]
+
+    def scores(self, query) -> np.ndarray:
+        if self._codes is None or not self.ids:
+            return np.zeros(0, dtype=np.float32)
+        return cosine_scores(self._codes, self._scales, query)
+
+    def search(self, query, top_k: int = 10) -> list[tuple[str, float]]:
+        sims = self.scores(query)
+        if sims.size == 0:
+            return []
+        k = min(top_k, sims.size)
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [(self.ids[i], float(sims[i])) for i in top]
+
+    @property
+    def nbytes(self) -> int:
+        size = 0 if self._codes is None else self._codes.nbytes
+        if self._scales is not None:
+            size += self._scales.nbytes
+        return size
@@ -0,0 +1,133 @@
+"""
+Запись в векторное хранилище, совмещённая с эмбеддингом: батчи эмбеддингов по мере готовности
+собираются в upsert-батчи (по числу документов и размеру запроса) и пишутся параллельно.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from haystack import Document, component
+from haystack.document_stores.types import DuplicatePolicy
+
+from hay_v2_bot.config import UPSERT_BATCH_BYTES, UPSERT_BATCH_SIZE, UPSERT_CONCURRENCY, UPSERT_MAX_RETRIES
+
+# Общий пул: лимит параллельных upsert действует на весь процесс
+_pool = ThreadPoolExecutor(max_workers=max(1, UPSERT_CONCURRENCY), thread_name_prefix="upsert")
+
+# Оценка размера одного вектора в запросе: float в JSON ~12 байт плюс служебные поля и метаданные
+_BYTES_PER_DIM = 12
+_META_OVERHEAD = 256
+
+
+def payload_bytes(doc: Document) -> int:
+    return len(doc.embedding or []) * _BYTES_PER_DIM + len((doc.content or "").encode("utf-8")) + _META_OVERHEAD
+
+
+@component
+class PipelinedDocumentWriter:
+    """
+    Эмбеддинг + запись. Если эмбеддер умеет отдавать батчи по мере готовности (iter_embedded),
+    upsert первого батча стартует, пока остальные ещё эмбеддятся. Запись идемпотентна по ID документа
+    (DuplicatePolicy.OVERWRITE), поэтому упавший upsert-батч повторяется целиком без риска дублей.
+    embedder=None — документы уже с эмбеддингами, компонент только пишет.
+    """
+
+    def __init__(
+        self,
+        document_store,
+        embedder=None,
+        batch_size: int = UPSERT_BATCH_SIZE,
+        batch_bytes: int = UPSERT_BATCH_BYTES,
+        max_retries: int = UPSERT_MAX_RETRIES,
+        logger=None,
+    ):
+        self.document_store = document_store
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.max_retries = max_retries
+        self.log = logger or print
+
+    def _upsert(self, batch: list[Document]) -> tuple[int, int]:
+        """(записано, повторов)."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                written = self.document_store.write_documents(batch, policy=DuplicatePolicy.OVERWRITE)
+                return (written if isinstance(written, int) else len(batch)), attempt
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(10.0, 0.5 * 2 ** attempt)
+                self.log(f"[upsert] batch of {len(batch)} failed ({type(e).__name__}: {e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _embedded_batches(self, documents: list[Document]):
+        if self.embedder is None:
+            yield documents
+        elif hasattr(self.embedder, "iter_embedded"):
+            yield from self.embedder.iter_embedded(documents)
+        else:
+            yield self.embedder.run(documents=documents).get("documents") or []
+
+    @component.output_types(documents=list[Document], documents_written=int, stats=dict)
+    def run(self, documents: list[Document]) -> dict:
+        if not documents:
+            return {"documents": [], "documents_written": 0, "stats": {"written": 0, "batches": 0}}
+        t0 = time.perf_counter()
+        futures = []
+        embedded: list[Document] = []
+        pending: list[Document] = []
+        pending_bytes = 0
+        first_write = None
+
+        def flush():
+            nonlocal pending, pending_bytes, first_write
+            if pending:
+                first_write = first_write or time.perf_counter()
+                futures.append(_pool.submit(self._upsert, pending))
+                pending, pending_bytes = [], 0
+
+        try:
+            for batch in self._embedded_batches(documents):
+                for doc in batch:
+                    size = payload_bytes(doc)
+                    if pending and (len(pending) >= self.batch_size or pending_bytes + size > self.batch_bytes):
+                        flush()
+                    pending.append(doc)
+                    pending_bytes += size
+                    embedded.append(doc)
+                # Полный upsert-батч уходит сразу; неполный ждёт следующего батча эмбеддингов
+                if len(pending) >= self.batch_size:
+                    flush()
+            t_embedded = time.perf_counter()
+            flush()
+            written, retries = 0, 0
+            for fut in futures:
+                n, r = fut.result()
+                written += n
+                retries += r
+        except Exception:
+            for fut in futures:
+                fut.cancel()
+            raise
+        t1 = time.perf_counter()
+        write_seconds = t1 - first_write if first_write else 0.0
+        stats = {
+            "written": written,
+            "batches": len(futures),
+            "retries": retries,
+            "embed_seconds": round(t_embedded - t0, 3),
+            "write_seconds": round(write_seconds, 3),
+            "total_seconds": round(t1 - t0, 3),
+            # Сколько записи пришлось на время эмбеддинга
+            "overlap_seconds": round(max(0.0, t_embedded - first_write) if first_write else 0.0, 3),
+            "upserts_per_second": round(written / write_seconds, 1) if write_seconds > 0 else 0.0,
+        }
+        if len(futures) > 1:
+            self.log(
+                f"[upsert] {written} docs in {len(futures)} batches, write={write_seconds:.2f}s "
+                f"({stats['upserts_per_second']:.0f} upserts/s, overlap={stats['overlap_seconds']:.2f}s, retries={retries})"
+            )
+        # В исходном порядке (эмбеддер с iter_embedded проставляет векторы в те же объекты)
+        out = documents if self.embedder is None or hasattr(self.embedder, "iter_embedded") else embedded
+        return {"documents": out, "documents_written": written, "stats": stats}
@@ -7,20 +7,111 @@ load_dotenv(Path(__file__).resolve().parent.parent / ".env")
 load_dotenv()
 
 # Embedding
+# Бэкенд: openai (через прокси) | local (ONNX-модель на CPU через fastembed, pip install fastembed)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
-EMBEDDING_DIM = 1536
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+# Размерности локальных моделей; для модели не из списка задай EMBEDDING_DIM явно
+LOCAL_MODEL_DIMS = {
+    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2": 384,
+    "sentence-transformers/paraphrase-multilingual-mpnet-base-v2": 768,
+    "intfloat/multilingual-e5-large": 1024,
+    "BAAI/bge-small-en-v1.5": 384,
+    "BAAI/bge-base-en-v1.5": 768,
+}
+# Размерность эмбеддингов: text-embedding-3-* поддерживают укороченные векторы (параметр dimensions),
+# у локальной модели размерность своя
+EMBEDDING_DIM = int(
+    os.getenv("EMBEDDING_DIM") or (LOCAL_MODEL_DIMS.get(LOCAL_EMBEDDING_MODEL, 384) if EMBEDDING_BACKEND == "local" else 1536)
+)
+# Локальный бэкенд: экземпляров модели (0 — по числу ядер) и текстов в батче
+LOCAL_EMBEDDING_WORKERS = int(os.getenv("LOCAL_EMBEDDING_WORKERS", "0"))
+LOCAL_EMBEDDING_BATCH = int(os.getenv("LOCAL_EMBEDDING_BATCH", "32"))
+# Формат векторов, которые держим локально (в памяти процесса): float32 | float16 | int8
+EMBEDDING_LOCAL_DTYPE = os.getenv("EMBEDDING_LOCAL_DTYPE", "float32")
+# Эмбеддинг чанков документов: параллельных запросов, токенов и текстов на запрос, повторов упавшего батча
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "20000"))
+EMBED_BATCH_MAX_INPUTS = int(os.getenv("EMBED_BATCH_MAX_INPUTS", "256"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+# Запись в векторное хранилище: документов и байт на upsert (у Pinecone лимит 2 МБ на запрос), параллельных upsert, повторов
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+UPSERT_BATCH_BYTES = int(os.getenv("UPSERT_BATCH_BYTES", str(2 * 1000 * 1000)))
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", "4"))
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES", "3"))
+
+# Горячий слой памяти диалога: последние реплики пользователя в процессе (без запроса в Pinecone)
+HOT_TIER_TURNS = int(os.getenv("HOT_TIER_TURNS", "20"))
+HOT_TIER_ALWAYS = int(os.getenv("HOT_TIER_ALWAYS", "6"))
+HOT_TIER_MIN_SCORE = float(os.getenv("HOT_TIER_MIN_SCORE", "0.3"))
+HOT_TIER_MAX_BYTES = int(os.getenv("HOT_TIER_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Поиск контекста: отдельные подзапросы по диалогу и по документам и общий бюджет времени (сек)
+RETRIEVAL_DIALOG_TOP_K = int(os.getenv("RETRIEVAL_DIALOG_TOP_K", "5"))
+RETRIEVAL_DOCS_TOP_K = int(os.getenv("RETRIEVAL_DOCS_TOP_K", "10"))
+RETRIEVAL_BUDGET_SECONDS = float(os.getenv("RETRIEVAL_BUDGET_SECONDS", "3.0"))
+# Дедлайн ответа на сообщение (сек) и резерв под ответ без инструментов, если агент не уложился
+MESSAGE_DEADLINE_SECONDS = float(os.getenv("MESSAGE_DEADLINE_SECONDS", "12"))
+AGENT_FALLBACK_SECONDS = float(os.getenv("AGENT_FALLBACK_SECONDS", "4"))
+# Сколько брошенных по дедлайну запусков агента может работать в фоне; больше — сразу ответ без инструментов
+AGENT_MAX_ABANDONED = int(os.getenv("AGENT_MAX_ABANDONED", "8"))
+# Хеджирование эмбеддинга запроса и поиска: дубль после перцентиля латентности (до HEDGE_MIN_SAMPLES замеров —
+# после HEDGE_DEFAULT_DELAY сек), не больше HEDGE_MAX_RATIO дублей на вызов
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "1.0"))
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+# Сводка по хеджированию и промахам дедлайна в лог каждые N сообщений
+TAIL_STATS_EVERY = int(os.getenv("TAIL_STATS_EVERY", "100"))
 
 # Docling chunker tokenizer (модель из transformers: bert, gpt2 и т.д. Не sentence-transformers!)
 CHUNKER_TOKENIZER = os.getenv("CHUNKER_TOKENIZER", "bert-base-uncased")
 
+# Профиль конвертации Docling: auto | fast | balanced | full
+#   fast — без OCR и распознавания таблиц (PDF с текстовым слоем, DOCX/HTML/MD)
+#   balanced — таблицы (быстрый режим) + OCR только растровых областей (частично сканированные PDF)
+#   full — OCR всей страницы + точные таблицы (сканы, изображения)
+DOCLING_PROFILE = os.getenv("DOCLING_PROFILE", "auto")
+# Сколько страниц PDF (равномерно по документу) проверять на текстовый слой и пороги доли «текстовых» страниц
+DOCLING_PROBE_PAGES = int(os.getenv("DOCLING_PROBE_PAGES", "20"))
+DOCLING_FAST_TEXT_RATIO = float(os.getenv("DOCLING_FAST_TEXT_RATIO", "0.95"))
+DOCLING_FULL_TEXT_RATIO = float(os.getenv("DOCLING_FULL_TEXT_RATIO", "0.2"))
+# Бюджет памяти на одну конвертацию (МБ): конвертация идёт в отдельном процессе, при превышении
+# процесс убивается и файл конвертируется заново дешевле (батчи страниц, более лёгкий профиль).
+# 0 — без изоляции, в процессе бота (память только измеряется)
+DOCLING_MEMORY_BUDGET_MB = int(os.getenv("DOCLING_MEMORY_BUDGET_MB", "3072"))
+# Размер батча страниц PDF при повторной конвертации после превышения бюджета
+DOCLING_PAGE_BATCH = int(os.getenv("DOCLING_PAGE_BATCH", "20"))
+# Сколько изолированных процессов конвертации держать (каждый загружает свои модели)
+DOCLING_SANDBOXES = int(os.getenv("DOCLING_SANDBOXES", "2"))
+# Предельное время одной конвертации в изолированном процессе, секунды
+DOCLING_CONVERT_TIMEOUT = float(os.getenv("DOCLING_CONVERT_TIMEOUT", "900"))
+# Предельное время конвертации одного файла по всем попыткам (целиком, батчами, дешёвыми профилями), секунды
+DOCLING_FILE_TIMEOUT = float(os.getenv("DOCLING_FILE_TIMEOUT", "1800"))
+
 # Pinecone
 def _pinecone_api_key():
     return os.getenv("PINECONE_API_KEY") or os.getenv("PYNECONE_API_KEY")
 
-PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "tgdialog")
+# Индекс Pinecone создаётся под размерность; для нестандартной размерности по умолчанию — отдельный индекс
+# Векторы разных бэкендов несовместимы даже при одинаковой размерности — у локального свой индекс
+if EMBEDDING_BACKEND == "local":
+    _DEFAULT_INDEX = f"tgdialog-local-{EMBEDDING_DIM}"
+else:
+    _DEFAULT_INDEX = "tgdialog" if EMBEDDING_DIM == 1536 else f"tgdialog-{EMBEDDING_DIM}"
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME") or _DEFAULT_INDEX
 
 # Telegram
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Режим получения апдейтов: polling (один процесс) | webhook (HTTP-сервер + пул процессов-воркеров)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Публичный адрес для setWebhook (https://host[:port]); пусто — webhook в Telegram не регистрируется (офлайн-тесты)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
 
 # OpenAI (все запросы через прокси proxyapi.ru)
 # Приоритет: PROXY_API_KEY для прокси, затем OPENAI_API_KEY
@@ -28,6 +119,44 @@ OPENAI_API_KEY = os.getenv("PROXY_API_KEY") or os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 PROXY_BASE_URL = os.getenv("PROXY_BASE_URL", "https://openai.api.proxyapi.ru/v1")
 
+# Резюме файла (map-reduce): размер раздела, параллелизм и общий бюджет входных токенов
+SUMMARY_SECTION_CHARS = int(os.getenv("SUMMARY_SECTION_CHARS", "6000"))
+SUMMARY_PARALLELISM = int(os.getenv("SUMMARY_PARALLELISM", "8"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "60000"))
+SUMMARY_TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", "60"))
+
+# Загрузка файлов: лимит размера (проверяется до скачивания) и порог, до которого файл
+# конвертируется прямо из памяти; крупнее — скачивается потоком во временный файл
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+INMEMORY_MAX_BYTES = int(os.getenv("INMEMORY_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Пакетная загрузка (ZIP-архивы и альбомы Telegram)
+BULK_CONVERT_WORKERS = int(os.getenv("BULK_CONVERT_WORKERS", "4"))
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "100"))
+BULK_MAX_ARCHIVE_BYTES = int(os.getenv("BULK_MAX_ARCHIVE_BYTES", str(500 * 1024 * 1024)))
+# Сколько ждать следующих файлов альбома (media group) перед запуском обработки, сек
+BULK_MEDIA_GROUP_DELAY = float(os.getenv("BULK_MEDIA_GROUP_DELAY", "2.0"))
+
 # Paths
 ROOT_DIR = Path(__file__).resolve().parent
 WORK_LOG_PATH = ROOT_DIR / "WORK_LOG.txt"
+
+# Очередь задач индексации (SQLite) и воркеры ingest-worker
+JOB_DB_PATH = Path(os.getenv("JOB_DB_PATH", str(ROOT_DIR / "jobs.sqlite3")))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "900"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# Сколько воркеров запускать внутри процесса бота (0 — только отдельные ingest-worker)
+INGEST_INLINE_WORKERS = int(os.getenv("INGEST_INLINE_WORKERS", "1"))
+
+# Каталог проиндексированных файлов (SQLite) и квоты пользователя: файлов, байт загруженных файлов,
+# фрагментов в индексе (0 — без ограничения). Каталог описывает содержимое индекса, поэтому у каждого
+# индекса свой каталог: после смены индекса (бэкенд, размерность, имя) файлы индексируются заново.
+# catalog.sqlite3 — каталог исходного индекса tgdialog
+_DEFAULT_CATALOG = "catalog.sqlite3" if PINECONE_INDEX_NAME == "tgdialog" else f"catalog-{PINECONE_INDEX_NAME}.sqlite3"
+CATALOG_DB_PATH = Path(os.getenv("CATALOG_DB_PATH", str(ROOT_DIR / _DEFAULT_CATALOG)))
+USER_QUOTA_FILES = int(os.getenv("USER_QUOTA_FILES", "200"))
+USER_QUOTA_BYTES = int(os.getenv("USER_QUOTA_BYTES", str(200 * 1024 * 1024)))
+USER_QUOTA_CHUNKS = int(os.getenv("USER_QUOTA_CHUNKS", "50000"))
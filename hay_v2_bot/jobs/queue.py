@@ -0,0 +1,199 @@
+"""
+Персистентная очередь задач на SQLite.
+
+Задачу забирает воркер с арендой (lease): пока воркер жив, он продлевает аренду; если процесс
+упал или бот перезапустился, аренда истекает и задачу заберёт следующий воркер. Ошибки
+повторяются с экспоненциальной задержкой до max_attempts.
+"""
+
+import json
+import socket
+import sqlite3
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from hay_v2_bot.config import (
+    JOB_DB_PATH,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_BASE_SECONDS,
+    JOB_RETRY_MAX_SECONDS,
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_available ON jobs (status, available_at);
+"""
+
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def retry_delay(attempts: int, base: float = JOB_RETRY_BASE_SECONDS, cap: float = JOB_RETRY_MAX_SECONDS) -> float:
+    """Экспоненциальная задержка перед повтором: base, 2·base, 4·base … но не больше cap."""
+    return min(cap, base * (2 ** max(0, attempts - 1)))
+
+
+class JobQueue:
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = str(path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # Отдельное соединение на операцию: очередь используют разные потоки и процессы
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def enqueue(self, kind: str, payload: dict, max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO jobs (kind, payload, max_attempts, available_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), max_attempts, now, now),
+            )
+            return cur.lastrowid
+
+    def claim(self, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> dict | None:
+        """Забирает самую старую доступную задачу (новую, отложенную или с истёкшей арендой)."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Задачи, у которых истекла аренда после последней попытки, больше не выдаём
+                conn.execute(
+                    "UPDATE jobs SET status='failed', finished_at=?, last_error=COALESCE(last_error, 'lease expired') "
+                    "WHERE status='running' AND lease_expires < ? AND attempts >= max_attempts",
+                    (now, now),
+                )
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE (status='queued' AND available_at <= ?) "
+                    "OR (status='running' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status='running', lease_owner=?, lease_expires=?, attempts=attempts+1, "
+                    "started_at=COALESCE(started_at, ?) WHERE id=?",
+                    (worker_id, now + lease_seconds, now, row["id"]),
+                )
+                job = conn.execute("SELECT * FROM jobs WHERE id=?", (row["id"],)).fetchone()
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self._row_to_job(job)
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """Продлевает аренду; False — задачу уже забрал другой воркер."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires=? WHERE id=? AND lease_owner=? AND status='running'",
+                (time.time() + lease_seconds, job_id, worker_id),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status='done', finished_at=?, lease_expires=NULL WHERE id=? AND lease_owner=?",
+                (time.time(), job_id, worker_id),
+            )
+
+    def fail(self, job_id: int, worker_id: str, error: str, retryable: bool = True) -> dict:
+        """Помечает попытку неудачной. Возвращает {"retry": bool, "delay": сек}."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id=?", (job_id,)).fetchone()
+            if row is None:
+                return {"retry": False, "delay": 0.0}
+            if retryable and row["attempts"] < row["max_attempts"]:
+                delay = retry_delay(row["attempts"])
+                conn.execute(
+                    "UPDATE jobs SET status='queued', available_at=?, lease_owner=NULL, lease_expires=NULL, last_error=? "
+                    "WHERE id=? AND lease_owner=?",
+                    (now + delay, error[:2000], job_id, worker_id),
+                )
+                return {"retry": True, "delay": delay}
+            conn.execute(
+                "UPDATE jobs SET status='failed', finished_at=?, lease_expires=NULL, last_error=? WHERE id=? AND lease_owner=?",
+                (now, error[:2000], job_id, worker_id),
+            )
+            return {"retry": False, "delay": 0.0}
+
+    def pending_uploads(self, user_id: str) -> list[tuple[str, int | None]]:
+        """(имя, размер) файлов пользователя в незавершённых задачах: они ещё не в каталоге, но уже займут квоту."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT payload FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        out = []
+        for row in rows:
+            payload = json.loads(row["payload"])
+            if str(payload.get("user_id")) == str(user_id):
+                out.extend((ref["filename"], ref.get("file_size")) for ref in payload.get("files", []))
+        return out
+
+    def stats(self) -> dict:
+        """Глубина очереди по статусам и возраст задач (сек)."""
+        now = time.time()
+        with self._connect() as conn:
+            counts = {r["status"]: r["n"] for r in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+            queued = conn.execute(
+                "SELECT MIN(created_at) AS oldest, AVG(? - created_at) AS avg_age FROM jobs WHERE status='queued'", (now,)
+            ).fetchone()
+            running = conn.execute("SELECT MIN(started_at) AS oldest FROM jobs WHERE status='running'").fetchone()
+            recent = conn.execute(
+                "SELECT AVG(started_at - created_at) AS wait, AVG(finished_at - started_at) AS run FROM jobs "
+                "WHERE status='done' AND finished_at > ?",
+                (now - 3600,),
+            ).fetchone()
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_queued_age": now - queued["oldest"] if queued["oldest"] else 0.0,
+            "avg_queued_age": queued["avg_age"] or 0.0,
+            "oldest_running_age": now - running["oldest"] if running["oldest"] else 0.0,
+            "avg_wait_1h": recent["wait"] or 0.0,
+            "avg_run_1h": recent["run"] or 0.0,
+        }
+
+    def prune(self, older_than_seconds: float = 7 * 24 * 3600) -> int:
+        """Удаляет завершённые задачи старше заданного возраста."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - older_than_seconds,),
+            )
+            return cur.rowcount
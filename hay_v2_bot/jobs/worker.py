@@ -0,0 +1,269 @@
+"""
+Воркер индексации: забирает задачи из очереди, скачивает файлы из Telegram,
+прогоняет build_ingestion_pipeline (или пакетную индексацию) и резюме, пишет результат в чат.
+
+Отдельный процесс:  python hay_v2_bot/main.py ingest-worker
+Статистика очереди: python hay_v2_bot/main.py queue-stats
+"""
+
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+
+from hay_v2_bot.bot.bulk import ProgressMessage, extract_archive, is_archive, progress_text, short_error
+from hay_v2_bot.bot.downloads import UploadTooLarge, check_upload_size, fetch_telegram_file
+from hay_v2_bot.components import FileCatalog, PipelinedDocumentWriter, QuotaExceeded, delete_ids_batched, source_digest
+from hay_v2_bot.components.docling_loader import ConversionError
+from hay_v2_bot.config import BULK_MAX_ARCHIVE_BYTES, JOB_LEASE_SECONDS, JOB_POLL_INTERVAL
+from hay_v2_bot.jobs.queue import JobQueue, make_worker_id
+from hay_v2_bot.pipelines import (
+    ingestion_inputs,
+    build_file_summary,
+    build_section_summaries,
+    section_summary_documents,
+    run_bulk_ingestion,
+)
+
+
+def _progress(bot, payload: dict, text: str) -> ProgressMessage:
+    """Сообщение о прогрессе, отправленное обработчиком при постановке в очередь (или новое)."""
+    return ProgressMessage(bot, payload["chat_id"], text, message_id=payload.get("message_id"))
+
+
+def _catalog(runtime: dict) -> FileCatalog:
+    if runtime.get("catalog") is None:
+        runtime["catalog"] = FileCatalog()
+    return runtime["catalog"]
+
+
+def process_file_job(bot, runtime: dict, payload: dict, log) -> None:
+    chat_id, user_id = payload["chat_id"], payload["user_id"]
+    catalog = _catalog(runtime)
+    ref = payload["files"][0]
+    filename = ref["filename"]
+    progress = _progress(bot, payload, "Файл получен. Запускаю анализ и сохранение…")
+    progress.update("Анализирую и сохраняю файл. Это может занять немного времени…", force=True)
+    with fetch_telegram_file(bot, ref["file_id"], filename, ref.get("file_size")) as fetched:
+        log(f"[file] user_id={user_id} filename={filename} size={fetched.size} in_memory={fetched.in_memory}")
+        file_hash, _ = source_digest(fetched.source)
+        t0 = time.perf_counter()
+        # Чанки для резюме берём из выхода лоадера, а не перечитываем файл
+        result = runtime["ingestion_pipeline"].run(
+            ingestion_inputs(fetched.source, str(user_id), filename), include_outputs_from={"loader"}
+        )
+        index_seconds = time.perf_counter() - t0
+    stats = (result.get("commit") or {}).get("stats") or {}
+    write_stats = (result.get("writer") or {}).get("stats") or {}
+    log(
+        f"[file] user_id={user_id} filename={filename} chunks={stats.get('chunks')} written={stats.get('written')} "
+        f"deleted={stats.get('deleted')} embeddings_avoided={stats.get('embeddings_avoided')} upserts_avoided={stats.get('upserts_avoided')} "
+        f"upserts/s={write_stats.get('upserts_per_second', 0.0):.0f} overlap={write_stats.get('overlap_seconds', 0.0):.2f}s"
+    )
+    loaded = (result.get("loader") or {}).get("documents") or []
+    texts = [d.content for d in loaded if d.content]
+    catalog.update(
+        str(user_id),
+        filename,
+        file_hash=file_hash,
+        size_bytes=fetched.size,
+        text_bytes=sum(len(t.encode("utf-8")) for t in texts),
+        convert_seconds=loaded[0].meta.get("convert_seconds") if loaded else None,
+        index_seconds=index_seconds,
+    )
+    sections = build_section_summaries(texts, logger=log)
+    summary = build_file_summary(texts, section_summaries=sections)
+    section_docs = section_summary_documents(sections, str(user_id), filename)
+    PipelinedDocumentWriter(runtime["document_store"], embedder=runtime["doc_embedder"], logger=log).run(documents=section_docs)
+    stale = catalog.set_summary_ids(str(user_id), filename, [d.id for d in section_docs])
+    if stale:
+        delete_ids_batched(runtime["document_store"], stale)
+    progress.update("Готово. Я изучил этот файл, теперь можем его обсудить.", force=True)
+    bot.send_message(chat_id, summary)
+    log(f"[file] user_id={user_id} filename={filename} done, summary_len={len(summary)} sections={len(sections)}")
+
+
+def _unique_names(files: list[tuple]) -> list[tuple]:
+    """
+    Одинаковые имена в пакете (файлы альбома из разных папок, одноимённые файлы в разных архивах) получают префикс
+    с номером, как папки распаковки: иначе в каталоге и в квоте они перезаписали бы друг друга.
+    """
+    seen = set()
+    out = []
+    for n, (source, name) in enumerate(files, start=1):
+        unique = name
+        while unique in seen:
+            unique = f"{n:04d}_{unique}"
+        seen.add(unique)
+        out.append((source, unique))
+    return out
+
+
+def process_bundle_job(bot, runtime: dict, payload: dict, log) -> None:
+    """Пакет: несколько файлов (альбом) и/или архивы — распаковываются и индексируются вместе."""
+    chat_id, user_id = payload["chat_id"], payload["user_id"]
+    refs = payload["files"]
+    bundle_name = payload["bundle_name"]
+    progress = _progress(bot, payload, f"Получено файлов: {len(refs)}. Запускаю пакетную обработку…")
+    check_upload_size(sum(ref.get("file_size") or 0 for ref in refs), BULK_MAX_ARCHIVE_BYTES)
+    fetched_files = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="hayv2_bulk_") as tmp_dir:
+            files = []
+            # Размеры по позиции в files: имена внутри пакета могут совпадать
+            sizes = []
+            for n, ref in enumerate(refs, start=1):
+                filename = ref["filename"]
+                fetched = fetch_telegram_file(bot, ref["file_id"], filename, ref.get("file_size"))
+                fetched_files.append(fetched)
+                if is_archive(filename):
+                    unpack_dir = Path(tmp_dir) / f"{n:04d}_unpacked"
+                    unpack_dir.mkdir()
+                    archive = BytesIO(fetched.data) if fetched.in_memory else fetched.path
+                    extracted = extract_archive(archive, str(unpack_dir))
+                    files.extend(extracted)
+                    sizes.extend(os.path.getsize(path) for path, _ in extracted)
+                    fetched.cleanup()
+                else:
+                    files.append((fetched.source, filename))
+                    sizes.append(fetched.size)
+                progress.update(progress_text("download", n, len(refs)))
+            if not files:
+                progress.update("Не нашёл поддерживаемых файлов (PDF, DOCX, PPTX, HTML и др.).", force=True)
+                return
+            files = _unique_names(files)
+            # При постановке в очередь архив считался одним файлом своего размера; квота — по реальному содержимому
+            _catalog(runtime).check_quota_many(str(user_id), [(name, size) for (_, name), size in zip(files, sizes)])
+            result = run_bulk_ingestion(
+                files,
+                str(user_id),
+                runtime["document_store"],
+                runtime["doc_embedder"],
+                bundle_name=bundle_name,
+                manifest=_catalog(runtime),
+                progress=lambda stage, done, total: progress.update(progress_text(stage, done, total)),
+                logger=log,
+            )
+    finally:
+        for fetched in fetched_files:
+            fetched.cleanup()
+    failed_note = f"\nНе удалось обработать: {', '.join(result['failed'])}" if result["failed"] else ""
+    progress.update(
+        f"Готово: изучил {result['ok_files']} из {result['files']} файлов за {result['total_seconds']:.0f} с "
+        f"({result['files_per_minute']:.1f} файлов/мин).{failed_note}",
+        force=True,
+    )
+    bot.send_message(chat_id, result["summary"])
+
+
+def is_retryable(e: BaseException) -> bool:
+    """Слишком большой файл и файл, не влезающий в бюджет памяти даже после деградации, повторять бессмысленно."""
+    while e is not None:
+        if isinstance(e, (UploadTooLarge, QuotaExceeded)):
+            return False
+        if isinstance(e, ConversionError):
+            return e.retryable
+        # Pipeline.run оборачивает исключения компонентов
+        e = e.__cause__
+    return True
+
+
+JOB_HANDLERS = {
+    "file": process_file_job,
+    "bundle": process_bundle_job,
+}
+
+
+class IngestWorker:
+    """Цикл воркера: claim -> обработка (аренда продлевается в фоне) -> complete/fail с повтором."""
+
+    def __init__(self, bot, runtime: dict, queue: JobQueue, worker_id: str | None = None, lease_seconds: float = JOB_LEASE_SECONDS, logger=None):
+        self.bot = bot
+        self.runtime = runtime
+        self.queue = queue
+        self.worker_id = worker_id or make_worker_id()
+        self.lease_seconds = lease_seconds
+        self.log = logger or (lambda msg: None)
+
+    def _keep_lease(self, job_id: int, done: threading.Event):
+        while not done.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                self.log(f"[job] id={job_id} lease lost by {self.worker_id}")
+                return
+
+    def run_once(self) -> bool:
+        """Обрабатывает одну задачу; False — очередь пуста."""
+        job = self.queue.claim(self.worker_id, self.lease_seconds)
+        if job is None:
+            return False
+        job_id, payload = job["id"], job["payload"]
+        wait = time.time() - job["created_at"]
+        self.log(f"[job] id={job_id} kind={job['kind']} attempt={job['attempts']}/{job['max_attempts']} waited={wait:.1f}s worker={self.worker_id}")
+        done = threading.Event()
+        threading.Thread(target=self._keep_lease, args=(job_id, done), daemon=True).start()
+        t0 = time.perf_counter()
+        try:
+            JOB_HANDLERS[job["kind"]](self.bot, self.runtime, payload, self.log)
+            self.queue.complete(job_id, self.worker_id)
+            self.log(f"[job] id={job_id} done in {time.perf_counter() - t0:.1f}s")
+        except Exception as e:
+            outcome = self.queue.fail(job_id, self.worker_id, str(e), retryable=is_retryable(e))
+            self.log(f"[job] id={job_id} error: {e} retry={outcome['retry']} delay={outcome['delay']:.0f}s")
+            try:
+                if outcome["retry"]:
+                    text = f"Ошибка при обработке файла, повторю попытку через {outcome['delay']:.0f} с: {short_error(e)}"
+                else:
+                    text = f"Ошибка при обработке файла: {short_error(e)}"
+                _progress(self.bot, payload, text).update(text, force=True)
+            except Exception as notify_error:
+                self.log(f"[job] id={job_id} notify failed: {notify_error}")
+        finally:
+            done.set()
+        stats = self.queue.stats()
+        self.log(
+            f"[queue] queued={stats['queued']} running={stats['running']} failed={stats['failed']} "
+            f"oldest_queued_age={stats['oldest_queued_age']:.1f}s"
+        )
+        return True
+
+    def run_forever(self, stop: threading.Event | None = None, poll_interval: float = JOB_POLL_INTERVAL):
+        stop = stop or threading.Event()
+        self.log(f"[job] worker {self.worker_id} started")
+        while not stop.is_set():
+            try:
+                if not self.run_once():
+                    stop.wait(poll_interval)
+            except Exception as e:
+                # Сбой самой очереди (например, БД заблокирована) — не роняем воркер
+                self.log(f"[job] worker {self.worker_id} loop error: {e}")
+                stop.wait(poll_interval)
+
+
+def start_inline_workers(bot, runtime: dict, queue: JobQueue, count: int, logger=None) -> list[threading.Thread]:
+    """Воркеры внутри процесса бота: задачи переживают перезапуск, т.к. лежат в SQLite."""
+    threads = []
+    for i in range(count):
+        worker = IngestWorker(bot, runtime, queue, worker_id=f"{make_worker_id()}-inline{i}", logger=logger)
+        t = threading.Thread(target=worker.run_forever, name=f"ingest-inline-{i}", daemon=True)
+        t.start()
+        threads.append(t)
+    return threads
+
+
+def run_ingest_worker():
+    """Точка входа ingest-worker: отдельный процесс без агента и polling, только индексация."""
+    import telebot
+    from hay_v2_bot.bot.run import build_ingest_runtime, _log_work
+    from hay_v2_bot.config import TELEGRAM_BOT_TOKEN
+
+    runtime = build_ingest_runtime()
+    bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, threaded=False)
+    IngestWorker(bot, runtime, JobQueue(), logger=_log_work).run_forever()
+
+
+def print_queue_stats():
+    stats = JobQueue().stats()
+    for key, value in stats.items():
+        print(f"{key}\t{value:.1f}" if isinstance(value, float) else f"{key}\t{value}")
@@ -10,6 +10,12 @@ Haystack v2 Telegram-бот: RAG по документам (Docling + Pinecone),
 
   python hay_v2_bot/main.py
 
+Отдельный воркер индексации (можно запускать несколько копий; только на той же машине, где лежит JOB_DB_PATH —
+SQLite в режиме WAL не работает через сетевую файловую систему):
+
+  python hay_v2_bot/main.py ingest-worker
+  python hay_v2_bot/main.py queue-stats
+
 Требования: .env в корне Docling с TELEGRAM_BOT_TOKEN, PINECONE_API_KEY, OPENAI_API_KEY (или PROXY_API_KEY),
 PROXY_BASE_URL (по умолчанию https://openai.api.proxyapi.ru/v1).
 Логи пишутся в терминал и в hay_v2_bot/WORK_LOG.txt.
@@ -166,4 +172,12 @@ if str(root) not in sys.path:
 from hay_v2_bot.bot.run import run_bot
 
 if __name__ == "__main__":
-    run_bot()
+    command = sys.argv[1] if len(sys.argv) > 1 else "bot"
+    if command == "ingest-worker":
+        from hay_v2_bot.jobs.worker import run_ingest_worker
+        run_ingest_worker()
+    elif command == "queue-stats":
+        from hay_v2_bot.jobs.worker import print_queue_stats
+        print_queue_stats()
+    else:
+        run_bot()
@@ -1,12 +1,16 @@
-from .ingestion import build_ingestion_pipeline, get_document_texts_for_summary
+from .ingestion import build_ingestion_pipeline, ingestion_inputs
 from .generation import get_context_for_user
 from .agent_build import build_agent
-from .summary import build_file_summary
+from .bulk import run_bulk_ingestion
+from .summary import build_file_summary, build_section_summaries, section_summary_documents
 
 __all__ = [
     "build_ingestion_pipeline",
-    "get_document_texts_for_summary",
+    "ingestion_inputs",
     "get_context_for_user",
     "build_agent",
     "build_file_summary",
+    "build_section_summaries",
+    "section_summary_documents",
+    "run_bulk_ingestion",
 ]
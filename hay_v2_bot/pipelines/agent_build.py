@@ -4,7 +4,7 @@ from haystack.components.agents import Agent
 from haystack.components.generators.chat import OpenAIChatGenerator
 from haystack.utils import Secret
 
-from hay_v2_bot.components import dog_fact_tool, dog_image_tool
+from hay_v2_bot.components import dog_fact_tool, dog_image_tool, document_structure_tool
 from hay_v2_bot.config import OPENAI_MODEL, PROXY_BASE_URL, OPENAI_API_KEY
 
 
@@ -18,9 +18,12 @@ def build_agent():
     )
     return Agent(
         chat_generator=generator,
-        tools=[dog_fact_tool, dog_image_tool],
+        tools=[dog_fact_tool, dog_image_tool, document_structure_tool],
+        # user_id передаётся в agent.run и подставляется в document_structure: модель видит только документы своего пользователя
+        state_schema={"user_id": {"type": str}},
         system_prompt="""Ты — умный персональный помощник в Telegram. Ведёшь диалог естественно и учитываешь контекст предыдущих сообщений и загруженных пользователем документов.
 Используй инструменты dog_fact и dog_image_describe по запросу (факты о собаках, картинки собак, описание пород).
+На вопросы о конкретном разделе, таблице, странице или оглавлении загруженного документа отвечай через document_structure, а не по фрагментам контекста.
 Отвечай кратко, по-русски, дружелюбно. Если передан контекст (диалог или фрагменты документов) — опирайся на него.""",
         exit_conditions=["text"],
         max_agent_steps=10,
@@ -0,0 +1,155 @@
+"""
+Пакетная индексация нескольких файлов: параллельная конвертация Docling,
+общие батчи эмбеддингов и одна запись в хранилище на весь пакет, одно общее резюме.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from haystack import Document
+
+from hay_v2_bot.components import (
+    ChunkManifest,
+    ChunkDeltaFilter,
+    ChunkDeltaCommitter,
+    FileCatalog,
+    OutlineStore,
+    PipelinedDocumentWriter,
+    bundle_key,
+    delete_ids_batched,
+    source_digest,
+)
+from hay_v2_bot.components.docling_loader import docling_path_to_documents
+from hay_v2_bot.config import BULK_CONVERT_WORKERS
+from hay_v2_bot.pipelines.summary import build_file_summary, build_section_summaries, section_summary_documents
+
+
+def run_bulk_ingestion(
+    files: list[tuple[str, str]],
+    user_id: str,
+    document_store,
+    doc_embedder,
+    bundle_name: str,
+    manifest: ChunkManifest | None = None,
+    max_workers: int = BULK_CONVERT_WORKERS,
+    progress=None,
+    logger=None,
+) -> dict:
+    """
+    files — список (источник, имя файла); источник — путь или DocumentStream. progress(stage, done, total) вызывается по ходу работы.
+    Возвращает статистику пакета и общее резюме.
+    """
+    log = logger or (lambda msg: None)
+    report = progress or (lambda stage, done, total: None)
+    manifest = manifest or FileCatalog()
+    delta_filter = ChunkDeltaFilter(manifest=manifest)
+    committer = ChunkDeltaCommitter(document_store=document_store, manifest=manifest)
+    writer = PipelinedDocumentWriter(document_store=document_store, embedder=doc_embedder, logger=log)
+    outline_store = OutlineStore()
+    t0 = time.perf_counter()
+
+    # 1. Конвертация параллельно (не больше max_workers файлов одновременно)
+    converted: dict[int, list[Document]] = {}
+    failed: list[str] = []
+    report("convert", 0, len(files))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as pool:
+        futures = {
+            pool.submit(docling_path_to_documents, source, str(user_id), filename, outline_store=outline_store): i
+            for i, (source, filename) in enumerate(files)
+        }
+        for n, fut in enumerate(as_completed(futures), start=1):
+            i = futures[fut]
+            filename = files[i][1]
+            try:
+                docs = fut.result()
+            except Exception as e:
+                log(f"[bulk] user_id={user_id} filename={filename} convert error: {e}")
+                docs = []
+            if docs:
+                converted[i] = docs
+            else:
+                failed.append(filename)
+            report("convert", n, len(files))
+    t_convert = time.perf_counter()
+
+    # 2. Дельта по каждому файлу, затем общие батчи эмбеддингов и запись на весь пакет (параллельно с эмбеддингом)
+    deltas = []
+    fresh: list[Document] = []
+    texts: list[str] = []
+    for i in sorted(converted):
+        filename = files[i][1]
+        out = delta_filter.run(documents=converted[i], user_id=str(user_id), filename=filename)
+        deltas.append(out["delta"])
+        fresh.extend(out["documents"])
+        texts.extend(d.content for d in converted[i] if d.content)
+    report("embed", 0, len(fresh))
+    write = writer.run(documents=fresh)
+    report("embed", write["documents_written"], len(fresh))
+    t_index = time.perf_counter()
+
+    stats = {
+        "chunks": 0,
+        "written": write["documents_written"],
+        "deleted": 0,
+        "embeddings_avoided": 0,
+        "upserts_per_second": write["stats"].get("upserts_per_second", 0.0),
+    }
+    for delta in deltas:
+        file_stats = committer.run(documents_written=delta["new"], delta=delta)["stats"]
+        stats["chunks"] += file_stats["chunks"]
+        stats["deleted"] += file_stats["deleted"]
+        stats["embeddings_avoided"] += file_stats["embeddings_avoided"]
+    if isinstance(manifest, FileCatalog):
+        for i in sorted(converted):
+            source, filename = files[i]
+            try:
+                file_hash, size = source_digest(source)
+            except Exception:
+                file_hash, size = None, None
+            manifest.update(
+                str(user_id),
+                filename,
+                file_hash=file_hash,
+                size_bytes=size,
+                text_bytes=sum(len((d.content or "").encode("utf-8")) for d in converted[i]),
+                convert_seconds=converted[i][0].meta.get("convert_seconds"),
+                index_seconds=t_index - t_convert,
+            )
+
+    # 3. Одно общее резюме по всем файлам пакета (map-reduce по разделам)
+    report("summary", 0, 1)
+    sections = build_section_summaries(texts, logger=log)
+    summary = build_file_summary(texts, section_summaries=sections)
+    # Ключ пакета отдельный от имён файлов: ID резюме и строка каталога не совпадут с файлом того же имени
+    key = bundle_key(bundle_name)
+    section_docs = section_summary_documents(sections, str(user_id), key)
+    writer.run(documents=section_docs)
+    if isinstance(manifest, FileCatalog):
+        members = [files[i][1] for i in sorted(converted)]
+        stale = manifest.set_summary_ids(str(user_id), key, [d.id for d in section_docs], kind="bundle", members=members)
+        if stale:
+            delete_ids_batched(document_store, stale)
+    report("summary", 1, 1)
+    t_end = time.perf_counter()
+
+    elapsed = t_end - t0
+    ok_files = len(files) - len(failed)
+    result = {
+        **stats,
+        "files": len(files),
+        "ok_files": ok_files,
+        "failed": failed,
+        "summary": summary,
+        "convert_seconds": t_convert - t0,
+        "index_seconds": t_index - t_convert,
+        "total_seconds": elapsed,
+        "files_per_minute": ok_files / elapsed * 60 if elapsed > 0 else 0.0,
+    }
+    log(
+        f"[bulk] user_id={user_id} bundle={bundle_name} files={len(files)} ok={ok_files} failed={len(failed)} "
+        f"chunks={stats['chunks']} written={result['written']} embeddings_avoided={stats['embeddings_avoided']} "
+        f"upserts/s={stats['upserts_per_second']:.0f} "
+        f"convert={result['convert_seconds']:.1f}s index={result['index_seconds']:.1f}s total={elapsed:.1f}s "
+        f"throughput={result['files_per_minute']:.1f} files/min"
+    )
+    return result
@@ -1,17 +1,110 @@
+"""
+Поиск контекста для ответа: два параллельных подзапроса в Pinecone — по репликам диалога
+(meta.timestamp) и по документам (meta.chunk_index / section_index) — со своими top_k и фильтрами
+и общим бюджетом времени. Если одна сторона не уложилась, используется то, что успело прийти.
+С hedger медленный подзапрос дублируется (поиск идемпотентен).
+"""
+
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait
+
 from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
 
+from hay_v2_bot.components import Hedger, RecentDialogCache
+from hay_v2_bot.config import RETRIEVAL_DIALOG_TOP_K, RETRIEVAL_DOCS_TOP_K, RETRIEVAL_BUDGET_SECONDS
+
+# Общий пул: не создаём потоки на каждое сообщение
+_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="retrieve")
+
+
+def dialog_filters(user_id: str, before: float | None = None) -> dict:
+    """Реплики диалога пользователя; before — только старше этого времени (новее лежат в горячем слое)."""
+    return {
+        "operator": "AND",
+        "conditions": [
+            {"field": "user_id", "operator": "==", "value": str(user_id)},
+            {"field": "timestamp", "operator": "<", "value": before} if before is not None
+            else {"field": "timestamp", "operator": ">", "value": 0},
+        ],
+    }
+
+
+def document_filters(user_id: str) -> dict:
+    """Чанки загруженных файлов и резюме их разделов."""
+    return {
+        "operator": "AND",
+        "conditions": [
+            {"field": "user_id", "operator": "==", "value": str(user_id)},
+            {
+                "operator": "OR",
+                "conditions": [
+                    {"field": "chunk_index", "operator": ">=", "value": 0},
+                    {"field": "section_index", "operator": ">=", "value": 0},
+                ],
+            },
+        ],
+    }
 
-def get_context_for_user(retriever: PineconeEmbeddingRetriever, user_id: str, query_embedding: list, top_k: int = 15, logger=None):
-    """Достаёт релевантный контекст (диалог + чанки документов) по user_id и эмбеддингу запроса."""
+
+def _timed_query(retriever, query_embedding, filters: dict, top_k: int, hedger: Hedger | None = None, budget: float = 0.0) -> tuple[list, float]:
+    t0 = time.perf_counter()
+    query = partial(retriever.run, query_embedding=query_embedding, filters=filters, top_k=top_k)
+    docs = hedger.call("retrieve", query, timeout=budget) if hedger else query()
+    return docs.get("documents") or [], time.perf_counter() - t0
+
+
+def get_context_for_user(
+    retriever: PineconeEmbeddingRetriever,
+    user_id: str,
+    query_embedding: list,
+    dialog_top_k: int = RETRIEVAL_DIALOG_TOP_K,
+    docs_top_k: int = RETRIEVAL_DOCS_TOP_K,
+    budget: float = RETRIEVAL_BUDGET_SECONDS,
+    logger=None,
+    hot_cache: RecentDialogCache | None = None,
+    hedger: Hedger | None = None,
+):
+    """
+    Достаёт релевантный контекст (диалог + чанки документов) по user_id и эмбеддингу запроса.
+
+    Если передан hot_cache, недавние реплики берутся из памяти процесса, а подзапрос по диалогу
+    ищет только более старую историю.
+    """
     if logger:
         logger(f"[retrieve] user_id={user_id} query_embedding present: {query_embedding is not None}")
     if query_embedding is None:
         return ""
-    filters = {"field": "user_id", "operator": "==", "value": str(user_id)}
-    docs = retriever.run(query_embedding=query_embedding, filters=filters, top_k=top_k)
-    documents = docs.get("documents") or []
+    recent = hot_cache.context_turns(user_id, query_embedding) if hot_cache else []
+    cutoff = hot_cache.oldest_timestamp(user_id) if hot_cache else None
+
+    t0 = time.perf_counter()
+    futures = {}
+    if dialog_top_k > 0:
+        futures["dialog"] = _pool.submit(
+            _timed_query, retriever, query_embedding, dialog_filters(user_id, cutoff), dialog_top_k, hedger, budget
+        )
+    if docs_top_k > 0:
+        futures["docs"] = _pool.submit(_timed_query, retriever, query_embedding, document_filters(user_id), docs_top_k, hedger, budget)
+    wait(futures.values(), timeout=budget)
+
+    results, report = {}, []
+    for side, fut in futures.items():
+        if not fut.done():
+            report.append(f"{side}=timeout>{budget:.1f}s")
+            continue
+        try:
+            docs, seconds = fut.result()
+        except Exception as e:
+            report.append(f"{side}=error({e})")
+            continue
+        results[side] = docs
+        report.append(f"{side}={len(docs)} hits in {seconds:.2f}s")
     if logger:
-        logger(f"[retrieve] user_id={user_id} found {len(documents)} docs (top_k={top_k})")
-    if not documents:
+        logger(f"[retrieve] user_id={user_id} {' '.join(report)} hot_turns={len(recent)} total={time.perf_counter() - t0:.2f}s")
+
+    dialog = sorted(results.get("dialog", []), key=lambda d: d.meta.get("timestamp", 0))
+    parts = [d.content for d in results.get("docs", [])] + [d.content for d in dialog] + recent
+    if not parts:
         return ""
-    return "\n".join(d.content for d in documents)
+    return "\n".join(parts)
@@ -1,24 +1,158 @@
-import os
+"""
+Резюме файла в стиле map-reduce: чанки документа группируются в разделы,
+разделы резюмируются параллельно, затем сводятся в одно предложение.
+"""
 
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from haystack import Document
 from openai import OpenAI
 
-from hay_v2_bot.config import OPENAI_MODEL, OPENAI_API_KEY, PROXY_BASE_URL
+from hay_v2_bot.components.chunk_delta import chunk_id
+from hay_v2_bot.config import (
+    OPENAI_MODEL,
+    OPENAI_API_KEY,
+    PROXY_BASE_URL,
+    SUMMARY_SECTION_CHARS,
+    SUMMARY_PARALLELISM,
+    SUMMARY_TOKEN_BUDGET,
+    SUMMARY_TIMEOUT,
+)
 
+# Грубая оценка: ~4 символа на токен (для бюджета достаточно)
+_CHARS_PER_TOKEN = 4
 
-def build_file_summary(texts: list[str], max_chars: int = 10000) -> str:
-    """Генерирует одно предложение — резюме содержимого документа."""
-    if not texts:
-        return "Документ не содержит текста."
-    combined = "\n\n".join(texts)[:max_chars]
-    client = OpenAI(api_key=OPENAI_API_KEY, base_url=PROXY_BASE_URL)
+
+def _client() -> OpenAI:
+    return OpenAI(api_key=OPENAI_API_KEY, base_url=PROXY_BASE_URL, timeout=SUMMARY_TIMEOUT, max_retries=1)
+
+
+def _chat(client: OpenAI, prompt: str, max_tokens: int) -> str:
     resp = client.chat.completions.create(
         model=OPENAI_MODEL,
-        messages=[
-            {
-                "role": "user",
-                "content": f"Кратко резюмируй содержимое документа в одном предложении на русском. Только одно предложение.\n\nТекст:\n{combined}",
-            }
-        ],
-        max_tokens=150,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
     )
-    return (resp.choices[0].message.content or "Резюме недоступно.").strip()
+    return (resp.choices[0].message.content or "").strip()
+
+
+def _sample_chunks(chunks: list[str], cap: int) -> str:
+    """
+    Текст раздела не длиннее cap: если чанки целиком не помещаются, берутся чанки, равномерно
+    разнесённые по разделу (первый и последний включительно), каждый — поровну из cap.
+    """
+    joined = "\n\n".join(chunks)
+    if len(joined) <= cap:
+        return joined
+    avg = max(1, len(joined) // len(chunks))
+    k = min(len(chunks), max(1, cap // avg))
+    if k == 1:
+        picked = [chunks[len(chunks) // 2]]
+    else:
+        step = (len(chunks) - 1) / (k - 1)
+        picked = [chunks[i] for i in sorted({round(j * step) for j in range(k)})]
+    share = max(1, cap // len(picked) - 2)
+    return "\n\n".join(c[:share] for c in picked)[:cap]
+
+
+def split_into_sections(
+    texts: list[str],
+    section_chars: int = SUMMARY_SECTION_CHARS,
+    token_budget: int = SUMMARY_TOKEN_BUDGET,
+    logger=None,
+) -> list[str]:
+    """
+    Делит тексты чанков на последовательные разделы по ~section_chars символов.
+    Если документ не помещается в бюджет токенов, число разделов ограничивается, а из каждого раздела
+    берутся чанки равномерно по всей его длине (а не начало раздела) — так резюме покрывает весь документ.
+    """
+    texts = [t.strip() for t in texts if t and t.strip()]
+    if not texts:
+        return []
+    total = sum(len(t) for t in texts)
+    budget_chars = max(section_chars, token_budget * _CHARS_PER_TOKEN)
+    max_sections = max(1, budget_chars // section_chars)
+    n_sections = min(max_sections, max(1, math.ceil(total / section_chars)))
+    target = math.ceil(total / n_sections)
+    per_section_cap = min(section_chars, budget_chars // n_sections)
+
+    groups = []
+    current = []
+    current_len = 0
+    for t in texts:
+        current.append(t)
+        current_len += len(t)
+        if current_len >= target and len(groups) < n_sections - 1:
+            groups.append(current)
+            current, current_len = [], 0
+    if current:
+        groups.append(current)
+    sections = [_sample_chunks(group, per_section_cap) for group in groups]
+    kept = sum(len(s) for s in sections)
+    if logger and kept < total:
+        logger(f"[summary] text reduced to fit budget: {total} -> {kept} chars, sections={len(sections)} (chunks sampled across each section)")
+    return sections
+
+
+def build_section_summaries(texts: list[str], parallelism: int = SUMMARY_PARALLELISM, logger=None) -> list[str]:
+    """Map-стадия: параллельно резюмирует каждый раздел документа (2–3 предложения на раздел)."""
+    sections = split_into_sections(texts, logger=logger)
+    if len(sections) <= 1:
+        return []
+    client = _client()
+
+    def _summarize(section: str) -> str:
+        try:
+            return _chat(
+                client,
+                f"Кратко перескажи этот фрагмент документа в 2–3 предложениях на русском. Только факты из текста.\n\nТекст:\n{section}",
+                max_tokens=200,
+            )
+        except Exception as e:
+            if logger:
+                logger(f"[summary] section failed: {e}")
+            return ""
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(sections)))) as pool:
+        summaries = list(pool.map(_summarize, sections))
+    if logger:
+        ok = sum(1 for s in summaries if s)
+        logger(f"[summary] sections={len(sections)} ok={ok} parallelism={parallelism}")
+    return summaries
+
+
+def build_file_summary(texts: list[str], section_summaries: list[str] | None = None, max_chars: int = 10000) -> str:
+    """Генерирует одно предложение — резюме содержимого документа.
+
+    Если переданы резюме разделов (map-стадия), сводит их (reduce); иначе резюмирует текст напрямую.
+    """
+    if not texts:
+        return "Документ не содержит текста."
+    parts = [s for s in (section_summaries or []) if s]
+    if parts:
+        combined = "\n".join(f"{i + 1}. {s}" for i, s in enumerate(parts))[:max_chars]
+        prompt = f"Ниже пересказы разделов одного документа по порядку. Кратко резюмируй весь документ в одном предложении на русском. Только одно предложение.\n\nРазделы:\n{combined}"
+    else:
+        combined = "\n\n".join(texts)[:max_chars]
+        prompt = f"Кратко резюмируй содержимое документа в одном предложении на русском. Только одно предложение.\n\nТекст:\n{combined}"
+    return _chat(_client(), prompt, max_tokens=150) or "Резюме недоступно."
+
+
+def section_summary_documents(section_summaries: list[str], user_id: str, filename: str) -> list[Document]:
+    """Резюме разделов как Haystack Document — их можно эмбеддить и находить при последующих вопросах.
+
+    ID детерминирован по номеру раздела: при повторной загрузке файла резюме перезаписываются, а не дублируются.
+    """
+    out = []
+    for i, s in enumerate(section_summaries):
+        if not s:
+            continue
+        out.append(
+            Document(
+                id=chunk_id(user_id, filename, f"section_summary:{i}"),
+                content=f"Резюме раздела {i + 1} файла {filename}: {s}",
+                meta={"user_id": str(user_id), "filename": filename, "section_index": i, "kind": "section_summary"},
+            )
+        )
+    return out